@@ -10,12 +10,18 @@ import argparse
 from database_manager import DatabaseManager
 from project_analyzer import ProjectAnalyzer
 from snapshot_manager import SnapshotManager
+from snapshot_archive import DEFAULT_CODEC, available_codecs
+from snapshot_store import FILTER_PROFILES
+from search_manager import SearchManager, build_search_query
+from search_export import EXPORT_FORMATS, open_result_writer, export_query
+from search_recipes_manager import SearchRecipesManager
 
 class ConsoleManager:
     def __init__(self):
         self.db_manager = DatabaseManager()
         self.analyzer = ProjectAnalyzer()
         self.snapshot_manager = SnapshotManager(self.db_manager)
+        self.search_manager = SearchManager()
     
     def create_flutter_project(self, project_path, project_name):
         """Create a minimal Flutter project"""
@@ -216,6 +222,77 @@ app.*.map.json
                 stats = item['stats']
                 print(f"{prefix}{name} ({stats['lines']} lines, {stats['characters']} chars)")
     
+    def search(self, search_path, query, export_format='grep', output='-', file_patterns=None,
+               case_sensitive=False, use_regex=False, filename_only=False, max_files=None,
+               all_projects=False):
+        """Search files and stream results to a file or stdout"""
+        if all_projects:
+            # Every project from directory history is searched concurrently
+            search_paths = [entry['directory_path'] for entry in self.db_manager.get_directory_history(limit=20)]
+            if search_path:
+                search_paths.append(search_path)
+            if not search_paths:
+                print("❌ Error: Directory history is empty", file=sys.stderr)
+                return False
+        elif not os.path.exists(search_path):
+            print(f"❌ Error: Directory {search_path} does not exist", file=sys.stderr)
+            return False
+        else:
+            search_paths = [search_path]
+        
+        compiled_query = build_search_query(query, file_patterns, case_sensitive=case_sensitive,
+                                            use_regex=use_regex, filename_only=filename_only)
+        if compiled_query.error:
+            print(f"❌ Error: Invalid regular expression: {compiled_query.error}", file=sys.stderr)
+            return False
+        
+        try:
+            # Results are written as they are found, nothing is kept in memory
+            with open_result_writer(output, export_format) as writer:
+                export_query(self.search_manager, search_paths, compiled_query, writer,
+                             multi_root=all_projects, max_files=max_files)
+        except Exception as e:
+            print(f"❌ Error during search: {str(e)}", file=sys.stderr)
+            return False
+        
+        if output != '-':
+            print(f"✓ {writer.files_written} files, {writer.matches_written} matches written to {output}")
+        if self.search_manager.search_truncated:
+            print(f"ℹ️ Search stopped by limit: {self.search_manager.search_truncated}", file=sys.stderr)
+        return True
+    
+    def run_recipes(self, search_paths, export_format='grep', output='-'):
+        """Run all saved search recipes over several projects in a single pass"""
+        missing = [path for path in search_paths if not os.path.exists(path)]
+        if missing:
+            print(f"❌ Error: Directory {missing[0]} does not exist", file=sys.stderr)
+            return False
+        
+        recipes_manager = SearchRecipesManager(self.db_manager)
+        if not recipes_manager.get_recipes():
+            print("📋 No search recipes found", file=sys.stderr)
+            return False
+        
+        print(f"🔍 Running {len(recipes_manager.get_recipes())} recipes over {len(search_paths)} directories...",
+              file=sys.stderr)
+        batch = recipes_manager.run_recipes(self.search_manager, search_paths)
+        
+        try:
+            with open_result_writer(output, export_format) as writer:
+                for entry in batch:
+                    for result in entry['results']:
+                        writer.write(result)
+        except Exception as e:
+            print(f"❌ Error writing results: {str(e)}", file=sys.stderr)
+            return False
+        
+        print("\n📋 Recipe Results:", file=sys.stderr)
+        for entry in batch:
+            matches = sum(len(result['text_matches']) for result in entry['results'])
+            print(f"   {entry['recipe']['name']}: {len(entry['results'])} files, {matches} matches",
+                  file=sys.stderr)
+        return True
+    
     def create_snapshot(self, source_path):
         """Create snapshot of directory"""
         if not os.path.exists(source_path):
@@ -229,19 +306,75 @@ app.*.map.json
         
         description = input("Enter description (optional): ").strip()
         
-        compress_input = input("Compress snapshot? (y/n, default: y): ").strip().lower()
-        compress = compress_input != 'n'
+        storage = input("Storage (zip/copy/dedup, default: zip): ").strip().lower() or 'zip'
+        if storage not in ('zip', 'copy', 'dedup'):
+            print("❌ Error: Unknown storage mode")
+            return False
+        
+        codec = None
+        if storage == 'zip':
+            codecs = available_codecs()
+            codec = input(f"Archive format ({'/'.join(codecs)}, default: {DEFAULT_CODEC}): ").strip() or DEFAULT_CODEC
+            if codec not in codecs:
+                print("❌ Error: Unknown archive format")
+                return False
+        
+        filter_profile = input("Content (sources/sources_assets/full, default: sources_assets): ").strip() or 'sources_assets'
+        if filter_profile not in FILTER_PROFILES:
+            print("❌ Error: Unknown filter profile")
+            return False
+        
+        parent = None
+        if storage == 'dedup':
+            latest = self.snapshot_manager.find_latest_snapshot(source_path)
+            if latest:
+                incremental = input(f"Incremental from '{latest['name']}'? (y/n, default: y): ").strip().lower()
+                if incremental != 'n':
+                    parent = latest['id']
         
         print(f"🔄 Creating snapshot '{name}'...")
-        result = self.snapshot_manager.create_snapshot(source_path, name, description, compress)
+        result = self.snapshot_manager.create_snapshot(source_path, name, description,
+                                                       storage == 'zip', storage, parent, codec=codec,
+                                                       filter_profile=filter_profile)
         
         if result:
             print(f"✓ Snapshot created successfully: {result}")
+            stats = self.snapshot_manager.last_snapshot_stats
+            if storage == 'dedup' and stats:
+                print(f"   Files: {stats['files']} ({stats['unchanged']} unchanged), "
+                      f"new objects: {stats['new_objects']}, "
+                      f"written: {stats['bytes_written']} of {stats['bytes_total']} bytes")
             return True
         else:
             print("❌ Error creating snapshot")
             return False
     
+    def benchmark_codecs(self, source_path, codecs=None):
+        """Benchmark snapshot codecs on a project"""
+        if not os.path.exists(source_path):
+            print(f"❌ Error: Directory {source_path} does not exist")
+            return False
+        
+        print(f"⏱️ Benchmarking snapshot codecs on {source_path}...")
+        try:
+            results = self.snapshot_manager.benchmark_codecs(source_path, codecs)
+        except Exception as e:
+            print(f"❌ Error during benchmark: {str(e)}")
+            return False
+        
+        if not results:
+            return True
+        original_mb = results[0]['original_size'] / (1024 * 1024)
+        print(f"\n📊 Project size: {original_mb:.1f} MB")
+        print(f"{'Codec':<12} {'Size MB':>9} {'Ratio':>7} {'Create s':>9} {'MB/s':>8} {'Restore s':>10} {'MB/s':>8}")
+        print("-" * 70)
+        for r in results:
+            create_speed = original_mb / r['create_seconds'] if r['create_seconds'] else 0
+            restore_speed = original_mb / r['restore_seconds'] if r['restore_seconds'] else 0
+            print(f"{r['codec']:<12} {r['archive_size'] / (1024 * 1024):>9.2f} {r['ratio']:>7.2f} "
+                  f"{r['create_seconds']:>9.2f} {create_speed:>8.1f} {r['restore_seconds']:>10.2f} {restore_speed:>8.1f}")
+        return True
+    
     def list_snapshots(self):
         """List all available snapshots"""
         snapshots = self.snapshot_manager.list_snapshots()
@@ -259,9 +392,81 @@ app.*.map.json
             print(f"    Description: {snap['description'] or 'No description'}")
             print(f"    Created: {snap['created_date']}")
             print(f"    Compressed: {compressed_text}")
+            print(f"    Storage: {snap['storage']}" + (f" ({snap['codec']})" if snap['codec'] else ""))
+            print(f"    Content: {snap['filter_profile']}")
             print(f"    Path: {snap['directory_path']}")
+            if snap['last_verified']:
+                print(f"    Verified: {snap['verify_status']} ({snap['last_verified']})")
             print("-" * 40)
     
+    def verify_snapshots(self, max_rate_mb=None):
+        """Verify integrity of all snapshots"""
+        snapshots = self.snapshot_manager.list_snapshots()
+        if not snapshots:
+            print("📦 No snapshots found")
+            return True
+        
+        max_bytes_per_second = int(max_rate_mb * 1024 * 1024) if max_rate_mb else None
+        print(f"🔎 Verifying {len(snapshots)} snapshot(s)...")
+        results = self.snapshot_manager.verify_snapshots(max_bytes_per_second=max_bytes_per_second)
+        
+        failed = 0
+        for snap in snapshots:
+            result = results.get(snap['id'])
+            if result is None:
+                continue
+            icon = "✓" if result['status'] == 'ok' else "❌"
+            print(f"{icon} {snap['name']}: {result['status']} "
+                  f"({result['files_checked']} files, {result['bytes_checked'] / (1024 * 1024):.1f} MB)")
+            for problem in result['problems']:
+                print(f"     {problem}")
+            if result['status'] != 'ok':
+                failed += 1
+        
+        print(f"\n{len(results) - failed} of {len(results)} snapshot(s) are intact")
+        return failed == 0
+    
+    def snapshot_space(self):
+        """Show logical and physical snapshot sizes"""
+        report = self.snapshot_manager.get_space_report()
+        if not report['snapshots']:
+            print("📦 No snapshots found")
+            return True
+        
+        mb = 1024 * 1024
+        print("💾 Snapshot space usage:")
+        print(f"{'Id':>4} {'Name':<30} {'Storage':<8} {'Logical MB':>11} {'Physical MB':>12} {'Shared MB':>10}")
+        print("-" * 80)
+        for item in report['snapshots']:
+            name = item['name'] + (" (missing)" if item['missing'] else "")
+            print(f"{item['id']:>4} {name[:30]:<30} {item['storage']:<8} {item['logical_bytes'] / mb:>11.2f} "
+                  f"{item['physical_bytes'] / mb:>12.2f} {item['shared_bytes'] / mb:>10.2f}")
+        print("-" * 80)
+        print(f"Logical total: {report['logical_bytes'] / mb:.2f} MB")
+        print(f"Physical total: {report['physical_bytes'] / mb:.2f} MB "
+              f"(object store {report['store_bytes'] / mb:.2f} MB, unreferenced {report['garbage_bytes'] / mb:.2f} MB, "
+              f"without a record {report['orphaned_bytes'] / mb:.2f} MB)")
+        return True
+    
+    def prune_snapshots(self, keep_last=None, keep_daily=None, keep_weekly=None, max_size_mb=None,
+                        source_path=None, dry_run=False):
+        """Apply a retention policy and remove unreferenced objects"""
+        max_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None
+        try:
+            result = self.snapshot_manager.apply_retention(keep_last, keep_daily, keep_weekly, max_bytes,
+                                                           source_path, dry_run)
+        except Exception as e:
+            print(f"❌ Error pruning snapshots: {str(e)}")
+            return False
+        
+        action = "Would delete" if dry_run else "Deleted"
+        print(f"🧹 {action} {len(result['deleted'])} snapshot(s), kept {len(result['kept'])}")
+        for snapshot_id in result['deleted']:
+            snapshot = self.snapshot_manager.get_snapshot(snapshot_id) if dry_run else None
+            print(f"   - #{snapshot_id}" + (f" {snapshot['name']}" if snapshot else ""))
+        print(f"   Space {'to free' if dry_run else 'freed'}: {result['bytes_freed'] / (1024 * 1024):.2f} MB")
+        return True
+    
     def restore_snapshot(self):
         """Restore snapshot to directory"""
         snapshots = self.snapshot_manager.list_snapshots()
@@ -302,6 +507,53 @@ app.*.map.json
             print("❌ Error restoring snapshot")
             return False
     
+    def compare_snapshots(self):
+        """Compare two snapshots by their manifests"""
+        snapshots = self.snapshot_manager.list_snapshots()
+        
+        if len(snapshots) < 2:
+            print("📦 At least two snapshots are needed for comparison")
+            return False
+        
+        self.list_snapshots()
+        
+        try:
+            first = int(input("Enter first (older) snapshot number: ")) - 1
+            second = int(input("Enter second (newer) snapshot number: ")) - 1
+            if not (0 <= first < len(snapshots) and 0 <= second < len(snapshots)):
+                print("❌ Invalid snapshot number")
+                return False
+        except ValueError:
+            print("❌ Invalid input")
+            return False
+        
+        comparison = self.snapshot_manager.compare_snapshots(snapshots[first]['id'], snapshots[second]['id'])
+        if comparison is None:
+            print("❌ Error comparing snapshots")
+            return False
+        
+        stats = comparison['stats']
+        print(f"\n📊 {comparison['snapshot1']['name']} → {comparison['snapshot2']['name']}")
+        print("=" * 60)
+        print(f"   Added: {stats['added']}, Removed: {stats['removed']}, "
+              f"Modified: {stats['modified']}, Renamed: {stats['renamed']}, Unchanged: {stats['unchanged']}")
+        print(f"   Size change: {stats['size_change']:+d} bytes, Lines change: {stats['lines_change']:+d}")
+        print()
+        
+        differences = comparison['differences']
+        for bucket, sign in (('added', '+'), ('removed', '-'), ('modified', '~')):
+            items = differences[bucket]
+            for item in items[:10]:  # Show first 10
+                print(f"   {sign} {item['rel_path']}")
+            if len(items) > 10:
+                print(f"   ... and {len(items) - 10} more")
+        for item in differences['renamed'][:10]:
+            print(f"   ↪ {item['rel_path1']} → {item['rel_path2']}")
+        if len(differences['renamed']) > 10:
+            print(f"   ... and {len(differences['renamed']) - 10} more")
+        
+        return True
+    
     def compare_projects(self):
         """Compare two projects"""
         project1 = input("Enter first project path: ").strip()
@@ -469,10 +721,30 @@ def main():
     parser = argparse.ArgumentParser(description='Flutter Project Manager Console Interface')
     parser.add_argument('action', choices=[
         'create_project', 'analyze', 'create_snapshot', 'list_snapshots',
-        'restore_snapshot', 'compare_projects', 'execute_commands', 'backup'
+        'restore_snapshot', 'compare_projects', 'execute_commands', 'backup', 'search',
+        'run_recipes', 'benchmark_codecs', 'compare_snapshots', 'snapshot_space', 'prune_snapshots',
+        'verify_snapshots'
     ], help='Action to perform')
-    parser.add_argument('--path', help='Path for operations')
+    parser.add_argument('--path', help='Path for operations (comma-separated list for run_recipes)')
     parser.add_argument('--name', help='Name for operations')
+    parser.add_argument('--query', help='Search text (or file name with --filename-only)')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='grep',
+                        help='Search results format')
+    parser.add_argument('--output', default='-', help='Search results file (default: stdout)')
+    parser.add_argument('--include', help='Comma-separated file patterns for search, e.g. "*.dart,*.yaml"')
+    parser.add_argument('--filename-only', action='store_true', help='Search file names only')
+    parser.add_argument('--regex', action='store_true', help='Treat query as a regular expression')
+    parser.add_argument('--case-sensitive', action='store_true', help='Case-sensitive search')
+    parser.add_argument('--max-files', type=int, help='Stop after this many matching files')
+    parser.add_argument('--all-projects', action='store_true',
+                        help='Search every project from directory history')
+    parser.add_argument('--codecs', help='Comma-separated snapshot codecs for benchmark_codecs (default: all available)')
+    parser.add_argument('--keep-last', type=int, help='prune_snapshots: keep the newest N snapshots per project')
+    parser.add_argument('--keep-daily', type=int, help='prune_snapshots: keep one snapshot for each of the last N days')
+    parser.add_argument('--keep-weekly', type=int, help='prune_snapshots: keep one snapshot for each of the last N weeks')
+    parser.add_argument('--max-size', type=float, help='prune_snapshots: maximum total snapshot size in MB')
+    parser.add_argument('--dry-run', action='store_true', help='prune_snapshots: only show what would be deleted')
+    parser.add_argument('--max-rate', type=float, help='verify_snapshots: maximum read rate in MB/s')
     
     if len(sys.argv) == 1:
         # Interactive mode
@@ -558,11 +830,52 @@ def main():
     elif args.action == 'compare_projects':
         console.compare_projects()
     
+    elif args.action == 'compare_snapshots':
+        console.compare_snapshots()
+    
+    elif args.action == 'snapshot_space':
+        console.snapshot_space()
+    
+    elif args.action == 'verify_snapshots':
+        if not console.verify_snapshots(args.max_rate):
+            sys.exit(1)
+    
+    elif args.action == 'prune_snapshots':
+        if not console.prune_snapshots(args.keep_last, args.keep_daily, args.keep_weekly, args.max_size,
+                                       args.path, args.dry_run):
+            sys.exit(1)
+    
     elif args.action == 'execute_commands':
         console.execute_commands()
     
     elif args.action == 'backup':
         console.backup_settings()
+    
+    elif args.action == 'search':
+        if not (args.path or args.all_projects) or not args.query:
+            print("❌ Error: --query and either --path or --all-projects are required for search")
+            sys.exit(1)
+        file_patterns = [p.strip() for p in args.include.split(',')] if args.include else None
+        if not console.search(args.path, args.query, args.format, args.output, file_patterns,
+                              args.case_sensitive, args.regex, args.filename_only, args.max_files,
+                              args.all_projects):
+            sys.exit(1)
+    
+    elif args.action == 'benchmark_codecs':
+        if not args.path:
+            print("❌ Error: --path is required for benchmark_codecs")
+            sys.exit(1)
+        codecs = [c.strip() for c in args.codecs.split(',')] if args.codecs else None
+        if not console.benchmark_codecs(args.path, codecs):
+            sys.exit(1)
+    
+    elif args.action == 'run_recipes':
+        if not args.path:
+            print("❌ Error: --path is required for run_recipes")
+            sys.exit(1)
+        search_paths = [p.strip() for p in args.path.split(',') if p.strip()]
+        if not console.run_recipes(search_paths, args.format, args.output):
+            sys.exit(1)
 
 if __name__ == '__main__':
     main()
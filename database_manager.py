@@ -4,6 +4,18 @@ import os
 from datetime import datetime
 
 class DatabaseManager:
+    # Columns added to the snapshots table after its first version
+    SNAPSHOT_COLUMNS = {
+        'storage': 'TEXT',
+        'source_path': 'TEXT',
+        'parent_id': 'INTEGER REFERENCES snapshots(id)',
+        'codec': 'TEXT',
+        'filter_profile': 'TEXT',
+        'last_verified': 'TEXT',
+        'verify_status': 'TEXT',
+        'verify_message': 'TEXT'
+    }
+    
     def __init__(self, db_path='flutter_manager.db'):
         self.db_path = db_path
         self.init_database()
@@ -21,14 +33,29 @@ class DatabaseManager:
                       command_sequence TEXT,
                       created_date TEXT)''')
         
-        # Snapshots table
+        # Snapshots table (names repeat: every snapshot is a row of its own)
         c.execute('''CREATE TABLE IF NOT EXISTS snapshots
                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      name TEXT UNIQUE,
+                      name TEXT,
                       description TEXT,
                       directory_path TEXT,
                       compressed INTEGER,
                       created_date TEXT)''')
+        self._add_missing_columns(c, 'snapshots', self.SNAPSHOT_COLUMNS)
+        self._drop_unique_snapshot_names(c)
+        
+        # Per-file manifest rows of snapshots
+        c.execute('''CREATE TABLE IF NOT EXISTS snapshot_files
+                     (snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+                      relpath TEXT NOT NULL,
+                      size INTEGER,
+                      mtime REAL,
+                      hash TEXT,
+                      lines INTEGER,
+                      chars INTEGER,
+                      PRIMARY KEY (snapshot_id, relpath))''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_files_relpath ON snapshot_files (relpath, snapshot_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_files_hash ON snapshot_files (hash)")
         
         # Project presets table
         c.execute('''CREATE TABLE IF NOT EXISTS project_presets
@@ -51,9 +78,59 @@ class DatabaseManager:
                       usage_count INTEGER DEFAULT 1,
                       created_date TEXT)''')
         
+        # Search recipes table (compiled_query caches the compiled regex sources)
+        c.execute('''CREATE TABLE IF NOT EXISTS search_recipes
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      name TEXT,
+                      description TEXT,
+                      query TEXT,
+                      file_patterns TEXT,
+                      exclude_patterns TEXT,
+                      case_sensitive INTEGER DEFAULT 0,
+                      use_regex INTEGER DEFAULT 0,
+                      filename_only INTEGER DEFAULT 0,
+                      created_date TEXT,
+                      usage_count INTEGER DEFAULT 0,
+                      last_used TEXT,
+                      compiled_query TEXT)''')
+        
         conn.commit()
         conn.close()
     
+    def _add_missing_columns(self, cursor, table, columns):
+        """Migrate an existing table by adding columns that are missing"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, definition in columns.items():
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    def _drop_unique_snapshot_names(self, cursor):
+        """
+        Migrate a snapshots table created with UNIQUE names. Saving a snapshot
+        under an existing name replaced the old row, which dropped the parent
+        of incremental snapshots. SQLite cannot drop a constraint, so the
+        table is rebuilt with the same ids.
+        """
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'snapshots'")
+        if 'name TEXT UNIQUE' not in cursor.fetchone()[0]:
+            return
+        columns = ['id', 'name', 'description', 'directory_path', 'compressed', 'created_date',
+                   *self.SNAPSHOT_COLUMNS]
+        added = ', '.join(f"{column} {definition}" for column, definition in self.SNAPSHOT_COLUMNS.items())
+        cursor.execute(f'''CREATE TABLE snapshots_new
+                          (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                           name TEXT,
+                           description TEXT,
+                           directory_path TEXT,
+                           compressed INTEGER,
+                           created_date TEXT,
+                           {added})''')
+        column_list = ', '.join(columns)
+        cursor.execute(f"INSERT INTO snapshots_new ({column_list}) SELECT {column_list} FROM snapshots")
+        cursor.execute("DROP TABLE snapshots")
+        cursor.execute("ALTER TABLE snapshots_new RENAME TO snapshots")
+    
     def save_command(self, name, description, command_sequence):
         """Save command sequence to database"""
         conn = sqlite3.connect(self.db_path)
@@ -83,16 +160,18 @@ class DatabaseManager:
                 'command_sequence': json.loads(cmd[3]), 'created_date': cmd[4]} 
                 for cmd in commands]
     
-    def save_snapshot(self, name, description, directory_path, compressed=False):
-        """Save snapshot information to database"""
+    def save_snapshot(self, name, description, directory_path, compressed=False, storage=None,
+                      source_path=None, parent_id=None, codec=None, filter_profile=None):
+        """Save snapshot information to database, returns the snapshot id"""
         conn = sqlite3.connect(self.db_path)
         c = conn.cursor()
         
         try:
-            c.execute("INSERT OR REPLACE INTO snapshots (name, description, directory_path, compressed, created_date) VALUES (?, ?, ?, ?, ?)",
-                     (name, description, directory_path, 1 if compressed else 0, datetime.now().isoformat()))
+            c.execute("INSERT INTO snapshots (name, description, directory_path, compressed, created_date, storage, source_path, parent_id, codec, filter_profile) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (name, description, directory_path, 1 if compressed else 0, datetime.now().isoformat(),
+                      storage, source_path, parent_id, codec, filter_profile))
             conn.commit()
-            return True
+            return c.lastrowid
         except Exception as e:
             print(f"Error saving snapshot: {e}")
             return False
@@ -104,13 +183,185 @@ class DatabaseManager:
         conn = sqlite3.connect(self.db_path)
         c = conn.cursor()
         
-        c.execute("SELECT * FROM snapshots")
+        c.execute("SELECT id, name, description, directory_path, compressed, created_date, storage, source_path, parent_id, codec, filter_profile, last_verified, verify_status, verify_message FROM snapshots")
         snapshots = c.fetchall()
         conn.close()
         
         return [{'id': snap[0], 'name': snap[1], 'description': snap[2], 
                 'directory_path': snap[3], 'compressed': bool(snap[4]), 
-                'created_date': snap[5]} for snap in snapshots]
+                'created_date': snap[5],
+                'storage': snap[6] or ('zip' if snap[4] else 'copy'),
+                'source_path': snap[7], 'parent_id': snap[8],
+                'codec': snap[9] or ('zip-deflate' if snap[4] else None),
+                'filter_profile': snap[10] or 'full',
+                'last_verified': snap[11], 'verify_status': snap[12],
+                'verify_message': snap[13]} for snap in snapshots]
+    
+    def delete_snapshot(self, snapshot_id):
+        """Delete a snapshot record with its file rows; snapshots built on it lose their parent link"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("DELETE FROM snapshot_files WHERE snapshot_id = ?", (snapshot_id,))
+            c.execute("UPDATE snapshots SET parent_id = NULL WHERE parent_id = ?", (snapshot_id,))
+            c.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+            conn.commit()
+            return c.rowcount > 0
+        except Exception as e:
+            print(f"Error deleting snapshot: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def save_snapshot_verification(self, snapshot_id, status, message, verified_date=None):
+        """Record the result of a snapshot integrity check"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("UPDATE snapshots SET last_verified = ?, verify_status = ?, verify_message = ? WHERE id = ?",
+                      (verified_date or datetime.now().isoformat(), status, message, snapshot_id))
+            conn.commit()
+            return c.rowcount > 0
+        except Exception as e:
+            print(f"Error saving snapshot verification: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def save_snapshot_files(self, snapshot_id, files):
+        """
+        Store the manifest of a snapshot as per-file rows in one executemany.
+        files: relative path -> {'size', 'mtime', 'hash', 'lines', 'chars'}
+        """
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("DELETE FROM snapshot_files WHERE snapshot_id = ?", (snapshot_id,))
+            c.executemany("INSERT INTO snapshot_files (snapshot_id, relpath, size, mtime, hash, lines, chars) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          ((snapshot_id, relpath, entry['size'], entry['mtime'], entry['hash'],
+                            entry.get('lines'), entry.get('chars'))
+                           for relpath, entry in files.items()))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error saving snapshot files: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def delete_snapshot_files(self, snapshot_id):
+        """Delete the file rows of a snapshot"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("DELETE FROM snapshot_files WHERE snapshot_id = ?", (snapshot_id,))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error deleting snapshot files: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def get_indexed_snapshot_ids(self):
+        """Ids of snapshots that have file rows"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        c.execute("SELECT DISTINCT snapshot_id FROM snapshot_files")
+        ids = {row[0] for row in c.fetchall()}
+        conn.close()
+        return ids
+    
+    def get_snapshot_files(self, snapshot_id, pattern=None):
+        """File rows of a snapshot, optionally filtered by a GLOB pattern on relpath"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        query = "SELECT relpath, size, mtime, hash, lines, chars FROM snapshot_files WHERE snapshot_id = ?"
+        params = [snapshot_id]
+        if pattern:
+            query += " AND relpath GLOB ?"
+            params.append(pattern)
+        c.execute(query + " ORDER BY relpath", params)
+        files = c.fetchall()
+        conn.close()
+        
+        return [{'relpath': f[0], 'size': f[1], 'mtime': f[2], 'hash': f[3],
+                 'lines': f[4], 'chars': f[5]} for f in files]
+    
+    def find_snapshots_with_file(self, relpath, file_hash=None):
+        """Snapshots containing a file (or this exact version of it when file_hash is given)"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        query = """SELECT s.id, s.name, s.created_date, f.size, f.mtime, f.hash
+                   FROM snapshot_files f JOIN snapshots s ON s.id = f.snapshot_id
+                   WHERE f.relpath = ?"""
+        params = [relpath]
+        if file_hash:
+            query += " AND f.hash = ?"
+            params.append(file_hash)
+        c.execute(query + " ORDER BY s.created_date", params)
+        rows = c.fetchall()
+        conn.close()
+        
+        return [{'snapshot_id': r[0], 'name': r[1], 'created_date': r[2],
+                 'size': r[3], 'mtime': r[4], 'hash': r[5]} for r in rows]
+    
+    def get_file_history(self, relpath, source_path=None):
+        """
+        Versions of a file across snapshots: one row per snapshot where
+        its content differs from the previous snapshot containing it
+        """
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        source_filter = "AND s.source_path = ?" if source_path else ""
+        params = [relpath, source_path] if source_path else [relpath]
+        c.execute(f"""SELECT snapshot_id, name, created_date, size, mtime, hash FROM (
+                          SELECT s.id AS snapshot_id, s.name, s.created_date, f.size, f.mtime, f.hash,
+                                 LAG(f.hash) OVER (ORDER BY s.created_date, s.id) AS previous_hash
+                          FROM snapshot_files f JOIN snapshots s ON s.id = f.snapshot_id
+                          WHERE f.relpath = ? {source_filter})
+                      WHERE previous_hash IS NULL OR previous_hash != hash
+                      ORDER BY created_date, snapshot_id""", params)
+        rows = c.fetchall()
+        conn.close()
+        
+        return [{'snapshot_id': r[0], 'name': r[1], 'created_date': r[2],
+                 'size': r[3], 'mtime': r[4], 'hash': r[5]} for r in rows]
+    
+    def diff_snapshot_files(self, snapshot_a_id, snapshot_b_id):
+        """
+        Differences between two indexed snapshots computed in SQL.
+        Returns {'added', 'removed', 'modified'} lists of relpaths (b relative to a).
+        """
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        c.execute("""SELECT b.relpath FROM snapshot_files b
+                     LEFT JOIN snapshot_files a ON a.snapshot_id = ? AND a.relpath = b.relpath
+                     WHERE b.snapshot_id = ? AND a.relpath IS NULL ORDER BY b.relpath""",
+                  (snapshot_a_id, snapshot_b_id))
+        added = [row[0] for row in c.fetchall()]
+        c.execute("""SELECT a.relpath FROM snapshot_files a
+                     LEFT JOIN snapshot_files b ON b.snapshot_id = ? AND b.relpath = a.relpath
+                     WHERE a.snapshot_id = ? AND b.relpath IS NULL ORDER BY a.relpath""",
+                  (snapshot_b_id, snapshot_a_id))
+        removed = [row[0] for row in c.fetchall()]
+        c.execute("""SELECT a.relpath FROM snapshot_files a
+                     JOIN snapshot_files b ON b.snapshot_id = ? AND b.relpath = a.relpath
+                     WHERE a.snapshot_id = ? AND a.hash != b.hash ORDER BY a.relpath""",
+                  (snapshot_b_id, snapshot_a_id))
+        modified = [row[0] for row in c.fetchall()]
+        conn.close()
+        
+        return {'added': added, 'removed': removed, 'modified': modified}
     
     def save_preset(self, name, description, file_structure):
         """Save project preset to database"""
@@ -251,3 +502,132 @@ class DatabaseManager:
             return False
         finally:
             conn.close()
+
+    def _search_recipe_values(self, recipe):
+        """Column values of a search recipe dict (without id and counters)"""
+        return (recipe['name'], recipe.get('description', ''), recipe.get('query', ''),
+                json.dumps(recipe.get('file_patterns') or ['*']),
+                json.dumps(recipe.get('exclude_patterns') or []),
+                1 if recipe.get('case_sensitive') else 0,
+                1 if recipe.get('use_regex') else 0,
+                1 if recipe.get('filename_only') else 0)
+    
+    def add_search_recipes(self, recipes):
+        """Insert search recipes, returns list of new ids (None on error)"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            ids = []
+            for recipe in recipes:
+                c.execute("""INSERT INTO search_recipes
+                             (name, description, query, file_patterns, exclude_patterns,
+                              case_sensitive, use_regex, filename_only, created_date, usage_count)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                          self._search_recipe_values(recipe) +
+                          (recipe.get('created_date') or datetime.now().isoformat(),
+                           recipe.get('usage_count', 0)))
+                ids.append(c.lastrowid)
+            conn.commit()
+            return ids
+        except Exception as e:
+            print(f"Error saving search recipes: {e}")
+            return None
+        finally:
+            conn.close()
+    
+    def update_search_recipe(self, recipe_id, recipe):
+        """Update search recipe fields and drop its compiled query cache"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("""UPDATE search_recipes
+                         SET name = ?, description = ?, query = ?, file_patterns = ?, exclude_patterns = ?,
+                             case_sensitive = ?, use_regex = ?, filename_only = ?, compiled_query = NULL
+                         WHERE id = ?""",
+                      self._search_recipe_values(recipe) + (recipe_id,))
+            conn.commit()
+            return c.rowcount > 0
+        except Exception as e:
+            print(f"Error updating search recipe: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def delete_search_recipe(self, recipe_id):
+        """Delete search recipe"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("DELETE FROM search_recipes WHERE id = ?", (recipe_id,))
+            conn.commit()
+            return c.rowcount > 0
+        except Exception as e:
+            print(f"Error deleting search recipe: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def get_search_recipes(self):
+        """Get all search recipes in creation order (without compiled queries)"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        c.execute("""SELECT id, name, description, query, file_patterns, exclude_patterns,
+                            case_sensitive, use_regex, filename_only, created_date, usage_count, last_used
+                     FROM search_recipes ORDER BY id""")
+        recipes = c.fetchall()
+        conn.close()
+        
+        return [{'id': r[0], 'name': r[1], 'description': r[2], 'query': r[3],
+                 'file_patterns': json.loads(r[4]), 'exclude_patterns': json.loads(r[5]),
+                 'case_sensitive': bool(r[6]), 'use_regex': bool(r[7]), 'filename_only': bool(r[8]),
+                 'created_date': r[9], 'usage_count': r[10], 'last_used': r[11]}
+                for r in recipes]
+    
+    def increment_search_recipe_usage(self, recipe_id):
+        """Increment recipe usage counter with a single-row update"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("UPDATE search_recipes SET usage_count = usage_count + 1, last_used = ? WHERE id = ?",
+                      (datetime.now().isoformat(), recipe_id))
+            conn.commit()
+            return c.rowcount > 0
+        except Exception as e:
+            print(f"Error updating search recipe usage: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def get_search_recipe_compiled(self, recipe_id):
+        """Get cached compiled query of a recipe (None if not cached)"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        c.execute("SELECT compiled_query FROM search_recipes WHERE id = ?", (recipe_id,))
+        result = c.fetchone()
+        conn.close()
+        
+        if result and result[0]:
+            return json.loads(result[0])
+        return None
+    
+    def save_search_recipe_compiled(self, recipe_id, compiled_query):
+        """Cache compiled query of a recipe"""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        
+        try:
+            c.execute("UPDATE search_recipes SET compiled_query = ? WHERE id = ?",
+                      (json.dumps(compiled_query), recipe_id))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error caching compiled search recipe: {e}")
+            return False
+        finally:
+            conn.close()
@@ -2,15 +2,21 @@ import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 import subprocess
+import threading
 import webbrowser
 from database_manager import DatabaseManager
-from project_analyzer import ProjectAnalyzer
+from project_analyzer import ProjectAnalyzer, SKIP_FOLDERS
 from snapshot_manager import SnapshotManager
+from snapshot_archive import DEFAULT_CODEC, available_codecs
+from snapshot_pipeline import format_duration
 from settings_manager import SettingsManager, EditorSettingsDialog, HotkeySettingsDialog, AdvancedHotkeySettingsDialog
-from search_manager import SearchManager, SearchDialog
+from search_manager import SearchManager, SearchDialog, build_search_query
 from search_recipes_manager import SearchRecipesManager, SearchRecipeDialog
 
 class FlutterProjectManager:
+    # Результаты проверки целостности снапшотов
+    VERIFY_STATUS_LABELS = {'ok': "Исправен", 'corrupt': "Поврежден", 'missing': "Отсутствует"}
+
     def __init__(self, root):
         self.root = root
         self.root.title("Flutter Project Manager - Полная версия")
@@ -21,7 +27,9 @@ class FlutterProjectManager:
         self.analyzer = ProjectAnalyzer()
         self.snapshot_manager = SnapshotManager(self.db_manager)
         self.settings_manager = SettingsManager(self.db_manager)
-        self.search_manager = SearchManager()
+        # Индексы имен файлов хранятся рядом с базой данных
+        indexes_dir = os.path.join(os.path.dirname(os.path.abspath(self.db_manager.db_path)), "search_indexes")
+        self.search_manager = SearchManager(indexes_dir=indexes_dir)
         self.search_recipes_manager = SearchRecipesManager(self.db_manager)
         
         # Variables
@@ -40,6 +48,9 @@ class FlutterProjectManager:
         self.create_main_interface()
         self.setup_hotkeys()
         self.load_initial_data()
+        
+        # Фоновая проверка целостности снапшотов (с ограничением скорости чтения)
+        self.snapshot_manager.start_scrubber()
 
     def create_main_interface(self):
         """Создание главного интерфейса"""
@@ -302,11 +313,12 @@ class FlutterProjectManager:
         snap_list_frame = ttk.LabelFrame(snapshots_frame, text="Сохраненные снапшоты")
         snap_list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        self.snapshots_tree = ttk.Treeview(snap_list_frame, columns=("description", "date", "compressed"), show="tree headings")
+        self.snapshots_tree = ttk.Treeview(snap_list_frame, columns=("description", "date", "compressed", "verified"), show="tree headings")
         self.snapshots_tree.heading("#0", text="Название")
         self.snapshots_tree.heading("description", text="Описание")
         self.snapshots_tree.heading("date", text="Дата создания")
         self.snapshots_tree.heading("compressed", text="Сжатый")
+        self.snapshots_tree.heading("verified", text="Проверка")
         self.snapshots_tree.pack(fill=tk.BOTH, expand=True)
         
         # Кнопки управления снапшотами
@@ -722,6 +734,10 @@ class FlutterProjectManager:
             # Анализ директории
             stats = self.analyzer.analyze_directory(self.current_directory)
             
+            # Обновить индекс имен файлов для быстрого поиска
+            self.search_manager.update_filename_index(self.current_directory, stats['file_paths'],
+                                                      excluded_dirs=SKIP_FOLDERS)
+            
             # Очистка индикатора загрузки
             for item in self.project_tree.get_children():
                 self.project_tree.delete(item)
@@ -1125,8 +1141,11 @@ app.*.map.json
         snapshots = self.snapshot_manager.list_snapshots()
         for snap in snapshots:
             compressed_text = "Да" if snap['compressed'] else "Нет"
+            verified_text = self.VERIFY_STATUS_LABELS.get(snap['verify_status'], "Не проверен")
+            if snap['last_verified']:
+                verified_text += f" ({snap['last_verified'][:10]})"
             self.snapshots_tree.insert("", tk.END, text=snap['name'],
-                                     values=(snap['description'], snap['created_date'], compressed_text),
+                                     values=(snap['description'], snap['created_date'], compressed_text, verified_text),
                                      tags=(snap['id'],))
 
     def create_command_sequence(self):
@@ -1331,7 +1350,8 @@ app.*.map.json
             return
 
         # Открыть диалог расширенного поиска
-        SearchDialog(self.root, self.search_manager, self.current_directory, self.on_search_results)
+        SearchDialog(self.root, self.search_manager, self.settings_manager,
+                     self.current_directory, self.on_search_results)
 
     def search_in_files(self):
         """Поиск в содержимом файлов"""
@@ -1349,77 +1369,61 @@ app.*.map.json
 
     def perform_search(self, query, case_sensitive=False, use_regex=False, filename_only=False, search_directory=None):
         """Выполнение поиска с заданными параметрами"""
-        try:
-            # Очистить предыдущие результаты
-            self.clear_search_results()
+        self.start_background_search(query, search_directory,
+                                     case_sensitive=case_sensitive,
+                                     use_regex=use_regex,
+                                     filename_only=filename_only)
 
-            # Обновить статус
-            self.search_stats_label.config(text="Поиск...")
-            self.root.update()
+    def perform_content_search(self, search_text, file_patterns=None, exclude_patterns=None, search_directory=None):
+        """Выполнение поиска в содержимом файлов"""
+        self.start_background_search(search_text, search_directory,
+                                     file_patterns=file_patterns or ['*.py', '*.dart', '*.yaml', '*.json', '*.md', '*.txt'],
+                                     exclude_patterns=exclude_patterns or ['.git', 'node_modules', '.dart_tool', 'build'],
+                                     status_text="Поиск в файлах...")
 
+    def start_background_search(self, query, search_directory=None, status_text="Поиск...", **query_options):
+        """Запуск поиска через общий поисковый сервис в фоновом потоке"""
+        try:
             # Использовать переданную директорию или текущую
             search_path = search_directory or self.current_directory
             if not search_path:
                 messagebox.showwarning("Предупреждение", "Не указана директория для поиска!")
                 return
 
-            # Параметры поиска
-            search_params = {
-                'query': query,
-                'path': search_path,
-                'case_sensitive': case_sensitive,
-                'use_regex': use_regex,
-                'filename_only': filename_only,
-                'max_results': 1000
-            }
-
-            # Выполнить поиск
-            if filename_only:
-                results = self.search_manager.search_files(**search_params)
-            else:
-                results = self.search_manager.search_in_files(**search_params)
-
-            # Отобразить результаты
-            self.display_search_results(results, query)
-
-        except Exception as e:
-            messagebox.showerror("Ошибка поиска", f"Произошла ошибка при поиске:\n{str(e)}")
-            self.search_stats_label.config(text="Ошибка поиска")
-
-    def perform_content_search(self, search_text, file_patterns=None, exclude_patterns=None, search_directory=None):
-        """Выполнение поиска в содержимом файлов"""
-        try:
             # Очистить предыдущие результаты
             self.clear_search_results()
 
             # Обновить статус
-            self.search_stats_label.config(text="Поиск в файлах...")
-            self.root.update()
+            self.search_stats_label.config(text=status_text)
 
-            # Использовать переданную директорию или текущую
-            search_path = search_directory or self.current_directory
-            if not search_path:
-                messagebox.showwarning("Предупреждение", "Не указана директория для поиска!")
+            compiled_query = build_search_query(query, **query_options)
+            if compiled_query.error:
+                messagebox.showerror("Ошибка поиска", f"Некорректное регулярное выражение:\n{compiled_query.error}")
+                self.search_stats_label.config(text="Ошибка поиска")
                 return
 
-            # Параметры поиска
-            search_params = {
-                'query': search_text,
-                'path': search_path,
-                'file_patterns': file_patterns or ['*.py', '*.dart', '*.yaml', '*.json', '*.md', '*.txt'],
-                'exclude_patterns': exclude_patterns or ['.git', 'node_modules', '.dart_tool', 'build'],
-                'max_results': 1000
-            }
-
-            # Выполнить поиск
-            results = self.search_manager.search_in_files(**search_params)
-
-            # Отобразить результаты
-            self.display_search_results(results, search_text)
+            def on_done(results):
+                # Поиск по имени без совпадений - нечеткий поиск по индексу имен
+                if (not results and query_options.get('filename_only')
+                        and not query_options.get('use_regex')):
+                    results = self.search_manager.find_filenames(search_path, query)
+                self.root.after(0, self.display_search_results, results, query)
+
+            # Результаты и ошибки передаются в главный поток через after
+            self.search_manager.start_search(
+                [search_path], compiled_query,
+                done_callback=on_done,
+                error_callback=lambda error: self.root.after(0, self.show_search_error, str(error)),
+                max_files=1000
+            )
 
         except Exception as e:
-            messagebox.showerror("Ошибка поиска", f"Произошла ошибка при поиске:\n{str(e)}")
-            self.search_stats_label.config(text="Ошибка поиска")
+            self.show_search_error(str(e))
+
+    def show_search_error(self, error_message):
+        """Отображение ошибки поиска"""
+        messagebox.showerror("Ошибка поиска", f"Произошла ошибка при поиске:\n{error_message}")
+        self.search_stats_label.config(text="Ошибка поиска")
 
     def perform_content_search_in_directory(self, search_text, search_directory, file_patterns=None, exclude_patterns=None):
         """Выполнение поиска в содержимом файлов в указанной директории"""
@@ -1435,9 +1439,10 @@ app.*.map.json
             self.search_stats_label.config(text=f"Ничего не найдено для '{query}'")
             return
 
-        # Добавить результаты в дерево
-        for result in results:
-            result_type = result.get('type', 'file')
+        # Добавить результаты в дерево (по строке на файл или текстовое совпадение)
+        rows = self.search_manager.flatten_results(results)
+        for result in rows:
+            result_type = "Файл" if result['type'] == 'file' else "Текст"
             filename = os.path.basename(result['path'])
             file_path = result['path']
             file_size = result.get('size', 0)
@@ -1458,7 +1463,7 @@ app.*.map.json
 
             # Добавить в дерево
             item_id = self.search_results_tree.insert("", tk.END, values=(
-                result_type.capitalize(),
+                result_type,
                 filename,
                 file_path,
                 size_str,
@@ -1467,7 +1472,10 @@ app.*.map.json
             ), tags=(file_path,))
 
         # Обновить статистику
-        self.search_stats_label.config(text=f"Найдено {len(results)} результатов для '{query}'")
+        stats_text = f"Найдено {len(rows)} результатов в {len(results)} файлах для '{query}'"
+        if self.search_manager.search_truncated:
+            stats_text += " (показаны первые результаты)"
+        self.search_stats_label.config(text=stats_text)
 
         # Переключиться на вкладку поиска, если она не активна
         current_tab = self.notebook.tab(self.notebook.select(), "text")
@@ -1756,7 +1764,11 @@ class SnapshotDialog:
         
         self.dialog = tk.Toplevel(parent)
         self.dialog.title("Создание снапшота")
-        self.dialog.geometry("400x300")
+        self.dialog.geometry("400x540")
+        # Снапшот создается в фоновом потоке, окно остается отзывчивым
+        self.worker = None
+        self.cancel_requested = False
+        self.dialog.protocol("WM_DELETE_WINDOW", self.on_close)
         
         self.create_interface()
     
@@ -1769,27 +1781,123 @@ class SnapshotDialog:
         self.desc_text = tk.Text(self.dialog, height=5, width=40)
         self.desc_text.pack(pady=5)
         
-        self.compress_var = tk.BooleanVar(value=True)
-        ttk.Checkbutton(self.dialog, text="Сжать снапшот", variable=self.compress_var).pack(pady=10)
+        self.storage_var = tk.StringVar(value="zip")
+        storage_frame = ttk.Frame(self.dialog)
+        storage_frame.pack(pady=10)
+        ttk.Radiobutton(storage_frame, text="Архив", variable=self.storage_var, value="zip").pack(anchor=tk.W)
+        codec_frame = ttk.Frame(storage_frame)
+        codec_frame.pack(anchor=tk.W, padx=(20, 0))
+        ttk.Label(codec_frame, text="Формат:").pack(side=tk.LEFT)
+        self.codec_var = tk.StringVar(value=DEFAULT_CODEC)
+        ttk.Combobox(codec_frame, textvariable=self.codec_var, values=available_codecs(),
+                     state="readonly", width=15).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Radiobutton(storage_frame, text="Копия папки", variable=self.storage_var, value="copy").pack(anchor=tk.W)
+        ttk.Radiobutton(storage_frame, text="Хранилище без дубликатов", variable=self.storage_var, value="dedup").pack(anchor=tk.W)
+        
+        filter_frame = ttk.Frame(self.dialog)
+        filter_frame.pack(pady=5)
+        ttk.Label(filter_frame, text="Содержимое:").pack(side=tk.LEFT)
+        self.filter_profiles = {"Только исходники": "sources",
+                                "Исходники и ресурсы": "sources_assets",
+                                "Все файлы": "full"}
+        self.filter_var = tk.StringVar(value="Исходники и ресурсы")
+        ttk.Combobox(filter_frame, textvariable=self.filter_var, values=list(self.filter_profiles),
+                     state="readonly", width=20).pack(side=tk.LEFT, padx=(5, 0))
+        
+        self.incremental_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(self.dialog, text="Инкрементально от последнего снапшота (хранилище)",
+                        variable=self.incremental_var).pack(pady=5)
         
-        ttk.Button(self.dialog, text="Создать снапшот", command=self.create_snapshot).pack(pady=10)
+        buttons_frame = ttk.Frame(self.dialog)
+        buttons_frame.pack(pady=10)
+        self.create_button = ttk.Button(buttons_frame, text="Создать снапшот", command=self.create_snapshot)
+        self.create_button.pack(side=tk.LEFT, padx=(0, 5))
+        self.cancel_button = ttk.Button(buttons_frame, text="Отмена", command=self.cancel_snapshot,
+                                        state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT)
+        
+        self.progress_var = tk.DoubleVar(value=0)
+        ttk.Progressbar(self.dialog, variable=self.progress_var, maximum=100,
+                        length=360).pack(pady=(0, 5))
+        self.progress_label = ttk.Label(self.dialog, text="")
+        self.progress_label.pack()
     
     def create_snapshot(self):
         name = self.name_entry.get().strip()
         description = self.desc_text.get("1.0", tk.END).strip()
-        compress = self.compress_var.get()
+        storage = self.storage_var.get()
         
         if not name:
             messagebox.showwarning("Предупреждение", "Введите название снапшота!")
             return
         
-        result = self.snapshot_manager.create_snapshot(self.source_path, name, description, compress)
-        
+        parent = None
+        if storage == "dedup" and self.incremental_var.get():
+            latest = self.snapshot_manager.find_latest_snapshot(self.source_path)
+            parent = latest['id'] if latest else None
+        
+        codec = self.codec_var.get()
+        filter_profile = self.filter_profiles[self.filter_var.get()]
+        
+        def progress(percent, snapshot_progress):
+            # Вызывается из рабочего потока - обновление окна через after
+            self.dialog.after(0, self.update_progress, percent, self.format_progress(snapshot_progress))
+        
+        def run():
+            result = self.snapshot_manager.create_snapshot(self.source_path, name, description,
+                                                           storage == "zip", storage, parent,
+                                                           codec=codec, filter_profile=filter_profile,
+                                                           progress_callback=progress)
+            self.dialog.after(0, self.on_snapshot_done, result)
+        
+        self.cancel_requested = False
+        self.create_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.update_progress(0, "Подготовка...")
+        self.worker = threading.Thread(target=run, daemon=True)
+        self.worker.start()
+    
+    def update_progress(self, percent, message):
+        self.progress_var.set(percent)
+        self.progress_label.config(text=message)
+    
+    def format_progress(self, progress):
+        """Текст прогресса создания снапшота (SnapshotProgress)"""
+        megabytes = progress.bytes_done / (1024 * 1024)
+        if progress.bytes_total is None:
+            return f"Сохранено файлов: {progress.files_done} ({megabytes:.1f} МБ)"
+        text = (f"Сохранено файлов: {progress.files_done} из {progress.files_total} "
+                f"({megabytes:.1f} из {progress.bytes_total / (1024 * 1024):.1f} МБ)")
+        if progress.eta is not None:
+            text += f", осталось {format_duration(progress.eta)}"
+        return text
+    
+    def cancel_snapshot(self):
+        """Отмена создания: незавершенный снапшот удаляется"""
+        self.cancel_requested = True
+        self.cancel_button.config(state=tk.DISABLED)
+        self.progress_label.config(text="Отмена...")
+        self.snapshot_manager.cancel_snapshot()
+    
+    def on_close(self):
+        # Окно закрывается после остановки рабочего потока (см. on_snapshot_done)
+        if self.worker and self.worker.is_alive():
+            self.cancel_snapshot()
+        else:
+            self.dialog.destroy()
+    
+    def on_snapshot_done(self, result):
+        self.worker = None
         if result:
             messagebox.showinfo("Успех", f"Снапшот создан: {result}")
             self.refresh_callback()
             self.dialog.destroy()
+        elif self.cancel_requested:
+            self.dialog.destroy()
         else:
+            self.create_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+            self.update_progress(0, "")
             messagebox.showerror("Ошибка", "Ошибка создания снапшота!")
 
 
@@ -3,6 +3,11 @@ import difflib
 import hashlib
 from pathlib import Path
 
+# Папки, пропускаемые при анализе (и в индексе имен файлов, построенном по нему)
+SKIP_FOLDERS = frozenset({'__pycache__', '.git', '.svn', 'node_modules', '.dart_tool', 'build'})
+# Скомпилированные и двоичные файлы, пропускаемые при анализе
+SKIP_EXTENSIONS = frozenset({'.pyc', '.pyo', '.class', '.o', '.so', '.dll', '.exe', '.bin'})
+
 class ProjectAnalyzer:
     def __init__(self):
         pass
@@ -15,26 +20,33 @@ class ProjectAnalyzer:
             'lines': 0,
             'characters': 0,
             'file_tree': {},
+            'file_paths': [],
             'truncated': False
         }
         
         processed_files = 0
-        skip_extensions = {'.pyc', '.pyo', '.class', '.o', '.so', '.dll', '.exe', '.bin'}
-        skip_folders = {'__pycache__', '.git', '.svn', 'node_modules', '.dart_tool', 'build'}
+        listing_only = False
         
         for root, dirs, files in os.walk(directory_path):
             # Фильтрация папок
-            dirs[:] = [d for d in dirs if d not in skip_folders]
+            dirs[:] = [d for d in dirs if d not in SKIP_FOLDERS]
+            
+            # Имена всех файлов собираются для индекса имен,
+            # даже после достижения лимита анализа
+            stats['file_paths'].extend(os.path.join(root, f) for f in files)
+            if listing_only:
+                continue
             
             stats['folders'] += len(dirs)
             
             # Ограничение количества обрабатываемых файлов
             if processed_files >= max_files:
                 stats['truncated'] = True
-                break
+                listing_only = True
+                continue
             
             # Фильтрация файлов
-            filtered_files = [f for f in files if not any(f.endswith(ext) for ext in skip_extensions)]
+            filtered_files = [f for f in files if not any(f.endswith(ext) for ext in SKIP_EXTENSIONS)]
             stats['files'] += len(filtered_files)
             
             # Build file tree
@@ -77,6 +89,55 @@ class ProjectAnalyzer:
         
         return stats
     
+    def stats_from_entries(self, directory_path, files):
+        """
+        Статистика в формате analyze_directory по готовым записям файлов
+        {относительный путь с '/': {'size', 'hash', 'lines', 'chars'}},
+        например из манифеста снапшота, без чтения файлов
+        """
+        stats = {
+            'folders': 0,
+            'files': len(files),
+            'lines': 0,
+            'characters': 0,
+            'file_tree': {},
+            'file_paths': [],
+            'truncated': False
+        }
+        
+        for rel_path in sorted(files):
+            entry = files[rel_path]
+            parts = rel_path.split('/')
+            current_tree = stats['file_tree']
+            current_path = directory_path
+            for part in parts[:-1]:
+                current_path = os.path.join(current_path, part)
+                if part not in current_tree:
+                    current_tree[part] = {
+                        'type': 'folder',
+                        'children': {},
+                        'path': current_path,
+                        'stats': {'folders': 0, 'files': 0, 'lines': 0, 'characters': 0}
+                    }
+                    stats['folders'] += 1
+                current_tree = current_tree[part]['children']
+            
+            file_path = os.path.join(current_path, parts[-1])
+            file_stats = {'lines': entry.get('lines') or 0, 'characters': entry.get('chars') or 0,
+                          'size': entry['size']}
+            # Хеш содержимого позволяет сравнивать файлы без чтения (см. find_differences)
+            current_tree[parts[-1]] = {
+                'type': 'file',
+                'path': file_path,
+                'hash': entry['hash'],
+                'stats': file_stats
+            }
+            stats['file_paths'].append(file_path)
+            stats['lines'] += file_stats['lines']
+            stats['characters'] += file_stats['characters']
+        
+        return stats
+    
     def analyze_file(self, file_path):
         """Analyze single file and return statistics"""
         stats = {'lines': 0, 'characters': 0, 'size': 0}
@@ -126,7 +187,7 @@ class ProjectAnalyzer:
             if item in tree1 and item in tree2:
                 if tree1[item]['type'] == 'file' and tree2[item]['type'] == 'file':
                     # Compare file contents
-                    if self.files_are_different(tree1[item]['path'], tree2[item]['path']):
+                    if self.nodes_are_different(tree1[item], tree2[item]):
                         differences['modified'].append({
                             'name': item,
                             'type': 'file',
@@ -160,6 +221,12 @@ class ProjectAnalyzer:
         
         return differences
     
+    def nodes_are_different(self, node1, node2):
+        """Сравнение файлов дерева: по хешам, если они известны, иначе по содержимому"""
+        if 'hash' in node1 and 'hash' in node2:
+            return node1['hash'] != node2['hash']
+        return self.files_are_different(node1['path'], node2['path'])
+    
     def files_are_different(self, file1_path, file2_path):
         """Check if two files are different"""
         try:
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковый экспорт результатов поиска (CSV, JSONL, grep, текст)
+"""
+
+import os
+import sys
+import csv
+import json
+from abc import ABC, abstractmethod
+
+
+class SearchResultWriter(ABC):
+    """
+    Базовый класс потокового экспорта: каждый результат записывается
+    сразу, поэтому объект можно передавать как result_callback поиска
+    и не держать все результаты в памяти. Подкласс, не реализующий
+    write_result, нельзя создать.
+    """
+
+    def __init__(self, file_path="-"):
+        self.file_path = file_path
+        if file_path == "-":
+            self.file = sys.stdout
+            self.owns_file = False
+        else:
+            self.file = open(file_path, 'w', encoding='utf-8', newline='')
+            self.owns_file = True
+        self.files_written = 0
+        self.matches_written = 0
+        self.write_header()
+
+    def __call__(self, result):
+        self.write(result)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_header(self):
+        """Заголовок файла (если нужен формату)"""
+
+    def write(self, result):
+        """Запись одного результата поиска"""
+        self.write_result(result)
+        self.files_written += 1
+        self.matches_written += len(result['text_matches'])
+
+    @abstractmethod
+    def write_result(self, result):
+        """Запись результата в формате экспорта"""
+
+    def close(self):
+        """Завершение записи"""
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class CsvResultWriter(SearchResultWriter):
+    """
+    CSV: строка на файл без совпадений или на каждое совпадение.
+    Колонка project заполняется при поиске по нескольким проектам.
+    """
+
+    COLUMNS = ['type', 'path', 'line_number', 'size', 'modified', 'content', 'project']
+
+    def write_header(self):
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.COLUMNS)
+
+    def write_result(self, result):
+        modified = result['modified'].isoformat(timespec='seconds')
+        project = result.get('project', '')
+        if not result['text_matches']:
+            self.writer.writerow(['file', result['path'], '', result['size'], modified, '', project])
+            return
+        for match in result['text_matches']:
+            self.writer.writerow(['text', result['path'], match['line_number'],
+                                  result['size'], modified, match['line_text'], project])
+
+
+class JsonlResultWriter(SearchResultWriter):
+    """JSON Lines: объект на каждый найденный файл"""
+
+    def write_result(self, result):
+        record = {
+            'path': result['path'],
+            'size': result['size'],
+            'modified': result['modified'].isoformat(timespec='seconds'),
+            'matches': [
+                {
+                    'line_number': match['line_number'],
+                    'line_text': match['line_text'],
+                    'match_start': match['match_start'],
+                    'match_end': match['match_end']
+                }
+                for match in result['text_matches']
+            ]
+        }
+        if 'project' in result:
+            record['project'] = result['project']
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class GrepResultWriter(SearchResultWriter):
+    """
+    Формат grep: path:line:text (для файлов без совпадений - только путь).
+    При поиске по нескольким проектам строка начинается с [проект].
+    """
+
+    def write_result(self, result):
+        prefix = f"[{result['project']}] " if 'project' in result else ""
+        if not result['text_matches']:
+            self.file.write(f"{prefix}{result['path']}\n")
+            return
+        for match in result['text_matches']:
+            self.file.write(f"{prefix}{result['path']}:{match['line_number']}:{match['line_text']}\n")
+
+
+class TextResultWriter(SearchResultWriter):
+    """Текстовый отчет для чтения человеком"""
+
+    def write_header(self):
+        self.file.write("Результаты поиска файлов\n")
+        self.file.write("=" * 50 + "\n\n")
+
+    def write_result(self, result):
+        self.file.write(f"Файл: {result['name']}\n")
+        if 'project' in result:
+            self.file.write(f"Проект: {result['project']}\n")
+        self.file.write(f"Путь: {result['path']}\n")
+        self.file.write(f"Размер: {format_file_size(result['size'])}\n")
+        self.file.write(f"Изменен: {result['modified'].strftime('%d.%m.%Y %H:%M')}\n")
+
+        if result['text_matches']:
+            self.file.write("Текстовые совпадения:\n")
+            for match in result['text_matches']:
+                self.file.write(f"  Строка {match['line_number']}: {match['line_text']}\n")
+
+        self.file.write("\n" + "-" * 50 + "\n\n")
+
+
+EXPORT_FORMATS = {
+    'csv': CsvResultWriter,
+    'jsonl': JsonlResultWriter,
+    'grep': GrepResultWriter,
+    'text': TextResultWriter
+}
+
+EXPORT_EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.grep': 'grep'
+}
+
+
+def format_file_size(size_bytes):
+    """Форматирование размера файла"""
+    if size_bytes < 1024:
+        return f"{size_bytes} Б"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} КБ"
+    elif size_bytes < 1024 * 1024 * 1024:
+        return f"{size_bytes / (1024 * 1024):.1f} МБ"
+    else:
+        return f"{size_bytes / (1024 * 1024 * 1024):.1f} ГБ"
+
+
+def detect_export_format(file_path):
+    """Формат экспорта по расширению файла (по умолчанию - текст)"""
+    extension = os.path.splitext(file_path)[1].lower()
+    return EXPORT_EXTENSIONS.get(extension, 'text')
+
+
+def open_result_writer(file_path="-", export_format=None):
+    """Создание экспортера; формат определяется по расширению, если не задан"""
+    if export_format is None:
+        export_format = detect_export_format(file_path)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {export_format}")
+    return EXPORT_FORMATS[export_format](file_path)
+
+
+def export_query(search_manager, directories, query, writer, progress_callback=None,
+                 multi_root=False, **limits):
+    """
+    Поиск с записью результатов напрямую в экспортер, без накопления
+    в памяти. При multi_root=True директории ищутся параллельно как
+    отдельные проекты. Возвращает число записанных файлов.
+    """
+    if multi_root:
+        search_manager.search_projects(directories, query, progress_callback,
+                                       result_callback=writer, keep_results=False, **limits)
+    else:
+        search_manager.run_query(directories, query, progress_callback,
+                                 result_callback=writer, keep_results=False, **limits)
+    return writer.files_written
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Индекс имен файлов для мгновенного быстрого поиска
+"""
+
+import os
+import json
+import bisect
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+
+class FilenameIndex:
+    """
+    Индекс имен файлов одной директории: отсортированный массив имен
+    в нижнем регистре и таблица относительных путей.
+    Поддерживает поиск по префиксу, подстроке и нечеткий поиск
+    (по подпоследовательности символов с оценкой).
+    """
+
+    VERSION = 1
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        # Полнота индекса: False, если обход был прерван
+        self.complete = False
+        # Директории, пропущенные при обходе, по которому построен индекс
+        self.excluded_dirs = frozenset()
+        # Таблица путей; удаленные записи заменяются на None
+        self.paths: List[Optional[str]] = []
+        self.path_ids: Dict[str, int] = {}
+        # Отсортированные пары (имя в нижнем регистре, id пути) в двух массивах
+        self.names: List[str] = []
+        self.name_ids: List[int] = []
+
+    def __len__(self):
+        return len(self.path_ids)
+
+    def build(self, file_paths: Iterable[str], complete: bool = True):
+        """Построение индекса по списку путей файлов"""
+        self.paths = []
+        self.path_ids = {}
+        entries = []
+        for rel_path in self._relative_paths(file_paths):
+            if rel_path in self.path_ids:
+                continue
+            path_id = len(self.paths)
+            self.paths.append(rel_path)
+            self.path_ids[rel_path] = path_id
+            entries.append((os.path.basename(rel_path).lower(), path_id))
+
+        entries.sort()
+        self.names = [name for name, _ in entries]
+        self.name_ids = [path_id for _, path_id in entries]
+        self.complete = complete
+
+    def update(self, file_paths: Iterable[str], complete: bool = True):
+        """
+        Инкрементальная синхронизация с новым списком путей:
+        добавляются только новые файлы, удаляются только исчезнувшие
+        """
+        new_paths = set(self._relative_paths(file_paths))
+        old_paths = set(self.path_ids)
+
+        # При большом числе изменений дешевле построить индекс заново
+        changed = len(new_paths ^ old_paths)
+        if changed > max(len(old_paths) // 4, 1000):
+            self.build(new_paths, complete)
+            return
+
+        for rel_path in old_paths - new_paths:
+            self.remove(rel_path)
+        for rel_path in new_paths - old_paths:
+            self.add(rel_path)
+        self.complete = complete
+
+    def add(self, rel_path: str):
+        """Добавление файла в индекс"""
+        if rel_path in self.path_ids:
+            return
+        path_id = len(self.paths)
+        self.paths.append(rel_path)
+        self.path_ids[rel_path] = path_id
+
+        name = os.path.basename(rel_path).lower()
+        pos = self._insert_position(name, path_id)
+        self.names.insert(pos, name)
+        self.name_ids.insert(pos, path_id)
+
+    def remove(self, rel_path: str):
+        """Удаление файла из индекса"""
+        path_id = self.path_ids.pop(rel_path, None)
+        if path_id is None:
+            return
+        self.paths[path_id] = None
+
+        name = os.path.basename(rel_path).lower()
+        pos = bisect.bisect_left(self.names, name)
+        while pos < len(self.names) and self.names[pos] == name:
+            if self.name_ids[pos] == path_id:
+                del self.names[pos]
+                del self.name_ids[pos]
+                return
+            pos += 1
+
+    def _insert_position(self, name: str, path_id: int) -> int:
+        """Позиция вставки с сохранением порядка (имя, id)"""
+        pos = bisect.bisect_left(self.names, name)
+        while pos < len(self.names) and self.names[pos] == name and self.name_ids[pos] < path_id:
+            pos += 1
+        return pos
+
+    def _relative_paths(self, file_paths: Iterable[str]):
+        for file_path in file_paths:
+            if os.path.isabs(file_path):
+                file_path = os.path.relpath(file_path, self.root)
+            yield os.path.normpath(file_path)
+
+    def full_path(self, path_id: int) -> str:
+        """Абсолютный путь по id"""
+        return os.path.join(self.root, self.paths[path_id])
+
+    def lookup_prefix(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """Файлы, имя которых начинается с prefix (без учета регистра)"""
+        prefix = prefix.lower()
+        results = []
+        pos = bisect.bisect_left(self.names, prefix)
+        while pos < len(self.names) and self.names[pos].startswith(prefix):
+            results.append(self.full_path(self.name_ids[pos]))
+            if limit and len(results) >= limit:
+                break
+            pos += 1
+        return results
+
+    def lookup_substring(self, text: str, limit: Optional[int] = None) -> List[str]:
+        """Файлы, имя которых содержит text (без учета регистра)"""
+        text = text.lower()
+        results = []
+        for name, path_id in zip(self.names, self.name_ids):
+            if text in name:
+                results.append(self.full_path(path_id))
+                if limit and len(results) >= limit:
+                    break
+        return results
+
+    def lookup_fuzzy(self, pattern: str, limit: Optional[int] = 50) -> List[str]:
+        """
+        Нечеткий поиск: символы pattern должны встречаться в имени по порядку.
+        Результаты отсортированы по оценке (подряд идущие символы, начало
+        имени и начала слов ценятся выше, длинные имена - ниже).
+        """
+        pattern = pattern.lower()
+        if not pattern:
+            return []
+
+        scored = []
+        for name, path_id in zip(self.names, self.name_ids):
+            score = self.fuzzy_score(pattern, name)
+            if score is not None:
+                scored.append((-score, name, path_id))
+
+        scored.sort()
+        if limit:
+            scored = scored[:limit]
+        return [self.full_path(path_id) for _, _, path_id in scored]
+
+    @staticmethod
+    def fuzzy_score(pattern: str, name: str) -> Optional[int]:
+        """Оценка совпадения подпоследовательности (None - не совпадает)"""
+        score = 0
+        pos = 0
+        previous = -2
+        for char in pattern:
+            found = name.find(char, pos)
+            if found == -1:
+                return None
+            if found == previous + 1:
+                score += 5  # Подряд идущие символы
+            if found == 0:
+                score += 10  # Начало имени
+            elif name[found - 1] in '_-. ':
+                score += 3  # Начало слова
+            previous = found
+            pos = found + 1
+        return score * 10 - len(name)
+
+    def iter_paths(self):
+        """Все абсолютные пути индекса"""
+        for rel_path in self.path_ids:
+            yield os.path.join(self.root, rel_path)
+
+    def save(self, file_path: str) -> bool:
+        """Сохранение индекса в файл"""
+        try:
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+            data = {
+                'version': self.VERSION,
+                'root': self.root,
+                'complete': self.complete,
+                'excluded_dirs': sorted(self.excluded_dirs),
+                'paths': sorted(self.path_ids)
+            }
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            return True
+        except Exception as e:
+            print(f"Ошибка сохранения индекса имен файлов: {e}")
+            return False
+
+    @classmethod
+    def load(cls, file_path: str) -> Optional['FilenameIndex']:
+        """Загрузка индекса из файла (None, если файла нет или он поврежден)"""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != cls.VERSION:
+                return None
+            index = cls(data['root'])
+            index.build(data['paths'], data.get('complete', False))
+            index.excluded_dirs = frozenset(data.get('excluded_dirs', ()))
+            return index
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ошибка загрузки индекса имен файлов: {e}")
+            return None
+
+    @staticmethod
+    def storage_path(indexes_dir: str, root: str) -> str:
+        """Имя файла сохраненного индекса для директории"""
+        digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(indexes_dir, f"filenames_{digest}.json")
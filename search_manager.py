@@ -1,177 +1,1021 @@
 import os
 import re
+import codecs
 import fnmatch
+import functools
 import threading
+import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
+from search_index import FilenameIndex
+from search_export import format_file_size, open_result_writer, detect_export_format
+
+# Директории, исключаемые из поиска по умолчанию
+DEFAULT_EXCLUDE_DIRS = frozenset({'.git', '.svn', '__pycache__', 'node_modules', '.dart_tool', 'build'})
+
+
+class CompiledSearchQuery:
+    """
+    Поисковый запрос, подготовленный один раз для всего поиска:
+    регулярные выражения, набор расширений, фильтры даты и размера.
+    """
+    
+    def __init__(self, filename_patterns=("*",), text_pattern="", file_extensions=None,
+                 exclude_dirs=None, modified_after=None, modified_before=None,
+                 size_min=None, size_max=None, case_sensitive=False, use_regex=False,
+                 filename_query=None):
+        self.text_pattern = text_pattern
+        self.case_sensitive = case_sensitive
+        self.use_regex = use_regex
+        self.error = None
+        
+        # Шаблоны имен файлов fnmatch -> одно регулярное выражение.
+        # Регистр учитывается так же, как в fnmatch.fnmatch на текущей ОС
+        name_flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        patterns = [p for p in filename_patterns if p] or ["*"]
+        if "*" in patterns:
+            self.filename_regex = None
+        else:
+            self.filename_regex = re.compile(
+                '|'.join(fnmatch.translate(p) for p in patterns), name_flags)
+        
+        # Дополнительный фильтр имени (запрос рецепта "только имена файлов")
+        self.filename_query = None
+        self.filename_query_mode = None
+        self.filename_query_regex = None
+        self._filename_query_match = None
+        if filename_query and filename_query != "*":
+            self.filename_query = filename_query
+            query_flags = 0 if case_sensitive else re.IGNORECASE
+            try:
+                if use_regex:
+                    self.filename_query_mode = 'regex'
+                    self.filename_query_regex = re.compile(filename_query, query_flags)
+                elif any(c in filename_query for c in '*?['):
+                    self.filename_query_mode = 'glob'
+                    self.filename_query_regex = re.compile(fnmatch.translate(filename_query), query_flags)
+                else:
+                    self.filename_query_mode = 'substring'
+                    self.filename_query_regex = re.compile(re.escape(filename_query), query_flags)
+                self._filename_query_match = self._filename_matcher(
+                    self.filename_query_mode, self.filename_query_regex)
+            except re.error as e:
+                self.error = str(e)
+        
+        self.extensions = frozenset(e.lower() for e in file_extensions) if file_extensions else None
+        
+        # Исключения: точные имена директорий и шаблоны с подстановочными знаками
+        if exclude_dirs is None:
+            exclude_dirs = DEFAULT_EXCLUDE_DIRS
+        self.exclude_dirs = frozenset(d for d in exclude_dirs if not any(c in d for c in '*?['))
+        exclude_globs = [d for d in exclude_dirs if d not in self.exclude_dirs]
+        self.exclude_regex = re.compile('|'.join(fnmatch.translate(d) for d in exclude_globs)) if exclude_globs else None
+        
+        # Даты сравниваются с st_mtime напрямую, без datetime на каждый файл
+        self.mtime_min = modified_after.timestamp() if modified_after else None
+        self.mtime_max = modified_before.timestamp() if modified_before else None
+        self.size_min = size_min
+        self.size_max = size_max
+        
+        # Выражение для поиска текста
+        self.text_regex = None
+        self._byte_patterns = {}
+        if text_pattern:
+            flags = 0 if case_sensitive else re.IGNORECASE
+            try:
+                if use_regex:
+                    self.text_regex = re.compile(text_pattern, flags | re.MULTILINE)
+                else:
+                    self.text_regex = re.compile(re.escape(text_pattern), flags)
+            except re.error as e:
+                self.error = str(e)
+    
+    @staticmethod
+    def _filename_matcher(mode, regex):
+        """
+        Функция проверки имени для запроса по имени файла: шаблон glob
+        сопоставляется с именем целиком, как fnmatch и поиск по префиксу
+        в индексе; regex и подстрока - с любой частью имени
+        """
+        if regex is None:
+            return None
+        return regex.match if mode == 'glob' else regex.search
+    
+    def is_excluded_dir(self, name):
+        """Проверка, исключена ли директория"""
+        if name in self.exclude_dirs:
+            return True
+        return bool(self.exclude_regex and self.exclude_regex.match(name))
+    
+    def index_candidates(self, index):
+        """
+        Кандидаты из индекса имен файлов: по префиксу для шаблонов вида
+        'main*', по подстроке для простого запроса, иначе все файлы индекса
+        """
+        if self.filename_query_mode == 'substring':
+            return index.lookup_substring(self.filename_query)
+        if self.filename_query_mode == 'glob':
+            prefix = re.split(r'[*?\[]', self.filename_query, 1)[0]
+            if prefix:
+                return index.lookup_prefix(prefix)
+        return list(index.iter_paths())
+    
+    def match_name(self, name):
+        """Фильтры по имени файла и расширению"""
+        if self.filename_regex and not self.filename_regex.match(name):
+            return False
+        if self._filename_query_match and not self._filename_query_match(name):
+            return False
+        if self.extensions is not None:
+            _, ext = os.path.splitext(name)
+            if ext.lower() not in self.extensions:
+                return False
+        return True
+    
+    def match_stat(self, stat):
+        """Фильтры по дате модификации и размеру файла"""
+        if self.mtime_min is not None and stat.st_mtime < self.mtime_min:
+            return False
+        if self.mtime_max is not None and stat.st_mtime > self.mtime_max:
+            return False
+        if self.size_min and stat.st_size < self.size_min:
+            return False
+        if self.size_max and stat.st_size > self.size_max:
+            return False
+        return True
+    
+    def byte_regex(self, encoding):
+        """
+        Выражение для поиска простого текста прямо в байтах файла
+        (None, если шаблон нельзя искать в байтах этой кодировки)
+        """
+        if encoding not in self._byte_patterns:
+            regex = None
+            # Без учета регистра в байтах сравниваются только ASCII-буквы
+            if not self.use_regex and (self.case_sensitive or self.text_pattern.isascii()):
+                try:
+                    byte_pattern = self.text_pattern.encode(
+                        'utf-8' if encoding == 'utf-8-sig' else encoding)
+                    if not self.case_sensitive:
+                        byte_pattern = byte_pattern.lower()
+                    regex = re.compile(re.escape(byte_pattern))
+                except UnicodeEncodeError:
+                    regex = False
+            self._byte_patterns[encoding] = regex
+        return self._byte_patterns[encoding]
+    
+    # Версия 2: шаблон glob в запросе по имени сопоставляется с именем целиком
+    CACHE_VERSION = 2
+    
+    def to_cache(self):
+        """
+        Сериализуемое состояние запроса: исходники уже построенных
+        выражений, чтобы сохраненный рецепт не собирал их заново
+        """
+        def regex_state(regex):
+            return [regex.pattern, regex.flags] if regex is not None else None
+        
+        return {
+            'version': self.CACHE_VERSION,
+            'text_pattern': self.text_pattern,
+            'case_sensitive': self.case_sensitive,
+            'use_regex': self.use_regex,
+            'error': self.error,
+            'filename_regex': regex_state(self.filename_regex),
+            'filename_query': self.filename_query,
+            'filename_query_mode': self.filename_query_mode,
+            'filename_query_regex': regex_state(self.filename_query_regex),
+            'extensions': sorted(self.extensions) if self.extensions is not None else None,
+            'exclude_dirs': sorted(self.exclude_dirs),
+            'exclude_regex': regex_state(self.exclude_regex),
+            'mtime_min': self.mtime_min,
+            'mtime_max': self.mtime_max,
+            'size_min': self.size_min,
+            'size_max': self.size_max,
+            'text_regex': regex_state(self.text_regex)
+        }
+    
+    @classmethod
+    def from_cache(cls, data):
+        """Восстановление запроса из to_cache (None, если формат устарел)"""
+        if not data or data.get('version') != cls.CACHE_VERSION:
+            return None
+        
+        def regex_from_state(state):
+            return re.compile(state[0], state[1]) if state else None
+        
+        query = cls.__new__(cls)
+        query.text_pattern = data['text_pattern']
+        query.case_sensitive = data['case_sensitive']
+        query.use_regex = data['use_regex']
+        query.error = data['error']
+        query.filename_regex = regex_from_state(data['filename_regex'])
+        query.filename_query = data['filename_query']
+        query.filename_query_mode = data['filename_query_mode']
+        query.filename_query_regex = regex_from_state(data['filename_query_regex'])
+        query._filename_query_match = cls._filename_matcher(query.filename_query_mode,
+                                                            query.filename_query_regex)
+        query.extensions = frozenset(data['extensions']) if data['extensions'] is not None else None
+        query.exclude_dirs = frozenset(data['exclude_dirs'])
+        query.exclude_regex = regex_from_state(data['exclude_regex'])
+        query.mtime_min = data['mtime_min']
+        query.mtime_max = data['mtime_max']
+        query.size_min = data['size_min']
+        query.size_max = data['size_max']
+        query.text_regex = regex_from_state(data['text_regex'])
+        query._byte_patterns = {}
+        return query
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_search_query_cached(*args):
+    return CompiledSearchQuery(*args)
+
+
+def compile_search_query(filename_patterns=("*",), text_pattern="", file_extensions=None,
+                         exclude_dirs=None, modified_after=None, modified_before=None,
+                         size_min=None, size_max=None, case_sensitive=False, use_regex=False,
+                         filename_query=None):
+    """
+    Получение подготовленного запроса из LRU-кэша.
+    Повторный поиск с теми же параметрами (например, сохраненный рецепт)
+    не тратит время на компиляцию выражений.
+    """
+    if isinstance(filename_patterns, str):
+        filename_patterns = (filename_patterns,)
+    return _compile_search_query_cached(
+        tuple(filename_patterns or ("*",)),
+        text_pattern or "",
+        tuple(file_extensions) if file_extensions else None,
+        frozenset(exclude_dirs) if exclude_dirs is not None else None,
+        modified_after, modified_before,
+        size_min, size_max,
+        bool(case_sensitive), bool(use_regex),
+        filename_query
+    )
+
+
+def build_search_query(query, file_patterns=None, exclude_patterns=None,
+                       case_sensitive=False, use_regex=False, filename_only=False, **filters):
+    """
+    Единая схема запроса для всех точек входа поиска (быстрый поиск,
+    поиск в папке, рецепты): строка запроса, шаблоны файлов, исключения
+    и флаги. В режиме filename_only запрос относится к имени файла
+    (шаблон с * и ?, подстрока или регулярное выражение), иначе - к содержимому.
+    Дополнительные фильтры (даты, размер, расширения) передаются как есть.
+    """
+    params = dict(filters)
+    params.update({
+        'filename_patterns': file_patterns or ("*",),
+        'exclude_dirs': exclude_patterns,
+        'case_sensitive': case_sensitive,
+        'use_regex': use_regex
+    })
+    if filename_only:
+        params['filename_query'] = query
+    else:
+        params['text_pattern'] = query
+    return compile_search_query(**params)
+
 
 class SearchManager:
-    def __init__(self):
+    # Размер начала файла для определения кодировки и двоичных файлов
+    SNIFF_SIZE = 8192
+    
+    def __init__(self, indexes_dir=None):
         self.search_results = []
         self.search_cancelled = False
+        # Причина остановки последнего поиска по лимиту (None - поиск полный)
+        self.search_truncated = None
+        # Причины остановки по лимиту по корням последнего search_projects
+        self.truncated_projects = {}
+        # Количество файлов из предыдущих прогонов для оценки прогресса
+        self.file_count_cache = {}
+        # Индексы имен файлов по корневым директориям; если задан
+        # indexes_dir, индексы сохраняются между сеансами
+        self.filename_indexes = {}
+        self.indexes_dir = indexes_dir
+        # Корни, индексы которых синхронизированы с диском в этом сеансе:
+        # сохраненный индекс не знает о файлах, созданных после его записи
+        self.refreshed_index_roots = set()
+    
+    def update_filename_index(self, root, file_paths, complete=True,
+                              excluded_dirs=DEFAULT_EXCLUDE_DIRS):
+        """
+        Синхронизация индекса имен файлов директории со списком путей
+        (например, из обхода ProjectAnalyzer). excluded_dirs - директории,
+        пропущенные при обходе: индекс используется только для запросов,
+        исключающих как минимум их.
+        """
+        root = os.path.abspath(root)
+        index = self.filename_indexes.get(root)
+        if index is None:
+            index = FilenameIndex(root)
+            index.build(file_paths, complete)
+            self.filename_indexes[root] = index
+        else:
+            index.update(file_paths, complete)
+        index.excluded_dirs = frozenset(excluded_dirs)
+        self.refreshed_index_roots.add(root)
+        
+        if self.indexes_dir:
+            index.save(FilenameIndex.storage_path(self.indexes_dir, root))
+        return index
+    
+    def get_filename_index(self, root):
+        """Индекс имен файлов директории (из памяти или сохраненный)"""
+        root = os.path.abspath(root)
+        index = self.filename_indexes.get(root)
+        if index is None and self.indexes_dir:
+            index = FilenameIndex.load(FilenameIndex.storage_path(self.indexes_dir, root))
+            if index is not None:
+                self.filename_indexes[root] = index
+        return index
+    
+    def _usable_index(self, directory, query):
+        """
+        Индекс, которым можно заменить обход директории для запроса:
+        только полный и обновленный в этом сеансе (загруженный с диска
+        индекс используется лишь для мгновенного поиска find_filenames)
+        """
+        if query.text_pattern:
+            return None
+        if os.path.abspath(directory) not in self.refreshed_index_roots:
+            return None
+        index = self.get_filename_index(directory)
+        if index is None or not index.complete:
+            return None
+        if not index.excluded_dirs <= query.exclude_dirs:
+            return None
+        return index
+    
+    def find_filenames(self, root, text, mode='fuzzy', limit=50):
+        """
+        Мгновенный поиск по индексу имен файлов: mode - 'prefix',
+        'substring' или 'fuzzy'. Возвращает результаты в общем формате
+        (пустой список, если индекса для директории нет)
+        """
+        index = self.get_filename_index(root)
+        if index is None:
+            return []
+        
+        if mode == 'prefix':
+            paths = index.lookup_prefix(text, limit)
+        elif mode == 'substring':
+            paths = index.lookup_substring(text, limit)
+        else:
+            paths = index.lookup_fuzzy(text, limit)
+        
+        results = []
+        for file_path in paths:
+            result = self._file_result(file_path)
+            if result:
+                results.append(result)
+        return results
+    
+    def _file_result(self, file_path, stat=None, text_matches=None):
+        """Результат поиска в общем формате (None, если файла уже нет)"""
+        if stat is None:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return None
+        return {
+            'path': file_path,
+            'name': os.path.basename(file_path),
+            'directory': os.path.dirname(file_path),
+            'size': stat.st_size,
+            'modified': datetime.fromtimestamp(stat.st_mtime),
+            'text_matches': text_matches or []
+        }
         
     def search_files(self, directories, filename_pattern="*", text_pattern="", 
                     file_extensions=None, exclude_dirs=None, 
                     modified_after=None, modified_before=None,
                     size_min=None, size_max=None, case_sensitive=False,
-                    use_regex=False, progress_callback=None):
+                    use_regex=False, progress_callback=None, result_callback=None,
+                    max_results=None, max_files=None, max_matches_per_file=None,
+                    max_total_matches=None, time_budget=None):
         """
         Массовый поиск файлов и текста
+        
+        result_callback вызывается для каждого найденного файла сразу,
+        не дожидаясь окончания поиска. max_results - синоним max_files.
         """
-        self.search_results = []
+        # Запрос подготавливается один раз на весь поиск
+        query = compile_search_query(
+            filename_patterns=filename_pattern,
+            text_pattern=text_pattern,
+            file_extensions=file_extensions,
+            exclude_dirs=exclude_dirs,
+            modified_after=modified_after,
+            modified_before=modified_before,
+            size_min=size_min,
+            size_max=size_max,
+            case_sensitive=case_sensitive,
+            use_regex=use_regex
+        )
+        return self.run_query(directories, query, progress_callback, result_callback,
+                              max_files=max_files or max_results,
+                              max_matches_per_file=max_matches_per_file,
+                              max_total_matches=max_total_matches,
+                              time_budget=time_budget)
+    
+    def run_query(self, directories, query, progress_callback=None, result_callback=None,
+                  max_files=None, max_matches_per_file=None, max_total_matches=None,
+                  time_budget=None, keep_results=True, cancel_event=None):
+        """
+        Поиск по подготовленному запросу (CompiledSearchQuery)
+        
+        Лимиты: max_files - число найденных файлов, max_matches_per_file и
+        max_total_matches - число текстовых совпадений, time_budget - время
+        поиска в секундах. Причина остановки по лимиту - в search_truncated.
+        При keep_results=False результаты только передаются в result_callback
+        (например, потоковому экспортеру) и не накапливаются в памяти.
+        cancel_event (threading.Event) отменяет только этот поиск.
+        """
+        results = self.search_results = []
+        found_files = 0
         self.search_cancelled = False
+        self.search_truncated = None
+        
+        should_pause = None
+        if time_budget:
+            deadline = time.monotonic() + time_budget
+            should_pause = lambda: time.monotonic() > deadline
+        
+        for result in self.iter_query(directories, query, progress_callback,
+                                      max_files=max_files,
+                                      max_matches_per_file=max_matches_per_file,
+                                      max_total_matches=max_total_matches,
+                                      should_pause=should_pause, cancel_event=cancel_event):
+            if result is None:
+                self.search_truncated = 'time_budget'
+                break
+            
+            found_files += 1
+            if keep_results:
+                results.append(result)
+            if result_callback:
+                result_callback(result)
         
-        if exclude_dirs is None:
-            exclude_dirs = {'.git', '__pycache__', 'node_modules', '.dart_tool', 'build'}
+        if progress_callback:
+            status = f"Поиск завершен. Найдено файлов: {found_files}"
+            if self.search_truncated:
+                status += " (достигнут лимит поиска)"
+            progress_callback(100, status)
         
-        total_files = 0
-        processed_files = 0
+        # Свой список: следующий поиск заменяет self.search_results
+        return results
+    
+    def search_in_files(self, query, path, file_patterns=None, exclude_patterns=None,
+                        case_sensitive=False, use_regex=False, filename_only=False,
+                        max_results=None, progress_callback=None, result_callback=None, **limits):
+        """
+        Синхронный поиск по единой схеме запроса (см. build_search_query).
+        path - директория или список директорий.
+        """
+        compiled = build_search_query(query, file_patterns, exclude_patterns,
+                                      case_sensitive, use_regex, filename_only)
+        directories = [path] if isinstance(path, str) else list(path)
+        return self.run_query(directories, compiled, progress_callback, result_callback,
+                              max_files=max_results, **limits)
+    
+    @staticmethod
+    def dedupe_roots(roots):
+        """
+        Корневые директории без повторов и вложенных друг в друга
+        (сравниваются реальные пути; несуществующие пропускаются)
+        """
+        unique = []
+        for root in sorted({os.path.realpath(r) for r in roots if os.path.isdir(r)}):
+            # После сортировки родитель всегда идет раньше вложенных директорий
+            if unique and os.path.commonpath([unique[-1], root]) == unique[-1]:
+                continue
+            unique.append(root)
+        return unique
+    
+    def search_projects(self, roots, query, progress_callback=None, result_callback=None,
+                        max_workers=None, keep_results=True, cancel_event=None,
+                        max_results=None, max_files=None, max_matches_per_file=None,
+                        max_total_matches=None, time_budget=None):
+        """
+        Параллельный поиск по нескольким проектам (например, по истории
+        директорий): вложенные и повторяющиеся корни объединяются, каждый
+        проект ищется в своем потоке (с индексом имен файлов, если он есть).
+        Результаты помечаются ключом 'project' и передаются в result_callback
+        по мере нахождения.
+        
+        Лимиты те же, что у search_files: max_files (синоним - max_results),
+        max_matches_per_file и max_total_matches действуют для каждого
+        проекта отдельно, time_budget - на весь поиск. Причины остановки
+        по лимиту по корням - в truncated_projects, их сводка - в search_truncated.
+        """
+        results = self.search_results = []
+        self.search_cancelled = False
+        self.search_truncated = None
+        truncated = self.truncated_projects = {}
         
-        # Подсчет общего количества файлов для прогресса
-        for directory in directories:
-            if not os.path.exists(directory):
+        roots = self.dedupe_roots(roots)
+        lock = threading.Lock()
+        state = {'found': 0, 'done': 0}
+        
+        should_pause = None
+        if time_budget:
+            deadline = time.monotonic() + time_budget
+            should_pause = lambda: time.monotonic() > deadline
+        
+        def search_root(root):
+            project = os.path.basename(root) or root
+            
+            def truncate(reason):
+                # У каждого потока своя причина остановки
+                truncated[root] = reason
+            
+            for result in self.iter_query([root], query,
+                                          max_files=max_files or max_results,
+                                          max_matches_per_file=max_matches_per_file,
+                                          max_total_matches=max_total_matches,
+                                          should_pause=should_pause, cancel_event=cancel_event,
+                                          on_truncated=truncate):
+                if result is None:
+                    truncate('time_budget')
+                    break
+                result['project'] = project
+                with lock:
+                    state['found'] += 1
+                    if keep_results:
+                        results.append(result)
+                    if result_callback:
+                        result_callback(result)
+            with lock:
+                state['done'] += 1
+                if progress_callback:
+                    progress_callback(state['done'] / len(roots) * 100,
+                                      f"Проектов обработано: {state['done']} из {len(roots)}, "
+                                      f"найдено файлов: {state['found']}")
+        
+        if roots:
+            workers = max_workers or min(len(roots), (os.cpu_count() or 1) + 4)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # result() пробрасывает исключения из потоков проектов
+                for future in [executor.submit(search_root, root) for root in roots]:
+                    future.result()
+        
+        if truncated:
+            self.search_truncated = ', '.join(sorted(set(truncated.values())))
+        
+        if progress_callback:
+            status = f"Поиск завершен. Проектов: {len(roots)}, найдено файлов: {state['found']}"
+            if self.search_truncated:
+                status += f" (достигнут лимит поиска в проектах: {len(truncated)})"
+            progress_callback(100, status)
+        
+        return results
+    
+    def start_search(self, directories, query, result_callback=None, progress_callback=None,
+                     done_callback=None, error_callback=None, multi_root=False, **limits):
+        """
+        Асинхронный поиск в отдельном потоке.
+        Все обратные вызовы выполняются в потоке поиска; GUI должен
+        передавать их в главный поток (например, через after).
+        done_callback(results) вызывается всегда, в том числе после ошибки.
+        При multi_root=True директории ищутся параллельно как отдельные
+        проекты (см. search_projects). Чтобы отмена не зависела от
+        следующих поисков, передайте свой cancel_event (threading.Event).
+        """
+        def worker():
+            results = []
+            try:
+                if multi_root:
+                    results = self.search_projects(directories, query, progress_callback,
+                                                   result_callback, **limits)
+                else:
+                    results = self.run_query(directories, query, progress_callback,
+                                             result_callback, **limits)
+            except Exception as e:
+                if error_callback:
+                    error_callback(e)
+            finally:
+                if done_callback:
+                    done_callback(results)
+        
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
+    
+    def flatten_results(self, results):
+        """Плоские строки результатов: файл без совпадений или по строке на совпадение"""
+        rows = []
+        for result in results:
+            if not result['text_matches']:
+                rows.append({'type': 'file', 'path': result['path'], 'size': result['size'],
+                             'line_number': '', 'content': ''})
                 continue
-            for root, dirs, files in os.walk(directory):
-                # Исключение директорий
-                dirs[:] = [d for d in dirs if d not in exclude_dirs]
-                total_files += len(files)
+            for match in result['text_matches']:
+                rows.append({'type': 'text', 'path': result['path'], 'size': result['size'],
+                             'line_number': match['line_number'], 'content': match['line_text']})
+        return rows
+    
+    def open_cursor(self, directories, query, page_time_budget=None, **limits):
+        """Постраничный поиск: следующая страница продолжает уже начатый обход"""
+        self.search_cancelled = False
+        self.search_truncated = None
+        return SearchCursor(self, directories, query, page_time_budget, **limits)
+    
+    def iter_query(self, directories, query, progress_callback=None, max_files=None,
+                   max_matches_per_file=None, max_total_matches=None, should_pause=None,
+                   cancel_event=None, on_truncated=None):
+        """
+        Генератор результатов поиска за один проход по директориям.
+        Когда should_pause() возвращает True, генератор отдает None;
+        следующий next() продолжает поиск с того же места.
+        Поиск прекращается после cancel_search() или cancel_event.set().
+        Причина остановки по лимиту передается в on_truncated(reason)
+        (по умолчанию записывается в search_truncated).
+        """
+        def cancelled():
+            return self.search_cancelled or (cancel_event is not None and cancel_event.is_set())
+        
+        if on_truncated is None:
+            on_truncated = functools.partial(setattr, self, 'search_truncated')
+        
+        processed_files = 0
+        found_files = 0
+        total_matches = 0
+        dirs_visited = 0
+        dirs_discovered = len(directories)
+        
+        # Общее количество файлов известно только по предыдущему прогону,
+        # поэтому поиск идет за один проход с адаптивной оценкой прогресса
+        count_key = (tuple(directories), query.exclude_dirs, query.exclude_regex)
+        cached_total = self.file_count_cache.get(count_key)
         
         # Поиск файлов
         for directory in directories:
             if not os.path.exists(directory):
                 continue
+            
+            # Поиск только по именам использует индекс вместо обхода диска
+            index = self._usable_index(directory, query)
+            if index is not None:
+                for result in self._iter_index_query(index, query, should_pause):
+                    if cancelled():
+                        return
+                    yield result
+                    if result is None:
+                        continue
+                    found_files += 1
+                    if max_files and found_files >= max_files:
+                        on_truncated('max_files')
+                        return
+                continue
                 
             for root, dirs, files in os.walk(directory):
-                if self.search_cancelled:
-                    break
+                if cancelled():
+                    return
                     
                 # Исключение директорий
-                dirs[:] = [d for d in dirs if d not in exclude_dirs]
+                dirs[:] = [d for d in dirs if not query.is_excluded_dir(d)]
+                dirs_visited += 1
+                dirs_discovered += len(dirs)
                 
                 for file in files:
-                    if self.search_cancelled:
-                        break
+                    if cancelled():
+                        return
+                    
+                    if should_pause and should_pause():
+                        yield None
                     
                     processed_files += 1
                     
                     # Обновление прогресса
                     if progress_callback and processed_files % 50 == 0:
-                        progress = (processed_files / total_files) * 100 if total_files > 0 else 0
-                        progress_callback(progress, f"Обработано файлов: {processed_files}/{total_files}")
+                        total_estimate = self._estimate_total_files(
+                            processed_files, dirs_visited, dirs_discovered, cached_total)
+                        progress = min(processed_files / total_estimate * 100, 99)
+                        progress_callback(progress, f"Обработано файлов: {processed_files} из ~{total_estimate}")
                     
                     file_path = os.path.join(root, file)
                     
-                    # Фильтр по имени файла
-                    if not fnmatch.fnmatch(file, filename_pattern):
+                    # Фильтры по имени файла и расширению
+                    if not query.match_name(file):
                         continue
                     
-                    # Фильтр по расширению
-                    if file_extensions:
-                        _, ext = os.path.splitext(file)
-                        if ext.lower() not in [e.lower() for e in file_extensions]:
-                            continue
-                    
                     try:
                         stat = os.stat(file_path)
                         
-                        # Фильтр по дате модификации
-                        if modified_after and datetime.fromtimestamp(stat.st_mtime) < modified_after:
-                            continue
-                        if modified_before and datetime.fromtimestamp(stat.st_mtime) > modified_before:
-                            continue
-                        
-                        # Фильтр по размеру файла
-                        if size_min and stat.st_size < size_min:
-                            continue
-                        if size_max and stat.st_size > size_max:
+                        # Фильтры по дате модификации и размеру файла
+                        if not query.match_stat(stat):
                             continue
                         
                         # Поиск текста в файле
                         text_matches = []
-                        if text_pattern:
-                            matches = self.search_text_in_file(file_path, text_pattern, 
-                                                             case_sensitive, use_regex)
+                        if query.text_pattern:
+                            file_limit = max_matches_per_file
+                            if max_total_matches:
+                                remaining = max_total_matches - total_matches
+                                file_limit = min(file_limit, remaining) if file_limit else remaining
+                            
+                            matches = self.search_query_in_file(file_path, query, file_limit)
                             if matches:
                                 text_matches = matches
                             else:
                                 continue  # Текст не найден, пропускаем файл
                         
-                        # Добавление результата
-                        result = {
-                            'path': file_path,
-                            'name': file,
-                            'directory': root,
-                            'size': stat.st_size,
-                            'modified': datetime.fromtimestamp(stat.st_mtime),
-                            'text_matches': text_matches
-                        }
-                        self.search_results.append(result)
-                        
                     except (OSError, PermissionError) as e:
                         continue
+                    
+                    found_files += 1
+                    total_matches += len(text_matches)
+                    
+                    yield self._file_result(file_path, stat, text_matches)
+                    
+                    # Ранняя остановка по лимитам
+                    if max_files and found_files >= max_files:
+                        on_truncated('max_files')
+                        return
+                    if max_total_matches and total_matches >= max_total_matches:
+                        on_truncated('max_total_matches')
+                        return
+        
+        if not cancelled():
+            self.file_count_cache[count_key] = processed_files
+    
+    def search_batch(self, directories, queries, progress_callback=None):
+        """
+        Выполнение нескольких запросов (например, рецептов) за один обход.
+        Каждый файл читается не более одного раза: фильтры имени, расширения,
+        даты и размера всех запросов проверяются по одному stat, а текст -
+        по одному прочитанному содержимому. Директория пропускается, только
+        если ее исключают все запросы.
+        Возвращает списки результатов в порядке запросов.
+        """
+        self.search_cancelled = False
+        self.search_truncated = None
+        batch_results = [[] for _ in queries]
+        all_queries = tuple(range(len(queries)))
+        processed_files = 0
+        dirs_visited = 0
+        dirs_discovered = len(directories)
+        
+        for directory in directories:
+            if not os.path.exists(directory):
+                continue
+            
+            # Запросы, для которых директория не исключена
+            active_queries = {directory: all_queries}
+            
+            for root, dirs, files in os.walk(directory):
+                if self.search_cancelled:
+                    return batch_results
+                
+                active = active_queries.pop(root)
+                kept_dirs = []
+                for d in dirs:
+                    child_active = tuple(i for i in active if not queries[i].is_excluded_dir(d))
+                    if child_active:
+                        kept_dirs.append(d)
+                        active_queries[os.path.join(root, d)] = child_active
+                dirs[:] = kept_dirs
+                dirs_visited += 1
+                dirs_discovered += len(dirs)
+                
+                for file in files:
+                    if self.search_cancelled:
+                        return batch_results
+                    
+                    processed_files += 1
+                    if progress_callback and processed_files % 50 == 0:
+                        total_estimate = self._estimate_total_files(
+                            processed_files, dirs_visited, dirs_discovered)
+                        progress = min(processed_files / total_estimate * 100, 99)
+                        progress_callback(progress, f"Обработано файлов: {processed_files} из ~{total_estimate}")
+                    
+                    matching = [i for i in active if queries[i].match_name(file)]
+                    if not matching:
+                        continue
+                    
+                    file_path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(file_path)
+                        matching = [i for i in matching if queries[i].match_stat(stat)]
+                        if not matching:
+                            continue
+                        
+                        content = encoding = None
+                        for i in matching:
+                            query = queries[i]
+                            text_matches = []
+                            if query.text_pattern:
+                                if query.text_regex is None:
+                                    continue
+                                if content is None:
+                                    # Файл читается один раз для всех запросов
+                                    with open(file_path, 'rb') as f:
+                                        prefix = f.read(self.SNIFF_SIZE)
+                                        encoding = self.detect_encoding(prefix)
+                                        content = prefix + f.read() if encoding else b''
+                                if not encoding:
+                                    continue  # Двоичный файл
+                                text_matches = self.match_content(content, encoding, query)
+                                if not text_matches:
+                                    continue
+                            
+                            batch_results[i].append(self._file_result(file_path, stat, text_matches))
+                    
+                    except (OSError, PermissionError):
+                        continue
         
         if progress_callback:
-            progress_callback(100, f"Поиск завершен. Найдено файлов: {len(self.search_results)}")
+            found = sum(len(results) for results in batch_results)
+            progress_callback(100, f"Пакетный поиск завершен. Файлов: {processed_files}, найдено: {found}")
         
-        return self.search_results
+        return batch_results
+    
+    def _iter_index_query(self, index, query, should_pause=None):
+        """Результаты запроса по именам файлов из индекса"""
+        for file_path in query.index_candidates(index):
+            if should_pause and should_pause():
+                yield None
+            
+            # Исключения по шаблонам проверяются по всем частям пути
+            rel_dirs = os.path.relpath(os.path.dirname(file_path), index.root)
+            if rel_dirs != '.' and any(query.is_excluded_dir(part) for part in rel_dirs.split(os.sep)):
+                continue
+            
+            if not query.match_name(os.path.basename(file_path)):
+                continue
+            
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue  # Файл удален после построения индекса
+            if not query.match_stat(stat):
+                continue
+            
+            yield self._file_result(file_path, stat)
+    
+    def _estimate_total_files(self, processed_files, dirs_visited, dirs_discovered, cached_total=None):
+        """Оценка общего количества файлов без предварительного обхода"""
+        if cached_total and cached_total > processed_files:
+            return cached_total
+        
+        # Среднее число файлов в уже пройденных директориях,
+        # умноженное на число найденных, но еще не пройденных
+        files_per_dir = processed_files / max(dirs_visited, 1)
+        pending_dirs = max(dirs_discovered - dirs_visited, 0)
+        return max(int(processed_files + files_per_dir * pending_dirs), processed_files + 1)
     
     def search_text_in_file(self, file_path, pattern, case_sensitive=False, use_regex=False):
         """Поиск текста в файле"""
+        query = compile_search_query(text_pattern=pattern, case_sensitive=case_sensitive,
+                                     use_regex=use_regex)
+        return self.search_query_in_file(file_path, query)
+    
+    def search_query_in_file(self, file_path, query, max_matches=None):
+        """Поиск текста подготовленного запроса в файле (не более max_matches совпадений)"""
         matches = []
+        if query.text_regex is None:
+            return matches
         
         try:
-            # Определение кодировки
-            encodings = ['utf-8', 'cp1251', 'latin1']
-            content = None
+            with open(file_path, 'rb') as f:
+                # Кодировка определяется один раз по началу файла,
+                # двоичные файлы пропускаются без чтения остального содержимого
+                prefix = f.read(self.SNIFF_SIZE)
+                encoding = self.detect_encoding(prefix)
+                if encoding is None:
+                    return matches
+                content = prefix + f.read()
             
-            for encoding in encodings:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        content = f.read()
-                    break
-                except UnicodeDecodeError:
+            return self.match_content(content, encoding, query, max_matches)
+        
+        except Exception as e:
+            pass
+        
+        return matches
+    
+    def match_content(self, content, encoding, query, max_matches=None):
+        """Поиск текста запроса в уже прочитанном содержимом файла"""
+        if query.use_regex:
+            text = self._decode_text(content, encoding)
+            return self._find_line_matches(text, query.text_regex, encoding,
+                                           max_matches=max_matches)
+        
+        # Простой текст ищется прямо в байтах, если это возможно
+        byte_regex = query.byte_regex(encoding)
+        if byte_regex is False:
+            return []
+        if byte_regex is not None:
+            # bytes.lower() не меняет длину, поэтому позиции совпадений
+            # в приведенной копии совпадают с позициями в исходных данных
+            haystack = content if query.case_sensitive else content.lower()
+            return self._find_line_matches(content, byte_regex, encoding, match_text=query.text_pattern,
+                                           first_per_line=True, haystack=haystack,
+                                           max_matches=max_matches)
+        
+        text = self._decode_text(content, encoding)
+        return self._find_line_matches(text, query.text_regex, encoding,
+                                       match_text=query.text_pattern, first_per_line=True,
+                                       max_matches=max_matches)
+    
+    def detect_encoding(self, prefix):
+        """Определение кодировки по началу файла (None для двоичных файлов)"""
+        if prefix.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if b'\x00' in prefix:
+            return None
+        
+        try:
+            # Последний символ может быть обрезан на границе префикса
+            codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        
+        try:
+            prefix.decode('cp1251')
+            return 'cp1251'
+        except UnicodeDecodeError:
+            return 'latin1'
+    
+    def _decode_text(self, content, encoding):
+        """Декодирование содержимого с универсальными переводами строк"""
+        text = content.decode(encoding, errors='replace')
+        if '\r' in text:
+            # Как при чтении в текстовом режиме: '$' в регулярных выражениях
+            # должен срабатывать и в файлах с переводами строк Windows
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+    
+    def _find_line_matches(self, content, regex, encoding, match_text=None,
+                           first_per_line=False, haystack=None, max_matches=None):
+        """
+        Поиск совпадений в содержимом файла (bytes или str).
+        Границы и номера строк вычисляются только вокруг найденных позиций.
+        haystack - копия содержимого той же длины, в которой выполняется поиск.
+        Поиск прекращается после max_matches совпадений.
+        """
+        if haystack is None:
+            haystack = content
+        
+        matches = []
+        is_bytes = isinstance(content, bytes)
+        newline = b'\n' if is_bytes else '\n'
+        
+        def decode(value):
+            return value.decode(encoding, errors='replace') if is_bytes else value
+        
+        line_number = 1
+        counted_to = 0
+        pos = 0
+        
+        while pos <= len(content):
+            if max_matches and len(matches) >= max_matches:
+                break
+            
+            match = regex.search(haystack, pos)
+            if not match:
+                break
+            
+            start = match.start()
+            line_start = content.rfind(newline, 0, start) + 1
+            line_end = content.find(newline, start)
+            if line_end == -1:
+                line_end = len(content)
+            
+            if match.end() > line_end:
+                # Совпадение не должно переходить на следующую строку
+                # (\s, [^x] и т.п.): повторный поиск только в пределах строки
+                match = regex.search(haystack, start, line_end)
+                if not match:
+                    pos = line_end + 1
                     continue
+                start = match.start()
             
-            if content is None:
-                return matches
+            line_number += content.count(newline, counted_to, line_start)
+            counted_to = line_start
             
-            lines = content.split('\n')
+            match_start = len(decode(content[line_start:start]))
+            found_text = decode(content[start:match.end()])
+            matches.append({
+                'line_number': line_number,
+                'line_text': decode(content[line_start:line_end]).strip(),
+                'match_start': match_start,
+                'match_end': match_start + len(found_text),
+                'match_text': match_text if match_text is not None else found_text
+            })
             
-            if use_regex:
-                flags = 0 if case_sensitive else re.IGNORECASE
-                try:
-                    regex = re.compile(pattern, flags)
-                except re.error:
-                    return matches
-                
-                for line_num, line in enumerate(lines, 1):
-                    for match in regex.finditer(line):
-                        matches.append({
-                            'line_number': line_num,
-                            'line_text': line.strip(),
-                            'match_start': match.start(),
-                            'match_end': match.end(),
-                            'match_text': match.group()
-                        })
+            if first_per_line:
+                # Для простого текста достаточно одного совпадения на строку
+                pos = line_end + 1
             else:
-                search_pattern = pattern if case_sensitive else pattern.lower()
-                
-                for line_num, line in enumerate(lines, 1):
-                    search_line = line if case_sensitive else line.lower()
-                    if search_pattern in search_line:
-                        matches.append({
-                            'line_number': line_num,
-                            'line_text': line.strip(),
-                            'match_start': search_line.find(search_pattern),
-                            'match_end': search_line.find(search_pattern) + len(search_pattern),
-                            'match_text': pattern
-                        })
-        
-        except Exception as e:
-            pass
+                pos = match.end() if match.end() > start else start + 1
         
         return matches
     
@@ -181,24 +1025,93 @@ class SearchManager:
     
     def format_file_size(self, size_bytes):
         """Форматирование размера файла"""
-        if size_bytes < 1024:
-            return f"{size_bytes} Б"
-        elif size_bytes < 1024 * 1024:
-            return f"{size_bytes / 1024:.1f} КБ"
-        elif size_bytes < 1024 * 1024 * 1024:
-            return f"{size_bytes / (1024 * 1024):.1f} МБ"
-        else:
-            return f"{size_bytes / (1024 * 1024 * 1024):.1f} ГБ"
+        return format_file_size(size_bytes)
+
+
+class SearchCursor:
+    """
+    Курсор постраничного поиска. Обход директорий приостанавливается
+    между страницами, поэтому следующая страница не запускает поиск заново.
+    """
+    
+    def __init__(self, search_manager, directories, query, page_time_budget=None, **limits):
+        self.search_manager = search_manager
+        self.page_time_budget = page_time_budget
+        self.exhausted = False
+        self.returned = 0
+        self._page_deadline = None
+        self._results = search_manager.iter_query(directories, query,
+                                                  should_pause=self._page_expired, **limits)
+    
+    def _page_expired(self):
+        return self._page_deadline is not None and time.monotonic() > self._page_deadline
+    
+    @property
+    def has_more(self):
+        """Есть ли еще результаты"""
+        return not self.exhausted
+    
+    @property
+    def truncated(self):
+        """Причина остановки по лимиту, если поиск завершен не полностью"""
+        return self.search_manager.search_truncated if self.exhausted else None
+    
+    def next_page(self, page_size=100):
+        """
+        Следующая страница результатов (не более page_size файлов).
+        Страница может быть короче, если истекло page_time_budget секунд.
+        """
+        page = []
+        if self.exhausted:
+            return page
+        
+        if self.page_time_budget:
+            self._page_deadline = time.monotonic() + self.page_time_budget
+        
+        while len(page) < page_size:
+            try:
+                result = next(self._results)
+            except StopIteration:
+                self.exhausted = True
+                break
+            if result is None:
+                break  # Время страницы истекло, поиск продолжится со следующей
+            page.append(result)
+        
+        self.returned += len(page)
+        return page
+    
+    def close(self):
+        """Прекращение поиска"""
+        self._results.close()
+        self.exhausted = True
 
 
 class SearchDialog:
-    def __init__(self, parent, search_manager, settings_manager):
+    # Потоковая выдача результатов: ограниченная очередь между потоком
+    # поиска и UI, которую UI разбирает порциями по RESULTS_BATCH_ROWS строк
+    RESULTS_QUEUE_SIZE = 1000
+    RESULTS_BATCH_ROWS = 200
+    RESULTS_POLL_MS = 50
+    
+    def __init__(self, parent, search_manager, settings_manager, initial_directory=None,
+                 results_callback=None):
         self.parent = parent
         self.search_manager = search_manager
         self.settings_manager = settings_manager
+        self.results_callback = results_callback
         self.search_thread = None
+        # Отмена текущего поиска: у каждого поиска свое событие, поэтому
+        # следующий поиск не возобновляет отмененный
+        self.cancel_event = None
+        self.results_queue = None
+        self.search_finished = False
+        self.last_results = []
+        self.last_query = ""
+        self.closed = False
         
         self.dialog = tk.Toplevel(parent)
+        self.dialog.protocol("WM_DELETE_WINDOW", self.close)
         self.dialog.title("Поиск файлов и текста")
         self.dialog.geometry("900x700")
         self.dialog.resizable(True, True)
@@ -208,6 +1121,8 @@ class SearchDialog:
         self.dialog.grab_set()
         
         self.create_interface()
+        if initial_directory:
+            self.directories_listbox.insert(tk.END, initial_directory)
         self.center_dialog()
     
     def center_dialog(self):
@@ -258,7 +1173,9 @@ class SearchDialog:
         dirs_buttons_frame.pack(fill=tk.X, padx=5, pady=(0, 5))
         
         ttk.Button(dirs_buttons_frame, text="Добавить", command=self.add_directory).pack(side=tk.LEFT, padx=(0, 5))
-        ttk.Button(dirs_buttons_frame, text="Удалить", command=self.remove_directory).pack(side=tk.LEFT)
+        ttk.Button(dirs_buttons_frame, text="Удалить", command=self.remove_directory).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(dirs_buttons_frame, text="Проекты из истории",
+                   command=self.add_history_directories).pack(side=tk.LEFT)
         
         # Фильтры файлов
         files_frame = ttk.LabelFrame(scrollable_frame, text="Фильтры файлов")
@@ -335,6 +1252,7 @@ class SearchDialog:
         self.cancel_button.pack(side=tk.LEFT, padx=(0, 5))
         
         ttk.Button(buttons_frame, text="💾 Сохранить результаты", command=self.save_results).pack(side=tk.RIGHT)
+        ttk.Button(buttons_frame, text="📤 Поиск в файл", command=self.export_search).pack(side=tk.RIGHT, padx=(0, 5))
         
         # Прогресс-бар
         self.progress_var = tk.DoubleVar()
@@ -401,19 +1319,30 @@ class SearchDialog:
         if directory:
             self.directories_listbox.insert(tk.END, directory)
     
+    def add_history_directories(self):
+        """Добавление всех проектов из истории директорий"""
+        history = self.settings_manager.db_manager.get_directory_history(limit=20)
+        current = set(self.directories_listbox.get(0, tk.END))
+        for entry in history:
+            if entry['directory_path'] not in current:
+                self.directories_listbox.insert(tk.END, entry['directory_path'])
+    
     def remove_directory(self):
         """Удаление директории из списка"""
         selection = self.directories_listbox.curselection()
         if selection:
             self.directories_listbox.delete(selection[0])
     
-    def start_search(self):
-        """Начало поиска"""
+    def build_query(self):
+        """
+        Директории и запрос из полей диалога (запрос подготавливается
+        в главном потоке). None, если параметры некорректны.
+        """
         # Получение директорий
         directories = [self.directories_listbox.get(i) for i in range(self.directories_listbox.size())]
         if not directories:
             messagebox.showwarning("Предупреждение", "Выберите хотя бы одну директорию для поиска")
-            return
+            return None
         
         # Подготовка параметров
         filename_pattern = self.filename_pattern.get() or "*"
@@ -434,7 +1363,7 @@ class SearchDialog:
                 size_max = int(self.size_max_var.get())
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректный размер файла")
-            return
+            return None
         
         # Даты
         date_after = None
@@ -446,13 +1375,35 @@ class SearchDialog:
                 date_before = datetime.strptime(self.date_before_var.get(), "%d.%m.%Y")
         except ValueError:
             messagebox.showerror("Ошибка", "Некорректный формат даты (дд.мм.гггг)")
-            return
+            return None
         
         # Исключения
         exclude_dirs = set()
         if self.exclude_dirs.get():
             exclude_dirs = {d.strip() for d in self.exclude_dirs.get().split(',')}
         
+        query = compile_search_query(
+            filename_patterns=filename_pattern,
+            text_pattern=text_pattern,
+            file_extensions=extensions,
+            exclude_dirs=exclude_dirs,
+            modified_after=date_after,
+            modified_before=date_before,
+            size_min=size_min,
+            size_max=size_max,
+            case_sensitive=self.case_sensitive.get(),
+            use_regex=self.use_regex.get()
+        )
+        self.last_query = text_pattern or filename_pattern
+        return directories, query
+    
+    def start_search(self):
+        """Начало поиска"""
+        prepared = self.build_query()
+        if not prepared:
+            return
+        directories, query = prepared
+        
         # Включение режима поиска
         self.search_button.config(state="disabled")
         self.cancel_button.config(state="normal")
@@ -462,111 +1413,194 @@ class SearchDialog:
         for item in self.results_tree.get_children():
             self.results_tree.delete(item)
         
+        # Состояние потоковой выдачи результатов
+        self.results_queue = queue.Queue(maxsize=self.RESULTS_QUEUE_SIZE)
+        self.search_finished = False
+        self.directory_items = {}
+        self.pending_matches = None
+        self.shown_files = 0
+        self.shown_matches = 0
+        self.stats_label.config(text="Результатов не найдено")
+        
         # Запуск поиска в отдельном потоке
-        self.search_thread = threading.Thread(
-            target=self._search_worker,
-            args=(directories, filename_pattern, text_pattern, extensions,
-                  exclude_dirs, date_after, date_before, size_min, size_max)
+        results_queue = self.results_queue
+        cancel_event = self.cancel_event = threading.Event()
+        self.search_thread = self.search_manager.start_search(
+            directories, query,
+            result_callback=lambda result: self._enqueue_result(results_queue, result),
+            progress_callback=self._progress_callback(cancel_event),
+            done_callback=lambda results: self._search_done(results_queue, results),
+            error_callback=self._error_callback(cancel_event),
+            multi_root=len(directories) > 1,
+            cancel_event=cancel_event
         )
-        self.search_thread.daemon = True
-        self.search_thread.start()
+        
+        self.dialog.after(self.RESULTS_POLL_MS, self._drain_results, self.results_queue)
+    
+    def _search_done(self, results_queue, results):
+        """Окончание поиска (вызывается в потоке поиска)"""
+        if results_queue is not self.results_queue:
+            return  # Поиск отменен, окно закрыто или уже идет следующий поиск
+        self.last_results = results
+        # Маркер окончания поиска
+        self._enqueue_result(results_queue, None)
     
-    def _search_worker(self, directories, filename_pattern, text_pattern, extensions,
-                      exclude_dirs, date_after, date_before, size_min, size_max):
-        """Рабочий поток поиска"""
+    def _enqueue_result(self, results_queue, result):
+        """Передача результата в UI (блокируется, пока очередь заполнена)"""
+        while True:
+            try:
+                results_queue.put(result, timeout=0.1)
+                return
+            except queue.Full:
+                # После отмены или закрытия окна очередь больше не разбирается,
+                # поэтому ни результаты, ни маркер окончания уже не нужны
+                if results_queue is not self.results_queue:
+                    return
+    
+    def _call_in_ui(self, callback, *args):
+        """Вызов в главном потоке из потока поиска (после закрытия окна - ничего)"""
+        if self.closed:
+            return
         try:
-            results = self.search_manager.search_files(
-                directories=directories,
-                filename_pattern=filename_pattern,
-                text_pattern=text_pattern,
-                file_extensions=extensions,
-                exclude_dirs=exclude_dirs,
-                modified_after=date_after,
-                modified_before=date_before,
-                size_min=size_min,
-                size_max=size_max,
-                case_sensitive=self.case_sensitive.get(),
-                use_regex=self.use_regex.get(),
-                progress_callback=self.update_progress
-            )
-            
-            # Обновление результатов в главном потоке
-            self.dialog.after(0, self.update_results, results)
-            
-        except Exception as e:
-            self.dialog.after(0, self.search_error, str(e))
+            self.dialog.after(0, callback, *args)
+        except (tk.TclError, RuntimeError):
+            pass  # Окно закрыто во время вызова
     
     def update_progress(self, progress, status):
         """Обновление прогресса поиска"""
-        self.dialog.after(0, self._update_progress_ui, progress, status)
+        self._call_in_ui(self._update_progress_ui, progress, status)
+    
+    def _progress_callback(self, cancel_event):
+        """Прогресс поиска, который перестает обновлять окно после его отмены"""
+        def callback(progress, status):
+            if not cancel_event.is_set():
+                self.update_progress(progress, status)
+        return callback
+    
+    def _error_callback(self, cancel_event):
+        """Ошибка поиска, о которой не сообщается после его отмены"""
+        def callback(error):
+            if not cancel_event.is_set():
+                self._call_in_ui(self.search_error, str(error))
+        return callback
     
     def _update_progress_ui(self, progress, status):
         """Обновление UI прогресса"""
         self.progress_var.set(progress)
         self.status_label.config(text=status)
     
-    def update_results(self, results):
-        """Обновление результатов поиска"""
-        # Группировка по директориям
-        directories = {}
+    def _drain_results(self, results_queue):
+        """Вставка очередной порции результатов в дерево"""
+        # Очередь устаревшего поиска больше не разбирается
+        if results_queue is not self.results_queue:
+            return
         
-        for result in results:
-            dir_path = result['directory']
-            if dir_path not in directories:
-                directories[dir_path] = []
-            directories[dir_path].append(result)
-        
-        # Заполнение дерева
-        for dir_path, files in directories.items():
-            # Добавление директории
+        rows_left = self.RESULTS_BATCH_ROWS
+        while rows_left > 0:
+            if self.pending_matches:
+                rows_left -= self._insert_pending_matches(rows_left)
+                continue
+            
+            try:
+                result = results_queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if result is None:
+                self.finish_results()
+                return
+            
+            self._insert_file_result(result)
+            rows_left -= 1
+        
+        self._update_results_stats()
+        self.dialog.after(self.RESULTS_POLL_MS, self._drain_results, results_queue)
+    
+    def _insert_file_result(self, file_result):
+        """Добавление строки файла (и его директории при необходимости)"""
+        # Группировка по директориям
+        dir_path = file_result['directory']
+        dir_item = self.directory_items.get(dir_path)
+        if dir_item is None:
             dir_item = self.results_tree.insert("", tk.END, text="📁", values=(
                 os.path.basename(dir_path) or dir_path,
                 dir_path,
-                f"{len(files)} файлов",
+                "",
                 "",
                 ""
             ))
+            self.directory_items[dir_path] = [dir_item, 0]
             
-            # Добавление файлов
-            for file_result in files:
-                match_count = len(file_result['text_matches'])
-                match_text = f"{match_count} совпадений" if match_count > 0 else ""
-                
-                file_item = self.results_tree.insert(dir_item, tk.END, text="📄", values=(
-                    file_result['name'],
-                    file_result['path'],
-                    self.search_manager.format_file_size(file_result['size']),
-                    file_result['modified'].strftime("%d.%m.%Y %H:%M"),
-                    match_text
-                ))
-                
-                # Добавление совпадений текста
-                for match in file_result['text_matches']:
-                    self.results_tree.insert(file_item, tk.END, text="🔍", values=(
-                        f"Строка {match['line_number']}",
-                        match['line_text'][:100] + "..." if len(match['line_text']) > 100 else match['line_text'],
-                        "",
-                        "",
-                        match['match_text']
-                    ))
-        
-        # Обновление статистики
-        total_files = len(results)
-        total_matches = sum(len(r['text_matches']) for r in results)
-        
-        stats_text = f"Найдено файлов: {total_files}"
-        if total_matches > 0:
-            stats_text += f", текстовых совпадений: {total_matches}"
+            # Разворачивание первых результатов
+            if len(self.directory_items) <= 5:
+                self.results_tree.item(dir_item, open=True)
+        else:
+            dir_item = dir_item[0]
+        
+        self.directory_items[dir_path][1] += 1
+        self.results_tree.set(dir_item, "Размер", f"{self.directory_items[dir_path][1]} файлов")
+        
+        match_count = len(file_result['text_matches'])
+        match_text = f"{match_count} совпадений" if match_count > 0 else ""
+        
+        file_item = self.results_tree.insert(dir_item, tk.END, text="📄", values=(
+            file_result['name'],
+            file_result['path'],
+            self.search_manager.format_file_size(file_result['size']),
+            file_result['modified'].strftime("%d.%m.%Y %H:%M"),
+            match_text
+        ))
+        
+        self.shown_files += 1
+        self.shown_matches += match_count
+        if file_result['text_matches']:
+            # Совпадения вставляются следующими порциями
+            self.pending_matches = (file_item, iter(file_result['text_matches']))
+    
+    def _insert_pending_matches(self, max_rows):
+        """Добавление совпадений текста текущего файла, не более max_rows строк"""
+        file_item, matches = self.pending_matches
+        inserted = 0
+        
+        for match in matches:
+            self.results_tree.insert(file_item, tk.END, text="🔍", values=(
+                f"Строка {match['line_number']}",
+                match['line_text'][:100] + "..." if len(match['line_text']) > 100 else match['line_text'],
+                "",
+                "",
+                match['match_text']
+            ))
+            inserted += 1
+            if inserted >= max_rows:
+                return inserted
+        
+        self.pending_matches = None
+        # Пустой итератор тоже считается строкой, чтобы цикл порции завершался
+        return max(inserted, 1)
+    
+    def _update_results_stats(self):
+        """Обновление статистики по уже показанным результатам"""
+        if not self.shown_files:
+            return
+        
+        stats_text = f"Найдено файлов: {self.shown_files}"
+        if self.shown_matches > 0:
+            stats_text += f", текстовых совпадений: {self.shown_matches}"
         
         self.stats_label.config(text=stats_text)
+    
+    def finish_results(self):
+        """Завершение потоковой выдачи результатов"""
+        self.search_finished = True
+        self._update_results_stats()
         
         # Восстановление кнопок
         self.search_button.config(state="normal")
         self.cancel_button.config(state="disabled")
         
-        # Разворачивание первых результатов
-        for item in self.results_tree.get_children()[:5]:
-            self.results_tree.item(item, open=True)
+        # Передача результатов в главное окно
+        if self.results_callback:
+            self.results_callback(self.last_results, self.last_query)
     
     def search_error(self, error_message):
         """Обработка ошибки поиска"""
@@ -577,11 +1611,22 @@ class SearchDialog:
     
     def cancel_search(self):
         """Отмена поиска"""
-        self.search_manager.cancel_search()
+        if self.cancel_event:
+            self.cancel_event.set()
+        # Очередь отмененного поиска больше не разбирается
+        self.results_queue = None
         self.search_button.config(state="normal")
         self.cancel_button.config(state="disabled")
         self.status_label.config(text="Поиск отменен")
     
+    def close(self):
+        """Закрытие окна: поиск отменяется, его очередь результатов бросается"""
+        if self.cancel_event:
+            self.cancel_event.set()
+        self.results_queue = None
+        self.closed = True
+        self.dialog.destroy()
+    
     def show_context_menu(self, event):
         """Показ контекстного меню"""
         item = self.results_tree.selection()[0] if self.results_tree.selection() else None
@@ -612,8 +1657,16 @@ class SearchDialog:
             self.dialog.clipboard_append(file_path)
             messagebox.showinfo("Скопировано", "Путь к файлу скопирован в буфер обмена")
     
+    EXPORT_FILETYPES = [
+        ("Текстовые файлы", "*.txt"),
+        ("CSV файлы", "*.csv"),
+        ("JSON Lines", "*.jsonl"),
+        ("Формат grep", "*.grep"),
+        ("Все файлы", "*.*")
+    ]
+    
     def save_results(self):
-        """Сохранение результатов поиска"""
+        """Сохранение результатов поиска (формат - по расширению файла)"""
         if not hasattr(self.search_manager, 'search_results') or not self.search_manager.search_results:
             messagebox.showwarning("Предупреждение", "Нет результатов для сохранения")
             return
@@ -621,29 +1674,74 @@ class SearchDialog:
         file_path = filedialog.asksaveasfilename(
             title="Сохранить результаты поиска",
             defaultextension=".txt",
-            filetypes=[("Текстовые файлы", "*.txt"), ("CSV файлы", "*.csv"), ("Все файлы", "*.*")]
+            filetypes=self.EXPORT_FILETYPES
         )
         
         if file_path:
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write("Результаты поиска файлов\n")
-                    f.write("=" * 50 + "\n\n")
-                    
+                with open_result_writer(file_path) as writer:
                     for result in self.search_manager.search_results:
-                        f.write(f"Файл: {result['name']}\n")
-                        f.write(f"Путь: {result['path']}\n")
-                        f.write(f"Размер: {self.search_manager.format_file_size(result['size'])}\n")
-                        f.write(f"Изменен: {result['modified'].strftime('%d.%m.%Y %H:%M')}\n")
-                        
-                        if result['text_matches']:
-                            f.write("Текстовые совпадения:\n")
-                            for match in result['text_matches']:
-                                f.write(f"  Строка {match['line_number']}: {match['line_text']}\n")
-                        
-                        f.write("\n" + "-" * 50 + "\n\n")
+                        writer.write(result)
                 
                 messagebox.showinfo("Успех", f"Результаты сохранены в файл:\n{file_path}")
                 
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{str(e)}")
+    
+    def export_search(self):
+        """
+        Поиск с записью результатов сразу в файл: результаты не
+        накапливаются в памяти и не выводятся в дерево
+        """
+        prepared = self.build_query()
+        if not prepared:
+            return
+        directories, query = prepared
+        
+        file_path = filedialog.asksaveasfilename(
+            title="Записать результаты поиска в файл",
+            defaultextension=".csv",
+            filetypes=self.EXPORT_FILETYPES
+        )
+        if not file_path:
+            return
+        
+        try:
+            writer = open_result_writer(file_path)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось создать файл:\n{str(e)}")
+            return
+        
+        self.search_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.progress_var.set(0)
+        self.status_label.config(text=f"Запись результатов в {os.path.basename(file_path)}...")
+        
+        cancel_event = self.cancel_event = threading.Event()
+        
+        def done(results):
+            writer.close()
+            if not cancel_event.is_set():
+                self._call_in_ui(self.export_done, writer)
+        
+        self.search_thread = self.search_manager.start_search(
+            directories, query,
+            result_callback=writer,
+            progress_callback=self._progress_callback(cancel_event),
+            done_callback=done,
+            error_callback=self._error_callback(cancel_event),
+            keep_results=False,
+            multi_root=len(directories) > 1,
+            cancel_event=cancel_event
+        )
+    
+    def export_done(self, writer):
+        """Окончание поиска с записью в файл"""
+        self.search_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+        
+        status = (f"Записано файлов: {writer.files_written}, "
+                  f"совпадений: {writer.matches_written} ({detect_export_format(writer.file_path)})")
+        if self.search_manager.search_truncated:
+            status += " - достигнут лимит поиска"
+        self.status_label.config(text=status)
@@ -9,79 +9,95 @@ import os
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from database_manager import DatabaseManager
+from search_manager import CompiledSearchQuery, build_search_query
+
 
 class SearchRecipesManager:
     """Менеджер для сохранения и загрузки рецептов поиска"""
     
+    # Файл рецептов прежних версий, переносится в БД при первом запуске
+    LEGACY_RECIPES_FILE = "search_recipes.json"
+    MIGRATED_SETTING = "search_recipes_migrated"
+    
     def __init__(self, db_manager=None):
-        self.db_manager = db_manager
-        self.recipes_file = "search_recipes.json"
+        self.db_manager = db_manager or DatabaseManager()
+        self.recipes_file = self.LEGACY_RECIPES_FILE
+        # Подготовленные запросы рецептов по id
+        self.compiled_queries = {}
         self.recipes = self.load_recipes()
     
-    def load_recipes(self) -> Dict:
-        """Загрузка рецептов поиска из файла"""
+    def load_recipes(self) -> List[Dict]:
+        """Загрузка рецептов поиска из БД (с переносом из JSON при первом запуске)"""
         try:
-            if os.path.exists(self.recipes_file):
-                with open(self.recipes_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            if not self.db_manager.get_setting(self.MIGRATED_SETTING, False):
+                self.migrate_recipes()
+            return self.db_manager.get_search_recipes()
         except Exception as e:
             print(f"Ошибка загрузки рецептов поиска: {e}")
-        
-        # Возвращаем рецепты по умолчанию
-        return {
-            "recipes": [
-                {
-                    "name": "Поиск Dart файлов",
-                    "description": "Поиск по Dart файлам проекта",
-                    "query": "*.dart",
-                    "file_patterns": ["*.dart"],
-                    "exclude_patterns": [".dart_tool", "build"],
-                    "case_sensitive": False,
-                    "use_regex": False,
-                    "filename_only": True,
-                    "created_date": datetime.now().isoformat(),
-                    "usage_count": 0
-                },
-                {
-                    "name": "Поиск TODO комментариев",
-                    "description": "Поиск TODO, FIXME, HACK комментариев",
-                    "query": "(TODO|FIXME|HACK)",
-                    "file_patterns": ["*.dart", "*.py", "*.js", "*.ts"],
-                    "exclude_patterns": [".git", "node_modules", ".dart_tool", "build"],
-                    "case_sensitive": False,
-                    "use_regex": True,
-                    "filename_only": False,
-                    "created_date": datetime.now().isoformat(),
-                    "usage_count": 0
-                },
-                {
-                    "name": "Поиск конфигурационных файлов",
-                    "description": "Поиск YAML, JSON конфигурационных файлов",
-                    "query": "*",
-                    "file_patterns": ["*.yaml", "*.yml", "*.json"],
-                    "exclude_patterns": [".git", "node_modules", ".dart_tool", "build"],
-                    "case_sensitive": False,
-                    "use_regex": False,
-                    "filename_only": True,
-                    "created_date": datetime.now().isoformat(),
-                    "usage_count": 0
-                }
-            ]
-        }
+            return []
     
-    def save_recipes(self):
-        """Сохранение рецептов поиска в файл"""
-        try:
-            with open(self.recipes_file, 'w', encoding='utf-8') as f:
-                json.dump(self.recipes, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            print(f"Ошибка сохранения рецептов поиска: {e}")
-            return False
+    def migrate_recipes(self):
+        """Перенос рецептов из search_recipes.json (или рецептов по умолчанию) в БД"""
+        if not self.db_manager.get_search_recipes():
+            recipes = None
+            if os.path.exists(self.recipes_file):
+                try:
+                    with open(self.recipes_file, 'r', encoding='utf-8') as f:
+                        recipes = json.load(f).get("recipes", [])
+                except Exception as e:
+                    print(f"Ошибка чтения файла рецептов поиска: {e}")
+            if recipes is None:
+                recipes = self.default_recipes()
+            if self.db_manager.add_search_recipes(recipes) is None:
+                return False
+        
+        # Файл больше не используется, но остается как резервная копия
+        if os.path.exists(self.recipes_file):
+            try:
+                os.replace(self.recipes_file, self.recipes_file + ".bak")
+            except OSError as e:
+                print(f"Ошибка переименования файла рецептов поиска: {e}")
+        return self.db_manager.save_setting(self.MIGRATED_SETTING, True)
+    
+    def default_recipes(self) -> List[Dict]:
+        """Рецепты поиска по умолчанию"""
+        return [
+            {
+                "name": "Поиск Dart файлов",
+                "description": "Поиск по Dart файлам проекта",
+                "query": "*.dart",
+                "file_patterns": ["*.dart"],
+                "exclude_patterns": [".dart_tool", "build"],
+                "case_sensitive": False,
+                "use_regex": False,
+                "filename_only": True
+            },
+            {
+                "name": "Поиск TODO комментариев",
+                "description": "Поиск TODO, FIXME, HACK комментариев",
+                "query": "(TODO|FIXME|HACK)",
+                "file_patterns": ["*.dart", "*.py", "*.js", "*.ts"],
+                "exclude_patterns": [".git", "node_modules", ".dart_tool", "build"],
+                "case_sensitive": False,
+                "use_regex": True,
+                "filename_only": False
+            },
+            {
+                "name": "Поиск конфигурационных файлов",
+                "description": "Поиск YAML, JSON конфигурационных файлов",
+                "query": "*",
+                "file_patterns": ["*.yaml", "*.yml", "*.json"],
+                "exclude_patterns": [".git", "node_modules", ".dart_tool", "build"],
+                "case_sensitive": False,
+                "use_regex": False,
+                "filename_only": True
+            }
+        ]
     
     def get_recipes(self) -> List[Dict]:
         """Получение списка всех рецептов"""
-        return self.recipes.get("recipes", [])
+        return self.recipes
     
     def add_recipe(self, name: str, description: str, query: str, 
                    file_patterns: List[str] = None, exclude_patterns: List[str] = None,
@@ -99,11 +115,16 @@ class SearchRecipesManager:
                 "use_regex": use_regex,
                 "filename_only": filename_only,
                 "created_date": datetime.now().isoformat(),
-                "usage_count": 0
+                "usage_count": 0,
+                "last_used": None
             }
             
-            self.recipes["recipes"].append(recipe)
-            return self.save_recipes()
+            ids = self.db_manager.add_search_recipes([recipe])
+            if not ids:
+                return False
+            recipe["id"] = ids[0]
+            self.recipes.append(recipe)
+            return True
         except Exception as e:
             print(f"Ошибка добавления рецепта: {e}")
             return False
@@ -114,9 +135,9 @@ class SearchRecipesManager:
                       filename_only: bool = False) -> bool:
         """Обновление существующего рецепта"""
         try:
-            if 0 <= index < len(self.recipes["recipes"]):
-                recipe = self.recipes["recipes"][index]
-                recipe.update({
+            if 0 <= index < len(self.recipes):
+                recipe = self.recipes[index]
+                changes = {
                     "name": name,
                     "description": description,
                     "query": query,
@@ -125,8 +146,12 @@ class SearchRecipesManager:
                     "case_sensitive": case_sensitive,
                     "use_regex": use_regex,
                     "filename_only": filename_only
-                })
-                return self.save_recipes()
+                }
+                if not self.db_manager.update_search_recipe(recipe["id"], changes):
+                    return False
+                recipe.update(changes)
+                self.compiled_queries.pop(recipe["id"], None)
+                return True
             return False
         except Exception as e:
             print(f"Ошибка обновления рецепта: {e}")
@@ -135,9 +160,13 @@ class SearchRecipesManager:
     def delete_recipe(self, index: int) -> bool:
         """Удаление рецепта по индексу"""
         try:
-            if 0 <= index < len(self.recipes["recipes"]):
-                del self.recipes["recipes"][index]
-                return self.save_recipes()
+            if 0 <= index < len(self.recipes):
+                recipe_id = self.recipes[index]["id"]
+                if not self.db_manager.delete_search_recipe(recipe_id):
+                    return False
+                del self.recipes[index]
+                self.compiled_queries.pop(recipe_id, None)
+                return True
             return False
         except Exception as e:
             print(f"Ошибка удаления рецепта: {e}")
@@ -146,19 +175,69 @@ class SearchRecipesManager:
     def get_recipe(self, index: int) -> Optional[Dict]:
         """Получение рецепта по индексу"""
         try:
-            if 0 <= index < len(self.recipes["recipes"]):
-                return self.recipes["recipes"][index]
+            if 0 <= index < len(self.recipes):
+                return self.recipes[index]
             return None
         except Exception as e:
             print(f"Ошибка получения рецепта: {e}")
             return None
     
+    def get_compiled_query(self, index: int):
+        """
+        Подготовленный поисковый запрос для рецепта.
+        Результат компиляции хранится в БД рядом с рецептом, поэтому
+        запуск сохраненного рецепта - один поиск по первичному ключу.
+        """
+        recipe = self.get_recipe(index)
+        if recipe is None:
+            return None
+        
+        recipe_id = recipe["id"]
+        compiled = self.compiled_queries.get(recipe_id)
+        if compiled is None:
+            compiled = CompiledSearchQuery.from_cache(
+                self.db_manager.get_search_recipe_compiled(recipe_id))
+        if compiled is None:
+            compiled = build_search_query(
+                recipe.get("query", ""),
+                file_patterns=recipe.get("file_patterns"),
+                exclude_patterns=recipe.get("exclude_patterns") or [],
+                case_sensitive=recipe.get("case_sensitive", False),
+                use_regex=recipe.get("use_regex", False),
+                filename_only=recipe.get("filename_only", False)
+            )
+            self.db_manager.save_search_recipe_compiled(recipe_id, compiled.to_cache())
+        
+        self.compiled_queries[recipe_id] = compiled
+        return compiled
+    
+    def run_recipes(self, search_manager, directories, indexes: List[int] = None,
+                    progress_callback=None) -> List[Dict]:
+        """
+        Пакетное выполнение рецептов за один обход директорий
+        (по умолчанию - всех рецептов). Возвращает список
+        {'recipe': рецепт, 'results': результаты} в порядке рецептов.
+        """
+        if indexes is None:
+            indexes = range(len(self.recipes))
+        indexes = [i for i in indexes if self.get_recipe(i) is not None]
+        
+        queries = [self.get_compiled_query(i) for i in indexes]
+        batch_results = search_manager.search_batch(directories, queries, progress_callback)
+        
+        for i in indexes:
+            self.increment_usage(i)
+        return [{'recipe': self.get_recipe(i), 'results': results}
+                for i, results in zip(indexes, batch_results)]
+    
     def increment_usage(self, index: int):
         """Увеличение счетчика использования рецепта"""
         try:
-            if 0 <= index < len(self.recipes["recipes"]):
-                self.recipes["recipes"][index]["usage_count"] += 1
-                self.save_recipes()
+            if 0 <= index < len(self.recipes):
+                recipe = self.recipes[index]
+                if self.db_manager.increment_search_recipe_usage(recipe["id"]):
+                    recipe["usage_count"] += 1
+                    recipe["last_used"] = datetime.now().isoformat()
         except Exception as e:
             print(f"Ошибка увеличения счетчика: {e}")
 
@@ -0,0 +1,600 @@
+import os
+import bz2
+import time
+import zlib
+import shutil
+import struct
+import tarfile
+import zipfile
+import tempfile
+import threading
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional fast codecs, used only when installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Formats that are already compressed and are stored without recompression
+STORED_EXTENSIONS = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.apk', '.aab', '.jar', '.zip',
+    '.gz', '.tgz', '.bz2', '.xz', '.7z', '.mp3', '.mp4', '.woff', '.woff2'
+})
+
+# File signatures of already compressed content (for files without a known extension)
+COMPRESSED_SIGNATURES = (
+    b'\x89PNG', b'\xff\xd8\xff', b'PK\x03\x04', b'\x1f\x8b', b'BZh', b'\xfd7zXZ',
+    b'7z\xbc\xaf', b'GIF8'
+)
+
+
+def is_compressed_content(file_name, head):
+    """Detect already compressed files by extension or by their first bytes"""
+    if os.path.splitext(file_name)[1].lower() in STORED_EXTENSIONS:
+        return True
+    # RIFF is also the container of uncompressed WAV and AVI, only WebP is compressed
+    if head.startswith(b'RIFF'):
+        return head[8:12] == b'WEBP'
+    return head.startswith(COMPRESSED_SIGNATURES)
+
+
+class ScanningReader:
+    """
+    Source file wrapper that passes every chunk read to a scanner, so the
+    content can be hashed from the same read that archives it
+    """
+
+    def __init__(self, fileobj, scanner):
+        self.fileobj = fileobj
+        self.scanner = scanner
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.scanner.update(chunk)
+        return chunk
+
+
+def _scanning(fileobj, file_path, arcname, scan):
+    """fileobj, wrapped in a ScanningReader when the codec was given a scan callback"""
+    return ScanningReader(fileobj, scan(file_path, arcname)) if scan else fileobj
+
+
+class CompressedMember:
+    """A file compressed by a worker, ready to be appended to the archive"""
+
+    def __init__(self, file_path, arcname, compress_type, crc, file_size, compress_size, data=None):
+        self.file_path = file_path
+        self.arcname = arcname
+        self.compress_type = compress_type
+        self.crc = crc
+        self.file_size = file_size
+        self.compress_size = compress_size
+        # Compressed data (spooled to disk when large); None for stored members,
+        # which are copied straight from the source file
+        self.data = data
+
+
+class ParallelZipWriter:
+    """
+    ZIP writer that deflates (or bzip2-compresses) members in a thread pool
+    (zlib and bz2 release the GIL) while a single writer appends them in order. The archive is written
+    from the ZIP format itself (local headers, member data, then the
+    central directory, with ZIP64 records when needed), so no private
+    zipfile state is involved; zipfile reads the result.
+    Memory use is bounded by the number of members in flight; members larger
+    than SPILL_SIZE are spooled to temporary files. Already compressed files
+    are stored: the writer copies them from the source, computing the CRC
+    during the copy, and rewrites their local header afterwards.
+    """
+
+    BUFFER_SIZE = 1024 * 1024
+    SPILL_SIZE = 8 * 1024 * 1024
+    # Sizes and offsets above this need ZIP64 fields (the same limit as zipfile)
+    ZIP64_LIMIT = (1 << 31) - 1
+    ZIP_VERSION = 20
+    ZIP64_VERSION = 45
+    BZIP2_VERSION = 46
+    UTF8_FLAG = 0x800
+    # Compression methods the writer can run in parallel: raw streams of public compressors
+    COMPRESSORS = {
+        zipfile.ZIP_DEFLATED: lambda level: zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS),
+        zipfile.ZIP_BZIP2: lambda level: bz2.BZ2Compressor(max(level, 1)),
+    }
+
+    def __init__(self, archive_path, compress_level=6, workers=None,
+                 compression=zipfile.ZIP_DEFLATED, scan=None):
+        self.archive_path = archive_path
+        self.compress_level = compress_level
+        self.workers = workers or min(os.cpu_count() or 1, 8)
+        self.compression = compression
+        # scan(file_path, arcname) -> object whose update(chunk) gets the archived content
+        self.scan = scan
+        self.stored_members = 0
+        self._members = []
+
+    def write_files(self, files):
+        """Write (file_path, arcname) pairs to the archive"""
+        in_flight = deque()
+        max_in_flight = self.workers * 4
+        self._members = []
+
+        with open(self.archive_path, 'wb') as archive, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for file_path, arcname in files:
+                    in_flight.append(executor.submit(self._compress_member, file_path, arcname))
+                    if len(in_flight) >= max_in_flight:
+                        self._append_member(archive, in_flight.popleft().result())
+                while in_flight:
+                    self._append_member(archive, in_flight.popleft().result())
+                self._write_central_directory(archive)
+            finally:
+                # Release spooled data of members that were never written
+                for future in in_flight:
+                    future.cancel()
+                    if future.done() and not future.cancelled() and future.exception() is None:
+                        member = future.result()
+                        if member.data:
+                            member.data.close()
+
+    def _compress_member(self, file_path, arcname):
+        """Compress one file into a spooled buffer (runs in a worker thread)"""
+        crc = 0
+        file_size = 0
+        with open(file_path, 'rb') as src:
+            chunk = src.read(self.BUFFER_SIZE)
+
+            if is_compressed_content(arcname, chunk):
+                # Copied by the writer, which also computes the CRC
+                size = os.fstat(src.fileno()).st_size
+                return CompressedMember(file_path, arcname, zipfile.ZIP_STORED, None, size, size)
+
+            scanner = self.scan(file_path, arcname) if self.scan else None
+            compressor = self.COMPRESSORS[self.compression](self.compress_level)
+            data = tempfile.SpooledTemporaryFile(max_size=self.SPILL_SIZE)
+            try:
+                while chunk:
+                    if scanner:
+                        scanner.update(chunk)
+                    crc = zlib.crc32(chunk, crc)
+                    file_size += len(chunk)
+                    data.write(compressor.compress(chunk))
+                    chunk = src.read(self.BUFFER_SIZE)
+                data.write(compressor.flush())
+            except BaseException:
+                data.close()
+                raise
+
+        compress_size = data.tell()
+        data.seek(0)
+        return CompressedMember(file_path, arcname, self.compression, crc, file_size,
+                                compress_size, data)
+
+    def _append_member(self, archive, member):
+        """Append a member (single writer, archive order)"""
+        try:
+            zinfo = zipfile.ZipInfo.from_file(member.file_path, member.arcname)
+            zinfo.compress_type = member.compress_type
+            zinfo.file_size = member.file_size
+            zinfo.compress_size = member.compress_size
+            zinfo.CRC = member.crc or 0
+            zinfo.header_offset = archive.tell()
+            zip64 = max(member.file_size, member.compress_size) > self.ZIP64_LIMIT
+            archive.write(self._local_header(zinfo, zip64))
+
+            if member.data is not None:
+                shutil.copyfileobj(member.data, archive, self.BUFFER_SIZE)
+            else:
+                self.stored_members += 1
+                self._copy_stored(archive, member.file_path, zinfo, zip64)
+            self._members.append(zinfo)
+        finally:
+            if member.data is not None:
+                member.data.close()
+
+    def _copy_stored(self, archive, file_path, zinfo, zip64):
+        """Copy a stored member, then rewrite its header with the CRC and size of the bytes written"""
+        crc = 0
+        size = 0
+        with open(file_path, 'rb') as f:
+            src = _scanning(f, file_path, zinfo.filename, self.scan)
+            while True:
+                chunk = src.read(self.BUFFER_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                archive.write(chunk)
+        if size > self.ZIP64_LIMIT and not zip64:
+            # The header has no room for ZIP64 sizes
+            raise OSError(f"File changed while archiving: {file_path}")
+
+        zinfo.CRC = crc
+        zinfo.file_size = zinfo.compress_size = size
+        end = archive.tell()
+        archive.seek(zinfo.header_offset)
+        archive.write(self._local_header(zinfo, zip64))
+        archive.seek(end)
+
+    @classmethod
+    def _encoded_name(cls, zinfo):
+        """File name bytes and general purpose flags"""
+        try:
+            return zinfo.filename.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return zinfo.filename.encode('utf-8'), cls.UTF8_FLAG
+
+    def _version(self, zinfo, zip64):
+        """Version needed to extract a member"""
+        version = self.BZIP2_VERSION if zinfo.compress_type == zipfile.ZIP_BZIP2 else self.ZIP_VERSION
+        return max(version, self.ZIP64_VERSION) if zip64 else version
+
+    @staticmethod
+    def _dos_date_time(zinfo):
+        year, month, day, hour, minute, second = zinfo.date_time
+        return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+    def _local_header(self, zinfo, zip64):
+        name, flags = self._encoded_name(zinfo)
+        dos_date, dos_time = self._dos_date_time(zinfo)
+        file_size, compress_size = zinfo.file_size, zinfo.compress_size
+        extra = b''
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+            file_size = compress_size = 0xFFFFFFFF
+        version = self._version(zinfo, zip64)
+        return struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', version, flags, zinfo.compress_type,
+                           dos_time, dos_date, zinfo.CRC, compress_size, file_size,
+                           len(name), len(extra)) + name + extra
+
+    def _write_central_directory(self, archive):
+        start = archive.tell()
+        for zinfo in self._members:
+            name, flags = self._encoded_name(zinfo)
+            dos_date, dos_time = self._dos_date_time(zinfo)
+            # ZIP64 fields, in this order, for the values that do not fit
+            fields = [zinfo.file_size, zinfo.compress_size, zinfo.header_offset]
+            zip64_values = [value for value in fields if value > self.ZIP64_LIMIT]
+            file_size, compress_size, offset = (0xFFFFFFFF if value > self.ZIP64_LIMIT else value
+                                                for value in fields)
+            extra = b''
+            if zip64_values:
+                extra = struct.pack(f'<HH{len(zip64_values)}Q', 1, 8 * len(zip64_values), *zip64_values)
+            version = self._version(zinfo, bool(zip64_values))
+            archive.write(struct.pack('<4sBBBBHHHHLLLHHHHHLL', b'PK\x01\x02', version, zinfo.create_system,
+                                      version, 0, flags, zinfo.compress_type, dos_time, dos_date,
+                                      zinfo.CRC, compress_size, file_size, len(name), len(extra), 0, 0,
+                                      0, zinfo.external_attr, offset) + name + extra)
+
+        end = archive.tell()
+        count, size = len(self._members), end - start
+        if count > 0xFFFF or size > self.ZIP64_LIMIT or start > self.ZIP64_LIMIT:
+            archive.write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, self.ZIP64_VERSION,
+                                      self.ZIP64_VERSION, 0, 0, count, count, size, start))
+            archive.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, end, 1))
+            count = min(count, 0xFFFF)
+            size = min(size, 0xFFFFFFFF)
+            start = min(start, 0xFFFFFFFF)
+        archive.write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, count, count, size, start, 0))
+
+
+class MemberStream:
+    """
+    Readable stream of one archive member; closing it also closes the
+    archive the member was opened from
+    """
+
+    def __init__(self, member, owner):
+        self.member = member
+        self.owner = owner
+
+    def read(self, size=-1):
+        return self.member.read(size)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        try:
+            self.member.close()
+        finally:
+            self.owner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ZipCodec:
+    """ZIP archive with one compression method for all members"""
+
+    extension = '.zip'
+
+    def __init__(self, name, compression):
+        self.name = name
+        self.compression = compression
+
+    def available(self):
+        return True
+
+    def create(self, archive_path, files, level=6, workers=None, scan=None):
+        """
+        Write (file_path, arcname) pairs to a new archive. scan(file_path,
+        arcname) returns an object whose update(chunk) receives the content
+        of the file from the same read that archives it.
+        """
+        if self.compression in ParallelZipWriter.COMPRESSORS:
+            ParallelZipWriter(archive_path, level, workers, self.compression, scan).write_files(files)
+            return
+        # Stored and LZMA members have no compression level
+        with zipfile.ZipFile(archive_path, 'w', self.compression) as zipf:
+            for file_path, arcname in files:
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                zinfo.compress_type = self.compression
+                with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dst:
+                    shutil.copyfileobj(_scanning(src, file_path, arcname, scan), dst,
+                                       ParallelZipWriter.BUFFER_SIZE)
+
+    def extract(self, archive_path, destination, names=None):
+        """Extract the whole archive, or only the members listed in names"""
+        with zipfile.ZipFile(archive_path, 'r') as zipf:
+            zipf.extractall(destination, members=names)
+
+    def list_members(self, archive_path):
+        """Files of the archive as {'path', 'size', 'mtime'}; reads only the central directory"""
+        with zipfile.ZipFile(archive_path, 'r') as zipf:
+            return [self._member_entry(info) for info in zipf.infolist() if not info.is_dir()]
+
+    @staticmethod
+    def _member_entry(info):
+        return {'path': info.filename, 'size': info.file_size,
+                'mtime': time.mktime(info.date_time + (0, 0, -1))}
+
+    def iter_file_streams(self, archive_path):
+        """
+        (entry, stream) for every file member in archive order; reading a
+        stream to the end checks the member's CRC (BadZipFile on mismatch)
+        """
+        with zipfile.ZipFile(archive_path, 'r') as zipf:
+            for info in zipf.infolist():
+                if not info.is_dir():
+                    with zipf.open(info) as stream:
+                        yield self._member_entry(info), stream
+
+    def parallel_extract(self, archive_path, destination, restorer, names=None, entries=None):
+        """
+        Extract members on the restorer's thread pool. Every worker thread
+        reads through its own ZipFile handle, so members are decompressed
+        in parallel. entries is not needed: the central directory lists all members.
+        """
+        with zipfile.ZipFile(archive_path, 'r') as zipf:
+            wanted = None if names is None else set(names)
+            members = [self._member_entry(info) for info in zipf.infolist()
+                       if not info.is_dir() and (wanted is None or info.filename in wanted)]
+
+        local = threading.local()
+        handles = []
+
+        def open_source(entry):
+            handle = getattr(local, 'zipf', None)
+            if handle is None:
+                handle = local.zipf = zipfile.ZipFile(archive_path, 'r')
+                handles.append(handle)
+            return handle.open(entry['path'])
+
+        try:
+            restorer.restore(destination, members, open_source)
+        finally:
+            for handle in handles:
+                handle.close()
+
+    def open_member(self, archive_path, name):
+        """Open one member for reading without extracting anything else"""
+        zipf = zipfile.ZipFile(archive_path, 'r')
+        try:
+            return MemberStream(zipf.open(name), zipf)
+        except BaseException:
+            zipf.close()
+            raise
+
+
+class TarCodec:
+    """Tar stream compressed with gzip, bz2, xz or an optional fast codec"""
+
+    def __init__(self, name, extension, mode=None):
+        self.name = name
+        self.extension = extension
+        # tarfile compression mode ('gz', 'bz2', 'xz'); None for external codecs
+        self.mode = mode
+
+    def available(self):
+        return True
+
+    def _level_options(self, level):
+        if self.mode == 'xz':
+            return {'preset': level}
+        return {'compresslevel': max(level, 1)}
+
+    def create(self, archive_path, files, level=6, workers=None, scan=None):
+        """Write (file_path, arcname) pairs to a new archive (scan: see ZipCodec.create)"""
+        with tarfile.open(archive_path, f'w:{self.mode}', **self._level_options(level)) as tar:
+            self._add_files(tar, files, scan)
+
+    def _open_read(self, stack, archive_path):
+        """Open the archive for reading; everything to close is entered into stack"""
+        return stack.enter_context(tarfile.open(archive_path, 'r:*'))
+
+    def extract(self, archive_path, destination, names=None):
+        """Extract the whole archive, or only the members listed in names"""
+        with ExitStack() as stack:
+            tar = self._open_read(stack, archive_path)
+            if names is None:
+                self._extract_all(tar, destination)
+                return
+            wanted = set(names)
+            # Members are extracted as the stream reaches them
+            for member in tar:
+                if member.name in wanted:
+                    self._extract_member(tar, member, destination)
+                    wanted.discard(member.name)
+                    if not wanted:
+                        break
+
+    def list_members(self, archive_path):
+        """Files of the archive as {'path', 'size', 'mtime'}; member data is skipped, not extracted"""
+        with ExitStack() as stack:
+            tar = self._open_read(stack, archive_path)
+            return [{'path': member.name, 'size': member.size, 'mtime': member.mtime}
+                    for member in tar if member.isfile()]
+
+    def open_member(self, archive_path, name):
+        """Open one member for reading; the stream is decompressed only up to that member"""
+        stack = ExitStack()
+        try:
+            tar = self._open_read(stack, archive_path)
+            for member in tar:
+                if member.name == name and member.isfile():
+                    return MemberStream(tar.extractfile(member), stack)
+            raise KeyError(f"There is no item named {name!r} in the archive")
+        except BaseException:
+            stack.close()
+            raise
+
+    def iter_file_streams(self, archive_path):
+        """(entry, stream) for every regular file member in archive order"""
+        with ExitStack() as stack:
+            tar = self._open_read(stack, archive_path)
+            for member in tar:
+                if member.isfile():
+                    yield ({'path': member.name, 'size': member.size, 'mtime': member.mtime},
+                           tar.extractfile(member))
+
+    def parallel_extract(self, archive_path, destination, restorer, names=None, entries=None):
+        """
+        Extract members with the restorer: the tar stream is decompressed
+        sequentially here while worker threads write the files.
+        entries (e.g. from the snapshot manifest) let the restorer create
+        the directory skeleton and report progress against known totals.
+        """
+        with ExitStack() as stack:
+            tar = self._open_read(stack, archive_path)
+            restorer.restore_stream(destination, self._iter_file_members(tar, destination, names), entries)
+
+    def _iter_file_members(self, tar, destination, names=None):
+        """(entry, stream) pairs of regular files; other members are extracted in place"""
+        wanted = None if names is None else set(names)
+        for member in tar:
+            if wanted is not None and member.name not in wanted:
+                continue
+            if member.isfile():
+                yield ({'path': member.name, 'size': member.size, 'mtime': member.mtime},
+                       tar.extractfile(member))
+            elif not member.isdir():
+                self._extract_member(tar, member, destination)
+
+    def _add_files(self, tar, files, scan=None):
+        for file_path, arcname in files:
+            tarinfo = tar.gettarinfo(file_path, arcname)
+            if not tarinfo.isreg():
+                tar.addfile(tarinfo)
+                continue
+            # addfile reads exactly tarinfo.size bytes, which are the bytes scanned
+            with open(file_path, 'rb') as src:
+                tar.addfile(tarinfo, _scanning(src, file_path, arcname, scan))
+
+    def _extract_all(self, tar, destination):
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(destination, filter='data')
+        else:
+            tar.extractall(destination)
+
+    def _extract_member(self, tar, member, destination):
+        if hasattr(tarfile, 'data_filter'):
+            tar.extract(member, destination, filter='data')
+        else:
+            tar.extract(member, destination)
+
+
+class ZstdTarCodec(TarCodec):
+    """Tar stream compressed with zstandard (optional dependency)"""
+
+    def available(self):
+        return zstandard is not None
+
+    def create(self, archive_path, files, level=6, workers=None, scan=None):
+        compressor = zstandard.ZstdCompressor(level=max(level, 1), threads=-1)
+        with open(archive_path, 'wb') as f, compressor.stream_writer(f) as stream, \
+                tarfile.open(fileobj=stream, mode='w|') as tar:
+            self._add_files(tar, files, scan)
+
+    def _open_read(self, stack, archive_path):
+        f = stack.enter_context(open(archive_path, 'rb'))
+        stream = stack.enter_context(zstandard.ZstdDecompressor().stream_reader(f))
+        return stack.enter_context(tarfile.open(fileobj=stream, mode='r|'))
+
+
+class Lz4TarCodec(TarCodec):
+    """Tar stream compressed with LZ4 frames (optional dependency)"""
+
+    def available(self):
+        return lz4 is not None
+
+    def create(self, archive_path, files, level=6, workers=None, scan=None):
+        with lz4.frame.open(archive_path, 'wb', compression_level=level) as stream, \
+                tarfile.open(fileobj=stream, mode='w|') as tar:
+            self._add_files(tar, files, scan)
+
+    def _open_read(self, stack, archive_path):
+        stream = stack.enter_context(lz4.frame.open(archive_path, 'rb'))
+        return stack.enter_context(tarfile.open(fileobj=stream, mode='r|'))
+
+
+DEFAULT_CODEC = 'zip-deflate'
+
+CODECS = {codec.name: codec for codec in (
+    ZipCodec('zip-deflate', zipfile.ZIP_DEFLATED),
+    ZipCodec('zip-stored', zipfile.ZIP_STORED),
+    ZipCodec('zip-lzma', zipfile.ZIP_LZMA),
+    ZipCodec('zip-bzip2', zipfile.ZIP_BZIP2),
+    TarCodec('tar-gz', '.tar.gz', 'gz'),
+    TarCodec('tar-bz2', '.tar.bz2', 'bz2'),
+    TarCodec('tar-xz', '.tar.xz', 'xz'),
+    ZstdTarCodec('tar-zst', '.tar.zst'),
+    Lz4TarCodec('tar-lz4', '.tar.lz4'),
+)}
+
+
+def available_codecs():
+    """Names of codecs usable in this installation"""
+    return [name for name, codec in CODECS.items() if codec.available()]
+
+
+def get_codec(name):
+    """Codec by name (ValueError if unknown or not installed)"""
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown snapshot codec: {name}")
+    if not codec.available():
+        raise ValueError(f"Snapshot codec {name} requires a package that is not installed")
+    return codec
+
+
+def codec_for_path(archive_path):
+    """Codec that can read an archive, detected by file extension (None if not an archive)"""
+    if archive_path.endswith('.zip'):
+        # Any ZIP compression method is read by zipfile
+        return CODECS[DEFAULT_CODEC]
+    for codec in CODECS.values():
+        if codec.extension != '.zip' and archive_path.endswith(codec.extension):
+            return codec
+    return None
@@ -1,9 +1,27 @@
 import os
 import shutil
-import zipfile
+import contextlib
+import fnmatch
+import difflib
 import tempfile
+import time
+import threading
 from datetime import datetime
 from database_manager import DatabaseManager
+from project_analyzer import ProjectAnalyzer
+from snapshot_store import (ObjectStore, SnapshotManifest, DEFAULT_FILTER_PROFILE, COPY_AUTO,
+                            COPY_HARDLINK, FileScanner, get_filter_profile, iter_source_files,
+                            scan_file, copy_file_with_stat)
+from snapshot_archive import DEFAULT_CODEC, available_codecs, get_codec, codec_for_path
+from snapshot_restore import ParallelRestorer, RestoreCancelled
+from snapshot_verify import IOThrottle, SnapshotVerifier, SnapshotScrubber
+from snapshot_pipeline import SnapshotPipeline, SnapshotCancelled
+from concurrent.futures import ThreadPoolExecutor
+
+# Snapshot storage modes
+STORAGE_ZIP = 'zip'
+STORAGE_COPY = 'copy'
+STORAGE_DEDUP = 'dedup'
 
 class SnapshotManager:
     def __init__(self, db_manager=None):
@@ -11,89 +29,920 @@ class SnapshotManager:
         self.snapshots_dir = 'snapshots'
         if not os.path.exists(self.snapshots_dir):
             os.makedirs(self.snapshots_dir)
+        # Deduplicated snapshots: shared blobs in snapshots/objects, one manifest per snapshot
+        self.store = ObjectStore(self.snapshots_dir)
+        self.manifests_dir = os.path.join(self.snapshots_dir, 'manifests')
+        # Held while blobs are added or garbage collected
+        self.store_lock = threading.Lock()
+        # ZIP compression level (0-9) and number of compression threads (None - by CPU count)
+        self.compress_level = 6
+        self.compress_workers = None
+        # File copy mode for copy snapshots, store blobs and file restores:
+        # 'auto' (reflink, then in-kernel copy, then plain copy), 'reflink' or 'copy'
+        self.copy_mode = COPY_AUTO
+        # Restore threads (None - by CPU count) and the restore in progress
+        self.restore_workers = None
+        self.active_restorer = None
+        self.last_restore_stats = None
+        # Snapshot being created and its path (see cancel_snapshot)
+        self.active_pipeline = None
+        self.active_snapshot_path = None
+        # Background integrity checks (see start_scrubber)
+        self.scrubber = None
+        self.active_verifier = None
+        # Id and statistics of the last created snapshot
+        self.last_snapshot_id = None
+        self.last_snapshot_stats = None
+        # Per-file analysis of live projects for manifest comparisons:
+        # (project path, filter profile) -> {relative path: manifest entry}
+        self.live_analysis_cache = {}
     
-    def create_snapshot(self, source_path, name, description="", compress=True):
-        """Create a snapshot of a directory"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        snapshot_name = f"{name}_{timestamp}"
+    def create_snapshot(self, source_path, name, description="", compress=True, storage=None,
+                        parent=None, compress_level=None, codec=None, filter_profile=None,
+                        progress_callback=None):
+        """
+        Create a snapshot of a directory.
+        storage: 'zip', 'copy' or 'dedup' (content-addressed store);
+        by default 'zip' when compress is set, otherwise 'copy'.
+        parent: id of a deduplicated snapshot to build an incremental
+        snapshot on (implies 'dedup'); files whose size and mtime match
+        the parent manifest are not read again.
+        compress_level: compression level, defaults to self.compress_level.
+        codec: archive format for 'zip' storage (see snapshot_archive.CODECS),
+        defaults to 'zip-deflate'.
+        filter_profile: 'sources', 'sources_assets' or 'full' (default);
+        excluded folders are pruned during the walk and never read.
+        progress_callback(percent, progress) reports files and bytes saved
+        with an ETA as a snapshot_pipeline.SnapshotProgress (str() gives
+        an English status line); it is called from the creating thread.
+        Creation can be stopped with cancel_snapshot() from another thread;
+        the partial snapshot is removed and None is returned.
+        """
+        filter_profile = filter_profile or DEFAULT_FILTER_PROFILE
+        try:
+            get_filter_profile(filter_profile)
+        except ValueError as e:
+            print(f"Error creating snapshot: {e}")
+            return None
+        
+        if parent is not None:
+            storage = STORAGE_DEDUP
+        elif storage is None:
+            storage = STORAGE_ZIP if compress else STORAGE_COPY
+        
+        parent_manifest = None
+        if parent is not None:
+            parent_manifest = self.load_manifest(parent)
+            if parent_manifest is None:
+                print(f"Error creating snapshot: parent snapshot {parent} is not a deduplicated snapshot")
+                return None
         
-        if compress:
-            snapshot_path = os.path.join(self.snapshots_dir, f"{snapshot_name}.zip")
-            success = self._create_compressed_snapshot(source_path, snapshot_path)
+        if storage == STORAGE_ZIP:
+            codec = codec or DEFAULT_CODEC
+            try:
+                archive_codec = get_codec(codec)
+            except ValueError as e:
+                print(f"Error creating compressed snapshot: {e}")
+                return None
+        
+        if storage == STORAGE_DEDUP:
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            snapshot_path = self._new_snapshot_path(self.manifests_dir, name, SnapshotManifest.SUFFIX)
+        elif storage == STORAGE_ZIP:
+            snapshot_path = self._new_snapshot_path(self.snapshots_dir, name, archive_codec.extension)
         else:
-            snapshot_path = os.path.join(self.snapshots_dir, snapshot_name)
-            success = self._create_uncompressed_snapshot(source_path, snapshot_path)
+            snapshot_path = self._new_snapshot_path(self.snapshots_dir, name)
         
-        if success:
-            # Save to database
-            self.db_manager.save_snapshot(name, description, snapshot_path, compress)
-            return snapshot_path
-        return None
+        pipeline = SnapshotPipeline(source_path, filter_profile, progress_callback)
+        self.active_pipeline = pipeline
+        self.active_snapshot_path = snapshot_path
+        # New blobs are unreferenced until the record is saved, so garbage
+        # collection waits for the whole deduplicated snapshot
+        with self.store_lock if storage == STORAGE_DEDUP else contextlib.nullcontext():
+            try:
+                with pipeline:
+                    if storage == STORAGE_DEDUP:
+                        success = self._create_dedup_snapshot(source_path, snapshot_path, parent_manifest,
+                                                              filter_profile, pipeline)
+                    elif storage == STORAGE_ZIP:
+                        success = self._create_compressed_snapshot(source_path, snapshot_path, compress_level,
+                                                                   codec, filter_profile, pipeline)
+                    else:
+                        success = self._create_uncompressed_snapshot(source_path, snapshot_path, filter_profile,
+                                                                     pipeline)
+            except SnapshotCancelled:
+                print("Snapshot creation cancelled")
+                return None
+            finally:
+                self.active_pipeline = None
+                self.active_snapshot_path = None
+            
+            if success:
+                # Save to database
+                self.last_snapshot_id = self.db_manager.save_snapshot(
+                    name, description, snapshot_path, storage == STORAGE_ZIP, storage,
+                    os.path.abspath(source_path), parent, codec if storage == STORAGE_ZIP else None,
+                    filter_profile)
+                if self.last_snapshot_id:
+                    self.index_snapshot_files(self.last_snapshot_id)
+                return snapshot_path
+            return None
+    
+    @staticmethod
+    def _new_snapshot_path(directory, name, suffix=''):
+        """
+        Path for a new snapshot: name plus a timestamp, with a counter when
+        a snapshot of the same name was already created in that second
+        """
+        snapshot_name = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        snapshot_path = os.path.join(directory, snapshot_name + suffix)
+        counter = 2
+        while os.path.lexists(snapshot_path) or os.path.lexists(SnapshotManifest.manifest_path(snapshot_path)):
+            snapshot_path = os.path.join(directory, f"{snapshot_name}_{counter}{suffix}")
+            counter += 1
+        return snapshot_path
+    
+    def cancel_snapshot(self):
+        """Cancel the snapshot being created"""
+        if self.active_pipeline:
+            self.active_pipeline.cancel()
+    
+    @staticmethod
+    def _remove_partial_snapshot(snapshot_path):
+        """Remove a snapshot that was not completed, with its sidecar manifest"""
+        if os.path.isdir(snapshot_path):
+            shutil.rmtree(snapshot_path, ignore_errors=True)
+        manifest_path = SnapshotManifest.manifest_path(snapshot_path)
+        for path in (snapshot_path, manifest_path, manifest_path + '.tmp'):
+            if os.path.isfile(path):
+                os.remove(path)
     
-    def _create_compressed_snapshot(self, source_path, snapshot_path):
-        """Create compressed snapshot using ZIP"""
+    def get_snapshot(self, snapshot_id):
+        """Snapshot record by id"""
+        snapshots = self.db_manager.get_snapshots()
+        return next((s for s in snapshots if s['id'] == snapshot_id), None)
+    
+    def load_manifest(self, snapshot_id):
+        """Manifest of a deduplicated snapshot (None for other storage modes)"""
+        snapshot = self.get_snapshot(snapshot_id)
+        if not snapshot or not SnapshotManifest.is_manifest(snapshot['directory_path']):
+            return None
         try:
-            with zipfile.ZipFile(snapshot_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(source_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, source_path)
-                        zipf.write(file_path, arcname)
+            return SnapshotManifest.load(snapshot['directory_path'])
+        except Exception as e:
+            print(f"Error loading snapshot manifest: {e}")
+            return None
+    
+    def get_snapshot_manifest(self, snapshot_id):
+        """
+        Manifest of any snapshot: the dedup manifest or the sidecar written
+        next to archives and copies (None for snapshots made without one)
+        """
+        snapshot = self.get_snapshot(snapshot_id)
+        if not snapshot:
+            return None
+        return self._load_manifest_for_path(snapshot['directory_path'])
+    
+    def _load_manifest_for_path(self, snapshot_path):
+        manifest_path = SnapshotManifest.manifest_path(snapshot_path)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            return SnapshotManifest.load(manifest_path)
+        except Exception as e:
+            print(f"Error loading snapshot manifest: {e}")
+            return None
+    
+    def index_snapshot_files(self, snapshot_id):
+        """Store the manifest of a snapshot in the snapshot_files table"""
+        manifest = self.get_snapshot_manifest(snapshot_id)
+        if manifest is None:
+            return False
+        return self.db_manager.save_snapshot_files(snapshot_id, manifest.files)
+    
+    def index_all_snapshot_files(self):
+        """Index snapshots that have a manifest but no file rows yet; returns their count"""
+        indexed = self.db_manager.get_indexed_snapshot_ids()
+        count = 0
+        for snapshot in self.db_manager.get_snapshots():
+            if snapshot['id'] not in indexed and self.index_snapshot_files(snapshot['id']):
+                count += 1
+        return count
+    
+    def _source_copy_mode(self):
+        """Copy mode for reading live project files: they change, so they are never hardlinked"""
+        return COPY_AUTO if self.copy_mode == COPY_HARDLINK else self.copy_mode
+    
+    def _record_file(self, manifest, file_path, rel_path):
+        """Add a file with its hash and line/char counts to a manifest"""
+        stat = os.stat(file_path)
+        info = scan_file(file_path)
+        manifest.add_file(rel_path, stat.st_size, stat.st_mtime, info['hash'],
+                          info['lines'], info['chars'])
+    
+    def find_latest_snapshot(self, source_path, storage=STORAGE_DEDUP):
+        """Most recent snapshot of a source directory with the given storage mode"""
+        source_path = os.path.abspath(source_path)
+        candidates = [s for s in self.db_manager.get_snapshots()
+                      if s['source_path'] == source_path and s['storage'] == storage
+                      and os.path.exists(s['directory_path'])]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda s: s['created_date'])
+    
+    def _create_compressed_snapshot(self, source_path, snapshot_path, compress_level=None,
+                                    codec=DEFAULT_CODEC, filter_profile=None, pipeline=None):
+        """
+        Create compressed snapshot archive. Files stream from the pipeline's
+        walker queue to the codec (ZIP members are compressed in parallel
+        with a bounded number in flight), so memory use does not grow with
+        the project. The sidecar manifest hashes the content as the codec
+        reads it, so every file is read once and the recorded hash is the
+        hash of the archived bytes.
+        """
+        if compress_level is None:
+            compress_level = self.compress_level
+        pipeline = pipeline or SnapshotPipeline(source_path, filter_profile)
+        manifest = SnapshotManifest(os.path.abspath(source_path), filter_profile=filter_profile)
+        manifest_path = SnapshotManifest.manifest_path(snapshot_path)
+        
+        file_stats = {}
+        scanners = {}
+        
+        def recorded_files():
+            for file_path, rel_path, size in pipeline.iter_files():
+                file_stats[rel_path] = os.stat(file_path)
+                yield file_path, rel_path
+                pipeline.advance(size)
+        
+        def scan(file_path, rel_path):
+            # Called from compression threads, once per file
+            scanner = scanners[rel_path] = FileScanner()
+            return scanner
+        
+        try:
+            get_codec(codec).create(snapshot_path, recorded_files(),
+                                    compress_level, self.compress_workers, scan)
+            pipeline.check_cancelled()
+            for rel_path, stat in file_stats.items():
+                info = scanners[rel_path].result()
+                manifest.add_file(rel_path, info['size'], stat.st_mtime, info['hash'],
+                                  info['lines'], info['chars'])
+            manifest.save(manifest_path)
             return True
+        except SnapshotCancelled:
+            self._remove_partial_snapshot(snapshot_path)
+            raise
         except Exception as e:
             print(f"Error creating compressed snapshot: {e}")
+            self._remove_partial_snapshot(snapshot_path)
             return False
     
-    def _create_uncompressed_snapshot(self, source_path, snapshot_path):
+    def _create_uncompressed_snapshot(self, source_path, snapshot_path, filter_profile=None,
+                                      pipeline=None):
         """Create uncompressed snapshot by copying directory"""
+        pipeline = pipeline or SnapshotPipeline(source_path, filter_profile)
+        manifest = SnapshotManifest(os.path.abspath(source_path), filter_profile=filter_profile)
+        
+        def copy_file(src, dst):
+            pipeline.check_cancelled()
+            copy_file_with_stat(src, dst, self._source_copy_mode())
+            # The copy is hashed right away, while it is still in the page cache
+            rel_path = os.path.relpath(dst, snapshot_path).replace(os.sep, '/')
+            self._record_file(manifest, dst, rel_path)
+            pipeline.advance(os.path.getsize(dst))
+        
         try:
-            shutil.copytree(source_path, snapshot_path)
+            snapshot_filter = get_filter_profile(filter_profile or DEFAULT_FILTER_PROFILE)
+            shutil.copytree(source_path, snapshot_path, ignore=snapshot_filter.copytree_ignore,
+                            copy_function=copy_file)
+            manifest.save(SnapshotManifest.manifest_path(snapshot_path))
             return True
+        except SnapshotCancelled:
+            self._remove_partial_snapshot(snapshot_path)
+            raise
         except Exception as e:
             print(f"Error creating uncompressed snapshot: {e}")
+            self._remove_partial_snapshot(snapshot_path)
             return False
     
-    def restore_snapshot(self, snapshot_path, destination_path, compressed=True):
-        """Restore snapshot to destination"""
+    def _create_dedup_snapshot(self, source_path, manifest_path, parent_manifest=None,
+                               filter_profile=None, pipeline=None):
+        """
+        Create snapshot in the content-addressed store: unchanged file
+        contents are already stored, so only new blobs are written.
+        With a parent manifest, files with the same size and mtime reuse
+        the parent's hash without being read.
+        If cancelled, blobs written by this snapshot are removed again
+        (the caller holds store_lock, so nothing else can reference them).
+        """
+        pipeline = pipeline or SnapshotPipeline(source_path, filter_profile)
+        new_objects = []
         try:
-            if compressed and snapshot_path.endswith('.zip'):
-                with zipfile.ZipFile(snapshot_path, 'r') as zipf:
-                    zipf.extractall(destination_path)
+            manifest = SnapshotManifest(os.path.abspath(source_path), filter_profile=filter_profile)
+            parent_files = parent_manifest.files if parent_manifest else {}
+            stats = {'files': 0, 'bytes_total': 0, 'new_objects': 0, 'bytes_written': 0,
+                     'unchanged': 0}
+            
+            for file_path, rel_path, _ in pipeline.iter_files():
+                stat = os.stat(file_path)
+                stats['files'] += 1
+                stats['bytes_total'] += stat.st_size
+                
+                previous = parent_files.get(rel_path)
+                if (previous and previous['size'] == stat.st_size
+                        and previous['mtime'] == stat.st_mtime
+                        and self.store.has_object(previous['hash'])):
+                    manifest.add_file(rel_path, stat.st_size, stat.st_mtime, previous['hash'],
+                                      previous.get('lines'), previous.get('chars'))
+                    stats['unchanged'] += 1
+                    pipeline.advance(stat.st_size)
+                    continue
+                
+                info = scan_file(file_path)
+                digest, written = self.store.put_file(file_path, info['hash'], self._source_copy_mode())
+                size = stat.st_size
+                if digest != info['hash']:
+                    # The file changed after it was scanned: record what was stored
+                    object_path = self.store.object_path(digest)
+                    info = scan_file(object_path)
+                    size = os.path.getsize(object_path)
+                manifest.add_file(rel_path, size, stat.st_mtime, digest,
+                                  info['lines'], info['chars'])
+                if written:
+                    new_objects.append(digest)
+                    stats['new_objects'] += 1
+                    stats['bytes_written'] += size
+                pipeline.advance(size)
+            
+            manifest.save(manifest_path)
+            self.last_snapshot_stats = stats
+            return True
+        except SnapshotCancelled:
+            for digest in new_objects:
+                self.store.remove_object(digest)
+            raise
+        except Exception as e:
+            print(f"Error creating deduplicated snapshot: {e}")
+            return False
+    
+    def _restore_dedup_snapshot(self, manifest_path, destination_path, names, restorer, copy_mode):
+        """Restore snapshot (or only the files listed in names) from a manifest and the object store"""
+        manifest = SnapshotManifest.load(manifest_path)
+        rel_paths = manifest.files if names is None else names
+        entries = [{'path': rel_path, **manifest.files[rel_path]} for rel_path in rel_paths]
+        restorer.restore_files(destination_path, entries,
+                               lambda entry: self.store.object_path(entry['hash']), copy_mode)
+    
+    def restore_snapshot(self, snapshot_path, destination_path, compressed=True, patterns=None,
+                         progress_callback=None, copy_mode=None):
+        """
+        Restore snapshot to destination on a thread pool: directories are
+        created first, then files are written in parallel with their mtimes.
+        patterns: glob patterns matched against '/'-separated relative
+        paths (e.g. 'lib/*.dart'); only matching files are restored.
+        progress_callback(percent, message) is called from worker threads.
+        copy_mode: defaults to self.copy_mode; 'hardlink' links restored
+        files to the read-only blobs of a deduplicated snapshot (other
+        snapshots are copied).
+        The restore can be stopped with cancel_restore().
+        """
+        copy_mode = copy_mode or self.copy_mode
+        restorer = ParallelRestorer(self.restore_workers, progress_callback)
+        self.active_restorer = restorer
+        try:
+            names = None
+            if patterns is not None:
+                names = [entry['path'] for entry in self._list_files(snapshot_path)
+                         if self._matches_patterns(entry['path'], patterns)]
+            
+            if SnapshotManifest.is_manifest(snapshot_path):
+                self._restore_dedup_snapshot(snapshot_path, destination_path, names, restorer, copy_mode)
+            elif compressed and codec_for_path(snapshot_path):
+                entries = self._manifest_entries(snapshot_path, names)
+                codec_for_path(snapshot_path).parallel_extract(snapshot_path, destination_path, restorer,
+                                                               names, entries)
             else:
-                shutil.copytree(snapshot_path, destination_path)
+                entries = self._list_files(snapshot_path)
+                if names is not None:
+                    wanted = set(names)
+                    entries = [entry for entry in entries if entry['path'] in wanted]
+                # Files of a copied snapshot are not immutable, so they are never hardlinked
+                restorer.restore_files(destination_path, entries,
+                                       lambda entry: os.path.join(snapshot_path, *entry['path'].split('/')),
+                                       COPY_AUTO if copy_mode == COPY_HARDLINK else copy_mode)
+            self.last_restore_stats = {'files': restorer.files_done, 'bytes': restorer.bytes_done,
+                                       'copy_methods': restorer.copy_methods}
             return True
+        except RestoreCancelled:
+            print("Snapshot restore cancelled")
+            return False
         except Exception as e:
             print(f"Error restoring snapshot: {e}")
             return False
+        finally:
+            self.active_restorer = None
+    
+    def cancel_restore(self):
+        """Cancel the running restore"""
+        if self.active_restorer:
+            self.active_restorer.cancel()
+    
+    def _manifest_entries(self, snapshot_path, names=None):
+        """Manifest files of a snapshot as restore entries (None without a manifest)"""
+        manifest = self._load_manifest_for_path(snapshot_path)
+        if manifest is None:
+            return None
+        rel_paths = manifest.files if names is None else names
+        return [{'path': rel_path, **manifest.files[rel_path]} for rel_path in rel_paths]
+    
+    @staticmethod
+    def _matches_patterns(rel_path, patterns):
+        return any(fnmatch.fnmatchcase(rel_path, pattern) for pattern in patterns)
+    
+    def _list_files(self, snapshot_path):
+        """Files of a snapshot path as {'path', 'size', 'mtime'} dicts"""
+        manifest_path = SnapshotManifest.manifest_path(snapshot_path)
+        if os.path.exists(manifest_path):
+            manifest = SnapshotManifest.load(manifest_path)
+            return [{'path': rel_path, 'size': entry['size'], 'mtime': entry['mtime']}
+                    for rel_path, entry in manifest.files.items()]
+        if os.path.isdir(snapshot_path):
+            files = []
+            for file_path, rel_path in iter_source_files(snapshot_path):
+                stat = os.stat(file_path)
+                files.append({'path': rel_path, 'size': stat.st_size, 'mtime': stat.st_mtime})
+            return files
+        codec = codec_for_path(snapshot_path)
+        if codec is None:
+            raise ValueError(f"Unknown snapshot format: {snapshot_path}")
+        return codec.list_members(snapshot_path)
+    
+    def list_snapshot_files(self, snapshot_id):
+        """
+        Files of a snapshot as {'path', 'size', 'mtime'} dicts, without
+        extracting anything: manifests are read directly and archives
+        list their members.
+        """
+        snapshot = self.get_snapshot(snapshot_id)
+        if not snapshot:
+            return None
+        try:
+            return self._list_files(snapshot['directory_path'])
+        except Exception as e:
+            print(f"Error listing snapshot files: {e}")
+            return None
+    
+    def open_snapshot_file(self, snapshot_id, rel_path):
+        """
+        Open one file of a snapshot as a binary stream (caller closes it).
+        Only that file is read: a blob of the object store, one archive
+        member or one file of a copied snapshot.
+        """
+        snapshot = self.get_snapshot(snapshot_id)
+        if not snapshot:
+            return None
+        snapshot_path = snapshot['directory_path']
+        try:
+            if SnapshotManifest.is_manifest(snapshot_path):
+                entry = SnapshotManifest.load(snapshot_path).files[rel_path]
+                return self.store.open_object(entry['hash'])
+            if os.path.isdir(snapshot_path):
+                return open(os.path.join(snapshot_path, *rel_path.split('/')), 'rb')
+            return codec_for_path(snapshot_path).open_member(snapshot_path, rel_path)
+        except Exception as e:
+            print(f"Error opening snapshot file {rel_path}: {e}")
+            return None
+    
+    def extract_snapshot_files(self, snapshot_id, destination_path, patterns):
+        """Extract only the snapshot files matching glob patterns"""
+        snapshot = self.get_snapshot(snapshot_id)
+        if not snapshot:
+            return False
+        return self.restore_snapshot(snapshot['directory_path'], destination_path,
+                                     snapshot['compressed'], patterns)
+    
+    def _read_snapshot_lines(self, snapshot_id, rel_path):
+        """Lines of one snapshot file, read from a single blob or member"""
+        stream = self.open_snapshot_file(snapshot_id, rel_path)
+        if stream is None:
+            raise FileNotFoundError(f"{rel_path} is not in snapshot {snapshot_id}")
+        with stream:
+            return stream.read().decode('utf-8', errors='ignore').splitlines(keepends=True)
+    
+    def get_snapshot_file_diff(self, snapshot_id, current_project_path, rel_path):
+        """Unified diff of one file between a snapshot and the current project"""
+        try:
+            snapshot_lines = self._read_snapshot_lines(snapshot_id, rel_path)
+            current_path = os.path.join(current_project_path, *rel_path.split('/'))
+            current_lines = []
+            if os.path.exists(current_path):
+                with open(current_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    current_lines = f.readlines()
+            
+            return list(difflib.unified_diff(snapshot_lines, current_lines,
+                                             fromfile=f"snapshot:{rel_path}",
+                                             tofile=current_path,
+                                             lineterm=''))
+        except Exception as e:
+            return [f"Error comparing files: {e}"]
+    
+    def benchmark_codecs(self, source_path, codecs=None, compress_level=None, filter_profile=None):
+        """
+        Compare snapshot codecs on a project: archive size and ratio,
+        create and restore time. Archives are written to a temporary directory.
+        """
+        if compress_level is None:
+            compress_level = self.compress_level
+        files = list(iter_source_files(source_path, filter_profile))
+        total_size = sum(os.path.getsize(file_path) for file_path, _ in files)
+        
+        results = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in codecs or available_codecs():
+                codec = get_codec(name)
+                archive_path = os.path.join(temp_dir, 'benchmark' + codec.extension)
+                
+                start = time.perf_counter()
+                codec.create(archive_path, files, compress_level, self.compress_workers)
+                create_seconds = time.perf_counter() - start
+                archive_size = os.path.getsize(archive_path)
+                
+                restore_path = os.path.join(temp_dir, 'restore')
+                start = time.perf_counter()
+                codec.extract(archive_path, restore_path)
+                restore_seconds = time.perf_counter() - start
+                
+                os.remove(archive_path)
+                shutil.rmtree(restore_path)
+                results.append({
+                    'codec': name,
+                    'original_size': total_size,
+                    'archive_size': archive_size,
+                    'ratio': total_size / archive_size if archive_size else 0,
+                    'create_seconds': create_seconds,
+                    'restore_seconds': restore_seconds
+                })
+        return results
+    
+    def verify_snapshots(self, snapshot_ids=None, workers=None, max_bytes_per_second=None,
+                         progress_callback=None):
+        """
+        Verify snapshots in parallel: ZIP CRCs and content hashes against
+        manifests or the object store. All workers together read at most
+        max_bytes_per_second. Results are recorded in the database.
+        Returns {snapshot id: result} (see SnapshotVerifier.verify).
+        """
+        snapshots = self.db_manager.get_snapshots()
+        if snapshot_ids is not None:
+            wanted = set(snapshot_ids)
+            snapshots = [s for s in snapshots if s['id'] in wanted]
+        
+        verifier = SnapshotVerifier(self.store, IOThrottle(max_bytes_per_second))
+        self.active_verifier = verifier
+        results = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1)) as executor:
+                futures = {executor.submit(verifier.verify, s['directory_path']): s for s in snapshots}
+                for future in futures:
+                    snapshot = futures[future]
+                    result = future.result()
+                    if verifier.cancelled:
+                        continue
+                    results[snapshot['id']] = result
+                    self.db_manager.save_snapshot_verification(
+                        snapshot['id'], result['status'], "\n".join(result['problems']),
+                        result['verified_date'])
+                    if progress_callback:
+                        progress_callback(len(results) / len(snapshots) * 100,
+                                          f"Verified {snapshot['name']}: {result['status']}")
+        finally:
+            self.active_verifier = None
+        return results
+    
+    def verify_snapshot(self, snapshot_id, max_bytes_per_second=None):
+        """Verify one snapshot (None if it does not exist)"""
+        return self.verify_snapshots([snapshot_id], 1, max_bytes_per_second).get(snapshot_id)
+    
+    def scrub_snapshots(self, max_age=7 * 24 * 3600, max_bytes_per_second=None):
+        """Verify snapshots never verified or last verified more than max_age seconds ago"""
+        now = datetime.now()
+        due = [s['id'] for s in self.db_manager.get_snapshots()
+               if not s['last_verified']
+               or (now - datetime.fromisoformat(s['last_verified'])).total_seconds() > max_age]
+        if not due:
+            return {}
+        return self.verify_snapshots(due, max_bytes_per_second=max_bytes_per_second)
+    
+    def start_scrubber(self, check_interval=3600, max_age=7 * 24 * 3600,
+                       max_bytes_per_second=10 * 1024 * 1024):
+        """
+        Start the background scrub: every check_interval seconds, snapshots
+        due for verification are checked with throttled reads
+        """
+        if self.scrubber and self.scrubber.is_alive():
+            return self.scrubber
+        self.scrubber = SnapshotScrubber(lambda: self.scrub_snapshots(max_age, max_bytes_per_second),
+                                         check_interval)
+        self.scrubber.start()
+        return self.scrubber
+    
+    def stop_scrubber(self):
+        """Stop the background scrub, cancelling a verification in progress"""
+        if self.scrubber:
+            self.scrubber.stop()
+            self.scrubber = None
+        if self.active_verifier:
+            self.active_verifier.cancel()
     
     def list_snapshots(self):
         """List all available snapshots"""
         return self.db_manager.get_snapshots()
     
     def delete_snapshot(self, snapshot_id):
-        """Delete a snapshot"""
-        snapshots = self.db_manager.get_snapshots()
-        snapshot = next((s for s in snapshots if s['id'] == snapshot_id), None)
+        """
+        Delete a snapshot. Blobs of deduplicated snapshots stay in the
+        shared store until collect_garbage() removes unreferenced ones.
+        """
+        snapshot = self.get_snapshot(snapshot_id)
         
         if snapshot:
             try:
                 if os.path.exists(snapshot['directory_path']):
-                    if snapshot['compressed']:
-                        os.remove(snapshot['directory_path'])
-                    else:
+                    # Archives and manifests are single files
+                    if os.path.isdir(snapshot['directory_path']):
                         shutil.rmtree(snapshot['directory_path'])
+                    else:
+                        os.remove(snapshot['directory_path'])
+                manifest_path = SnapshotManifest.manifest_path(snapshot['directory_path'])
+                if os.path.exists(manifest_path):
+                    os.remove(manifest_path)
                 
                 # Remove from database
-                conn = sqlite3.connect(self.db_manager.db_path)
-                c = conn.cursor()
-                c.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
-                conn.commit()
-                conn.close()
-                return True
+                return self.db_manager.delete_snapshot(snapshot_id)
             except Exception as e:
                 print(f"Error deleting snapshot: {e}")
         return False
     
+    def clear_all_snapshots(self):
+        """Delete every snapshot and empty the object store; returns the number deleted"""
+        deleted = sum(1 for snapshot in self.db_manager.get_snapshots()
+                      if self.delete_snapshot(snapshot['id']))
+        self.collect_garbage()
+        return deleted
+    
+    def collect_garbage(self, dry_run=False, max_age=3600):
+        """
+        Remove what no snapshot record references: blobs not listed by a
+        deduplicated snapshot in the database, archives, copies and
+        manifests left without a record, and temporary files of interrupted
+        writes. Orphans younger than max_age seconds are kept (they may
+        belong to a snapshot that is still being created).
+        Returns {'objects', 'objects_removed', 'orphans_removed', 'bytes_freed'},
+        or None when a manifest cannot be read (its blobs could not be told apart).
+        """
+        with self.store_lock:
+            snapshots = self.db_manager.get_snapshots()
+            references, _, manifests = self._dedup_references(snapshots)
+            unreadable = [s['name'] for s in snapshots
+                          if SnapshotManifest.is_manifest(s['directory_path'])
+                          and os.path.exists(s['directory_path']) and s['id'] not in manifests]
+            if unreadable:
+                print(f"Error collecting garbage: unreadable manifest of {', '.join(unreadable)}")
+                return None
+            
+            stats = {'objects': 0, 'objects_removed': 0, 'orphans_removed': 0, 'bytes_freed': 0}
+            for path, size in self._orphaned_snapshot_paths(snapshots, max_age):
+                if not dry_run:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                stats['orphans_removed'] += 1
+                stats['bytes_freed'] += size
+            
+            for digest, _, size in list(self.store.iter_objects()):
+                stats['objects'] += 1
+                if digest in references:
+                    continue
+                if not dry_run:
+                    self.store.remove_object(digest)
+                stats['objects_removed'] += 1
+                stats['bytes_freed'] += size
+            if not dry_run:
+                stats['bytes_freed'] += self.store.remove_stale_temp_files()
+            return stats
+    
+    def _orphaned_snapshot_paths(self, snapshots, max_age=0):
+        """
+        Archives, copies and manifests in the snapshot folders that no
+        record points to, as (path, size); entries modified within the last
+        max_age seconds and the snapshot being created are skipped
+        """
+        recorded = set()
+        for snapshot in snapshots:
+            recorded.add(os.path.abspath(snapshot['directory_path']))
+            recorded.add(os.path.abspath(SnapshotManifest.manifest_path(snapshot['directory_path'])))
+        skipped = {os.path.abspath(self.store.objects_dir), os.path.abspath(self.manifests_dir)}
+        if self.active_snapshot_path:
+            skipped.add(os.path.abspath(self.active_snapshot_path))
+            skipped.add(os.path.abspath(SnapshotManifest.manifest_path(self.active_snapshot_path)))
+        
+        orphans = []
+        now = time.time()
+        for directory in (self.snapshots_dir, self.manifests_dir):
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                path = os.path.abspath(os.path.join(directory, name))
+                if path in recorded or path in skipped:
+                    continue
+                if now - os.path.getmtime(path) < max_age:
+                    continue
+                orphans.append((path, self._path_size(path)))
+        return orphans
+    
+    def _dedup_references(self, snapshots):
+        """
+        Blob references of deduplicated snapshots:
+        (hash -> ids of snapshots using it, hash -> blob size, id -> manifest)
+        """
+        references = {}
+        blob_sizes = {}
+        manifests = {}
+        for snapshot in snapshots:
+            if not SnapshotManifest.is_manifest(snapshot['directory_path']):
+                continue
+            manifest = self._load_manifest_for_path(snapshot['directory_path'])
+            if manifest is None:
+                continue
+            manifests[snapshot['id']] = manifest
+            for entry in manifest.files.values():
+                references.setdefault(entry['hash'], set()).add(snapshot['id'])
+                blob_sizes[entry['hash']] = entry['size']
+        return references, blob_sizes, manifests
+    
+    @staticmethod
+    def _path_size(path):
+        """Bytes on disk of a file or directory tree"""
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        total = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                total += os.path.getsize(os.path.join(root, file))
+        return total
+    
+    def get_space_report(self):
+        """
+        Logical versus physical bytes per snapshot.
+        logical_bytes: size of the files the snapshot contains;
+        physical_bytes: bytes only this snapshot occupies (the archive or
+        copy, or blobs no other snapshot references); shared_bytes: blobs
+        shared with other deduplicated snapshots.
+        Totals include the store size, unreferenced (garbage) blob bytes and
+        orphaned bytes (snapshot files without a record); collect_garbage()
+        frees both.
+        """
+        snapshots = self.db_manager.get_snapshots()
+        references, blob_sizes, manifests = self._dedup_references(snapshots)
+        
+        report = []
+        for snapshot in snapshots:
+            path = snapshot['directory_path']
+            item = {'id': snapshot['id'], 'name': snapshot['name'], 'storage': snapshot['storage'],
+                    'created_date': snapshot['created_date'], 'logical_bytes': 0,
+                    'physical_bytes': 0, 'shared_bytes': 0, 'missing': not os.path.exists(path)}
+            if snapshot['id'] in manifests:
+                files = manifests[snapshot['id']].files
+                item['logical_bytes'] = sum(entry['size'] for entry in files.values())
+                for digest in {entry['hash'] for entry in files.values()}:
+                    if len(references[digest]) == 1:
+                        item['physical_bytes'] += blob_sizes[digest]
+                    else:
+                        item['shared_bytes'] += blob_sizes[digest]
+            elif not item['missing']:
+                item['physical_bytes'] = self._path_size(path)
+                manifest = self._load_manifest_for_path(path)
+                item['logical_bytes'] = (manifest.total_size() if manifest
+                                         else self._path_size(path) if os.path.isdir(path) else 0)
+            report.append(item)
+        
+        store_bytes = 0
+        garbage_bytes = 0
+        for digest, _, size in self.store.iter_objects():
+            store_bytes += size
+            if digest not in references:
+                garbage_bytes += size
+        orphaned_bytes = sum(size for _, size in self._orphaned_snapshot_paths(snapshots))
+        return {
+            'snapshots': report,
+            'logical_bytes': sum(item['logical_bytes'] for item in report),
+            'physical_bytes': (sum(item['physical_bytes'] for item in report if item['storage'] != STORAGE_DEDUP)
+                               + store_bytes + orphaned_bytes),
+            'store_bytes': store_bytes,
+            'garbage_bytes': garbage_bytes,
+            'orphaned_bytes': orphaned_bytes
+        }
+    
+    @staticmethod
+    def select_retained_snapshots(snapshots, keep_last=None, keep_daily=None, keep_weekly=None):
+        """
+        Ids of snapshots kept by count rules: the newest keep_last, the
+        newest snapshot of each of the last keep_daily days and of each of
+        the last keep_weekly ISO weeks that have snapshots.
+        Without any rule every snapshot is kept.
+        """
+        if not (keep_last or keep_daily or keep_weekly):
+            return {snapshot['id'] for snapshot in snapshots}
+        
+        newest_first = sorted(snapshots, key=lambda s: (s['created_date'], s['id']), reverse=True)
+        keep = {snapshot['id'] for snapshot in newest_first[:keep_last or 0]}
+        
+        for count, period in ((keep_daily, lambda date: date.date()),
+                              (keep_weekly, lambda date: date.isocalendar()[:2])):
+            if not count:
+                continue
+            periods = set()
+            for snapshot in newest_first:
+                key = period(datetime.fromisoformat(snapshot['created_date']))
+                if key not in periods:
+                    if len(periods) >= count:
+                        break
+                    periods.add(key)
+                    keep.add(snapshot['id'])
+        return keep
+    
+    def apply_retention(self, keep_last=None, keep_daily=None, keep_weekly=None, max_bytes=None,
+                        source_path=None, dry_run=False):
+        """
+        Delete snapshots not kept by the retention policy and collect garbage.
+        Count rules apply to the snapshots of each source directory separately
+        (or only to source_path). max_bytes bounds the physical size of all
+        snapshots: the oldest remaining snapshots are deleted until it fits,
+        but the newest snapshot of each source is always kept.
+        Returns {'kept', 'deleted', 'bytes_freed'} (ids; bytes are estimated in dry_run).
+        """
+        snapshots = self.db_manager.get_snapshots()
+        if source_path:
+            source_path = os.path.abspath(source_path)
+            snapshots = [s for s in snapshots if s['source_path'] == source_path]
+        
+        groups = {}
+        for snapshot in snapshots:
+            groups.setdefault(snapshot['source_path'], []).append(snapshot)
+        keep = set()
+        newest = set()
+        for group in groups.values():
+            keep |= self.select_retained_snapshots(group, keep_last, keep_daily, keep_weekly)
+            newest.add(max(group, key=lambda s: (s['created_date'], s['id']))['id'])
+        delete = [s for s in snapshots if s['id'] not in keep]
+        
+        if max_bytes is not None:
+            all_snapshots = self.db_manager.get_snapshots()
+            references, blob_sizes, _ = self._dedup_references(all_snapshots)
+            report = {item['id']: item for item in self.get_space_report()['snapshots']}
+            remaining_ids = {s['id'] for s in all_snapshots} - {s['id'] for s in delete}
+            
+            def occupied():
+                total = sum(report[i]['physical_bytes'] for i in remaining_ids
+                            if report[i]['storage'] != STORAGE_DEDUP)
+                return total + sum(blob_sizes[digest] for digest, users in references.items()
+                                   if users & remaining_ids)
+            
+            for snapshot in sorted(snapshots, key=lambda s: (s['created_date'], s['id'])):
+                if snapshot['id'] not in remaining_ids or snapshot['id'] in newest:
+                    continue
+                if occupied() <= max_bytes:
+                    break
+                delete.append(snapshot)
+                remaining_ids.discard(snapshot['id'])
+        
+        delete_ids = {s['id'] for s in delete}
+        result = {'kept': sorted(s['id'] for s in snapshots if s['id'] not in delete_ids),
+                  'deleted': sorted(delete_ids), 'bytes_freed': 0}
+        if dry_run:
+            result['bytes_freed'] = self._estimate_freed_bytes(delete)
+            return result
+        
+        before = self.get_space_report()['physical_bytes']
+        for snapshot in delete:
+            self.delete_snapshot(snapshot['id'])
+        self.collect_garbage()
+        result['bytes_freed'] = before - self.get_space_report()['physical_bytes']
+        return result
+    
+    def _estimate_freed_bytes(self, delete):
+        """Physical bytes released by deleting the given snapshots"""
+        snapshots = self.db_manager.get_snapshots()
+        references, blob_sizes, _ = self._dedup_references(snapshots)
+        report = {item['id']: item for item in self.get_space_report()['snapshots']}
+        delete_ids = {s['id'] for s in delete}
+        freed = sum(report[i]['physical_bytes'] for i in delete_ids
+                    if report[i]['storage'] != STORAGE_DEDUP)
+        freed += sum(blob_sizes[d] for d, users in references.items() if users and users <= delete_ids)
+        return freed
+    
     def copy_snapshot_to_directory(self, snapshot_id, destination_base):
         """Copy snapshot to specified directory"""
         snapshots = self.db_manager.get_snapshots()
@@ -106,17 +955,183 @@ class SnapshotManager:
             return self.restore_snapshot(snapshot_path, dest_path, snapshot['compressed'])
         return False
     
-    def compare_with_snapshot(self, current_project_path, snapshot_id):
-        """Compare current project with a snapshot"""
-        from project_analyzer import ProjectAnalyzer
+    def analyze_live_project(self, project_path, filter_profile=None):
+        """
+        Per-file entries ({'size', 'mtime', 'hash', 'lines', 'chars'}) of a
+        live project. Results are cached: only files whose size or mtime
+        changed since the previous call are read again.
+        """
+        project_path = os.path.abspath(project_path)
+        filter_profile = filter_profile or DEFAULT_FILTER_PROFILE
+        cache_key = (project_path, filter_profile)
+        cached = self.live_analysis_cache.get(cache_key, {})
         
-        snapshots = self.db_manager.get_snapshots()
-        snapshot = next((s for s in snapshots if s['id'] == snapshot_id), None)
+        files = {}
+        for file_path, rel_path in iter_source_files(project_path, filter_profile):
+            stat = os.stat(file_path)
+            entry = cached.get(rel_path)
+            if not entry or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                info = scan_file(file_path)
+                entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': info['hash'],
+                         'lines': info['lines'], 'chars': info['chars']}
+            files[rel_path] = entry
         
+        self.live_analysis_cache[cache_key] = files
+        return files
+    
+    @staticmethod
+    def _manifest_stats(files):
+        return {
+            'files': len(files),
+            'lines': sum(entry.get('lines') or 0 for entry in files.values()),
+            'characters': sum(entry.get('chars') or 0 for entry in files.values()),
+            'size': sum(entry['size'] for entry in files.values())
+        }
+    
+    def compare_with_snapshot(self, current_project_path, snapshot_id):
+        """
+        Compare current project with a snapshot; the result has the
+        structure of ProjectAnalyzer.compare_projects.
+        Snapshots with a manifest are compared by content hashes without
+        extracting anything; open a line diff of a modified file with
+        get_snapshot_file_diff (its relative path is path2 relative to the
+        project). Older snapshots are extracted and analysed.
+        """
+        snapshot = self.get_snapshot(snapshot_id)
         if not snapshot:
             return None
         
-        # Extract snapshot to temporary directory for comparison
+        manifest = self._load_manifest_for_path(snapshot['directory_path'])
+        if manifest is None:
+            return self._compare_extracted_snapshot(current_project_path, snapshot)
+        
+        try:
+            # The live project is walked with the snapshot's filter profile,
+            # so folders left out of the snapshot are not reported as added
+            current_files = self.analyze_live_project(current_project_path, manifest.filter_profile)
+        except Exception as e:
+            print(f"Error analyzing project: {e}")
+            return None
+        
+        # Same result as ProjectAnalyzer.compare_projects (and the extracting
+        # fallback), built from the entries: files are compared by hash
+        analyzer = ProjectAnalyzer()
+        snapshot_stats = analyzer.stats_from_entries(snapshot['directory_path'], manifest.files)
+        current_stats = analyzer.stats_from_entries(current_project_path, current_files)
+        return {
+            'project1': {
+                'path': snapshot['directory_path'],
+                'stats': snapshot_stats
+            },
+            'project2': {
+                'path': current_project_path,
+                'stats': current_stats
+            },
+            'differences': analyzer.find_differences(snapshot_stats['file_tree'],
+                                                     current_stats['file_tree'])
+        }
+    
+    def _snapshot_file_entries(self, snapshot_id):
+        """
+        Files of a snapshot as {relative path: entry}: rows of the
+        snapshot_files table, or the manifest for snapshots not indexed yet
+        """
+        rows = self.db_manager.get_snapshot_files(snapshot_id)
+        if rows:
+            return {row['relpath']: row for row in rows}
+        manifest = self.get_snapshot_manifest(snapshot_id)
+        return manifest.files if manifest is not None else None
+    
+    def compare_snapshots(self, snapshot_a_id, snapshot_b_id):
+        """
+        Compare two stored snapshots by content hashes, without reading
+        or extracting any file. Changes are reported from a to b; a file
+        removed from one path and added under another with the same
+        content is reported as renamed. Line diffs: get_snapshots_file_diff.
+        """
+        snapshot_a = self.get_snapshot(snapshot_a_id)
+        snapshot_b = self.get_snapshot(snapshot_b_id)
+        if not snapshot_a or not snapshot_b:
+            return None
+        files_a = self._snapshot_file_entries(snapshot_a_id)
+        files_b = self._snapshot_file_entries(snapshot_b_id)
+        if files_a is None or files_b is None:
+            print("Error comparing snapshots: snapshot has no manifest")
+            return None
+        
+        differences = {'added': [], 'removed': [], 'modified': [], 'renamed': [], 'unchanged': []}
+        removed_by_hash = {}
+        for rel_path in sorted(files_a.keys() - files_b.keys()):
+            removed_by_hash.setdefault(files_a[rel_path]['hash'], []).append(rel_path)
+        
+        for rel_path in sorted(files_b.keys() - files_a.keys()):
+            entry = files_b[rel_path]
+            candidates = removed_by_hash.get(entry['hash'])
+            if candidates:
+                # Prefer a file with the same name (moved to another folder)
+                name = os.path.basename(rel_path)
+                old_path = next((c for c in candidates if os.path.basename(c) == name), candidates[0])
+                candidates.remove(old_path)
+                differences['renamed'].append({'rel_path1': old_path, 'rel_path2': rel_path,
+                                               'size': entry['size']})
+            else:
+                differences['added'].append({'rel_path': rel_path, 'size': entry['size'],
+                                             'lines': entry.get('lines')})
+        
+        for candidates in removed_by_hash.values():
+            for rel_path in candidates:
+                entry = files_a[rel_path]
+                differences['removed'].append({'rel_path': rel_path, 'size': entry['size'],
+                                               'lines': entry.get('lines')})
+        differences['removed'].sort(key=lambda item: item['rel_path'])
+        
+        for rel_path in sorted(files_a.keys() & files_b.keys()):
+            entry_a = files_a[rel_path]
+            entry_b = files_b[rel_path]
+            if entry_a['hash'] == entry_b['hash']:
+                differences['unchanged'].append({'rel_path': rel_path})
+            else:
+                differences['modified'].append({
+                    'rel_path': rel_path,
+                    'size1': entry_a['size'], 'size2': entry_b['size'],
+                    'lines1': entry_a.get('lines'), 'lines2': entry_b.get('lines')
+                })
+        
+        stats_a = self._manifest_stats(files_a)
+        stats_b = self._manifest_stats(files_b)
+        stats = {bucket: len(items) for bucket, items in differences.items()}
+        stats.update({
+            'bytes_added': sum(item['size'] for item in differences['added']),
+            'bytes_removed': sum(item['size'] for item in differences['removed']),
+            'size_change': stats_b['size'] - stats_a['size'],
+            'lines_change': stats_b['lines'] - stats_a['lines']
+        })
+        
+        return {
+            'snapshot1': {'id': snapshot_a_id, 'name': snapshot_a['name'], 'stats': stats_a},
+            'snapshot2': {'id': snapshot_b_id, 'name': snapshot_b['name'], 'stats': stats_b},
+            'differences': differences,
+            'stats': stats
+        }
+    
+    def get_snapshots_file_diff(self, snapshot_a_id, snapshot_b_id, rel_path, rel_path_b=None):
+        """
+        Unified diff of one file between two snapshots; only the two blobs
+        involved are read. rel_path_b is the new path of a renamed file.
+        """
+        rel_path_b = rel_path_b or rel_path
+        try:
+            lines_a = self._read_snapshot_lines(snapshot_a_id, rel_path)
+            lines_b = self._read_snapshot_lines(snapshot_b_id, rel_path_b)
+            return list(difflib.unified_diff(lines_a, lines_b,
+                                             fromfile=f"snapshot {snapshot_a_id}:{rel_path}",
+                                             tofile=f"snapshot {snapshot_b_id}:{rel_path_b}",
+                                             lineterm=''))
+        except Exception as e:
+            return [f"Error comparing files: {e}"]
+    
+    def _compare_extracted_snapshot(self, current_project_path, snapshot):
+        """Compare with a snapshot that has no manifest by extracting it"""
         with tempfile.TemporaryDirectory() as temp_dir:
             if self.restore_snapshot(snapshot['directory_path'], temp_dir, snapshot['compressed']):
                 analyzer = ProjectAnalyzer()
@@ -0,0 +1,190 @@
+import os
+import time
+import queue
+import threading
+from snapshot_store import iter_source_files
+
+
+class SnapshotCancelled(Exception):
+    """Raised inside a snapshot creation that was cancelled"""
+
+
+def format_duration(seconds):
+    """m:ss, or h:mm:ss for an hour and more"""
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class SnapshotProgress:
+    """
+    Progress of a snapshot creation, passed to progress callbacks as the
+    message. str() is an English status line; a UI in another language
+    formats its own from the fields. files_total and bytes_total are None
+    until the walk has finished, eta is None while it cannot be estimated.
+    """
+
+    def __init__(self, files_done, bytes_done, files_total=None, bytes_total=None, eta=None):
+        self.files_done = files_done
+        self.bytes_done = bytes_done
+        self.files_total = files_total
+        self.bytes_total = bytes_total
+        self.eta = eta
+
+    def __str__(self):
+        megabytes = self.bytes_done / (1024 * 1024)
+        if self.bytes_total is None:
+            return f"Saved {self.files_done} files ({megabytes:.1f} MB)"
+        message = (f"Saved {self.files_done} of {self.files_total} files "
+                   f"({megabytes:.1f} of {self.bytes_total / (1024 * 1024):.1f} MB)")
+        if self.eta is not None:
+            message += f", {format_duration(self.eta)} left"
+        return message
+
+
+class SnapshotPipeline:
+    """
+    Source side of snapshot creation. A walker thread stats source files
+    into a queue of at most QUEUE_SIZE entries, and the snapshot writer
+    reads, compresses and writes them as it takes them. Memory use is
+    bounded whatever the size of the tree. The walker also sums the tree
+    size and publishes the totals when the walk finishes, so the tree is
+    walked once; from then on progress has a percentage and an ETA.
+    Progress is counted in files and bytes, and creation can be stopped
+    with cancel().
+    """
+
+    QUEUE_SIZE = 256
+    PROGRESS_INTERVAL = 0.1
+    # How often blocked threads look at the stop flag, in seconds
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, source_path, filter_profile=None, progress_callback=None):
+        self.source_path = source_path
+        self.filter_profile = filter_profile
+        self.progress_callback = progress_callback
+        self.cancelled = False
+        # Totals are None until the walker has walked the whole tree
+        self.files_total = None
+        self.bytes_total = None
+        self.files_done = 0
+        self.bytes_done = 0
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_time = None
+        self._last_progress = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        if exc_type is None:
+            self._report_progress(force=True)
+
+    def start(self):
+        """Start timing"""
+        self._start_time = time.monotonic()
+
+    def stop(self):
+        """Stop the walker thread and wait for it"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def cancel(self):
+        """Stop the snapshot; the caller removes what was already written"""
+        self.cancelled = True
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise SnapshotCancelled()
+
+    def _start_thread(self, target, name, *args):
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def iter_files(self):
+        """
+        Yield (file_path, relative_path, size) of the source files from the
+        walker thread. Raises SnapshotCancelled after cancel().
+        """
+        files = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._start_thread(self._walk, 'snapshot-walker', files)
+        while True:
+            self.check_cancelled()
+            try:
+                item = files.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _walk(self, files):
+        files_seen = bytes_seen = 0
+        try:
+            for file_path, rel_path in iter_source_files(self.source_path, self.filter_profile):
+                size = os.path.getsize(file_path)
+                files_seen += 1
+                bytes_seen += size
+                if not self._put(files, (file_path, rel_path, size)):
+                    return
+            # bytes_total is set last: progress reads it to know the totals are complete
+            self.files_total, self.bytes_total = files_seen, bytes_seen
+            self._put(files, None)
+        except Exception as e:
+            self._put(files, e)
+
+    def _put(self, files, item):
+        """Put into the bounded queue, waiting for room; False once the pipeline is stopped"""
+        while not self._stop.is_set():
+            try:
+                files.put(item, timeout=self.POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def advance(self, size):
+        """Count one file of size bytes as done"""
+        self.files_done += 1
+        self.bytes_done += size
+        self._report_progress()
+
+    def eta(self):
+        """Estimated seconds left (None until the totals are known)"""
+        if self.bytes_total is None or not self.bytes_done or self._start_time is None:
+            return None
+        rate = self.bytes_done / max(time.monotonic() - self._start_time, 1e-6)
+        return max(self.bytes_total - self.bytes_done, 0) / rate
+
+    def _report_progress(self, force=False):
+        """
+        Call progress_callback(percent, progress) with a SnapshotProgress,
+        at most every PROGRESS_INTERVAL seconds
+        """
+        if not self.progress_callback:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_progress < self.PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+
+        if force:
+            percent = 100
+        elif self.bytes_total:
+            percent = min(self.bytes_done / self.bytes_total * 100, 100)
+        else:
+            percent = 0
+        if self.bytes_total is None or force:
+            progress = SnapshotProgress(self.files_done, self.bytes_done)
+        else:
+            progress = SnapshotProgress(self.files_done, self.bytes_done, self.files_total,
+                                        self.bytes_total, self.eta())
+        self.progress_callback(percent, progress)
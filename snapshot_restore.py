@@ -0,0 +1,223 @@
+import io
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from snapshot_store import COPY_AUTO, COPY_HARDLINK, copy_file_fast
+
+
+class RestoreCancelled(Exception):
+    """Raised inside a restore that was cancelled"""
+
+
+class ParallelRestorer:
+    """
+    Restores snapshot files on a thread pool. The directory skeleton is
+    created in one pass first, then workers copy or decompress files with
+    large buffers and set their mtimes. Sources with random access (ZIP
+    members, store blobs, copied files) are read by the workers; sequential
+    tar streams are read by the caller and written by the workers.
+    """
+
+    BUFFER_SIZE = 4 * 1024 * 1024
+    # Stream members up to this size are read into memory and written by a worker
+    INLINE_SIZE = 4 * 1024 * 1024
+    # Limit of stream data read ahead of the workers
+    MAX_PENDING_BYTES = 64 * 1024 * 1024
+    PROGRESS_INTERVAL = 0.1
+
+    def __init__(self, workers=None, progress_callback=None):
+        # Restore is I/O bound, so more threads than cores keep the disk busy
+        self.workers = workers or min(16, (os.cpu_count() or 1) * 2)
+        self.progress_callback = progress_callback
+        self.cancelled = False
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        # Number of files restored by each copy method ('reflink', 'hardlink', ...)
+        self.copy_methods = {}
+        self._lock = threading.Lock()
+        self._created_dirs = set()
+        self._last_progress = 0
+
+    def cancel(self):
+        """Stop the restore; files already written are kept"""
+        self.cancelled = True
+
+    @staticmethod
+    def target_path(destination, rel_path):
+        """Destination path of a '/'-separated relative path (ValueError if it escapes destination)"""
+        parts = [part for part in rel_path.split('/') if part]
+        if (not parts or rel_path.startswith('/') or '..' in parts
+                or os.path.splitdrive(parts[0])[0]):
+            raise ValueError(f"Unsafe path in snapshot: {rel_path}")
+        return os.path.join(destination, *parts)
+
+    def prepare(self, destination, entries):
+        """Set totals and create the directory skeleton of all entries in one pass"""
+        self.files_total = len(entries)
+        self.bytes_total = sum(entry['size'] for entry in entries)
+        directories = {destination}
+        for entry in entries:
+            directories.add(os.path.dirname(self.target_path(destination, entry['path'])))
+        for directory in sorted(directories):
+            os.makedirs(directory, exist_ok=True)
+        self._created_dirs.update(directories)
+
+    def restore(self, destination, entries, open_source):
+        """
+        Restore entries ({'path', 'size', 'mtime'}) in parallel;
+        open_source(entry) returns a readable binary stream and must be
+        safe to call from worker threads.
+        """
+        self.prepare(destination, entries)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._restore_entry, destination, entry, open_source)
+                       for entry in entries]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        self._report_progress(force=True)
+
+    def restore_files(self, destination, entries, source_path, copy_mode=COPY_AUTO):
+        """
+        Restore entries from files on disk in parallel; source_path(entry)
+        returns the file to copy. Files are reflinked or copied in the kernel
+        when possible; with 'hardlink' (only safe for immutable store blobs)
+        they are linked, falling back to a copy across filesystems.
+        """
+        self.prepare(destination, entries)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._copy_entry, destination, entry, source_path(entry), copy_mode)
+                       for entry in entries]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        self._report_progress(force=True)
+
+    def restore_stream(self, destination, members, entries=None):
+        """
+        Restore from a sequential source: members yields (entry, stream)
+        pairs in archive order. Each member is read here and written by a
+        worker; members larger than INLINE_SIZE are written directly.
+        entries (e.g. from a manifest) give the skeleton and totals up front.
+        """
+        if entries is not None:
+            self.prepare(destination, entries)
+        else:
+            os.makedirs(destination, exist_ok=True)
+            self._created_dirs.add(destination)
+
+        in_flight = deque()
+        pending_bytes = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for entry, stream in members:
+                    if self.cancelled:
+                        raise RestoreCancelled()
+                    if entry['size'] > self.INLINE_SIZE:
+                        self._write_file(destination, entry, stream)
+                        continue
+                    data = io.BytesIO(stream.read())
+                    in_flight.append((executor.submit(self._write_file, destination, entry, data),
+                                      entry['size']))
+                    pending_bytes += entry['size']
+                    while in_flight and (pending_bytes > self.MAX_PENDING_BYTES
+                                         or len(in_flight) > self.workers * 4):
+                        future, size = in_flight.popleft()
+                        future.result()
+                        pending_bytes -= size
+                while in_flight:
+                    in_flight.popleft()[0].result()
+            finally:
+                for future, _ in in_flight:
+                    future.cancel()
+        self._report_progress(force=True)
+
+    def _restore_entry(self, destination, entry, open_source):
+        if self.cancelled:
+            raise RestoreCancelled()
+        with open_source(entry) as src:
+            self._write_file(destination, entry, src)
+
+    def _copy_entry(self, destination, entry, source, copy_mode):
+        if self.cancelled:
+            raise RestoreCancelled()
+        target = self.target_path(destination, entry['path'])
+        self._ensure_directory(os.path.dirname(target))
+        try:
+            try:
+                method = copy_file_fast(source, target, copy_mode)
+            except OSError:
+                if copy_mode != COPY_HARDLINK:
+                    raise
+                method = copy_file_fast(source, target, COPY_AUTO)
+        except BaseException:
+            if os.path.lexists(target):
+                os.remove(target)
+            raise
+        # A hardlink shares the inode of the blob, so its mtime is left alone
+        if method != COPY_HARDLINK:
+            os.utime(target, (entry['mtime'], entry['mtime']))
+        with self._lock:
+            self.copy_methods[method] = self.copy_methods.get(method, 0) + 1
+        self._advance(entry['size'])
+
+    def _ensure_directory(self, directory):
+        if directory not in self._created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._created_dirs.add(directory)
+
+    def _write_file(self, destination, entry, src):
+        """Copy one source stream to its destination file and restore its mtime"""
+        target = self.target_path(destination, entry['path'])
+        self._ensure_directory(os.path.dirname(target))
+
+        try:
+            # Unbuffered file: every write is already a BUFFER_SIZE chunk
+            with open(target, 'wb', buffering=0) as dst:
+                while True:
+                    if self.cancelled:
+                        raise RestoreCancelled()
+                    chunk = src.read(self.BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+        except BaseException:
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+        os.utime(target, (entry['mtime'], entry['mtime']))
+        self._advance(entry['size'])
+
+    def _advance(self, size):
+        with self._lock:
+            self.files_done += 1
+            self.bytes_done += size
+        self._report_progress()
+
+    def _report_progress(self, force=False):
+        """Call progress_callback(percent, message), at most every PROGRESS_INTERVAL seconds"""
+        if not self.progress_callback:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_progress < self.PROGRESS_INTERVAL:
+                return
+            self._last_progress = now
+            files_done, bytes_done = self.files_done, self.bytes_done
+        if self.bytes_total:
+            percent = min(bytes_done / self.bytes_total * 100, 100)
+        else:
+            percent = 100 if force else 0
+        total = f" of {self.files_total}" if self.files_total else ""
+        self.progress_callback(percent, f"Restored {files_done}{total} files "
+                                        f"({bytes_done / (1024 * 1024):.1f} MB)")
@@ -0,0 +1,394 @@
+import os
+import sys
+import json
+import stat
+import codecs
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime
+from project_analyzer import SKIP_FOLDERS, SKIP_EXTENSIONS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Build outputs and IDE/platform caches, on top of the folders skipped by the analyzer
+CACHE_FOLDERS = frozenset({'.idea', '.gradle', '.cxx', 'Pods', '.symlinks', 'ephemeral',
+                           '.pub-cache', '.pub', 'DerivedData', '.build'})
+ASSET_FOLDERS = frozenset({'assets', 'fonts', 'images'})
+ASSET_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico', '.ttf', '.otf',
+                              '.mp3', '.mp4', '.wav', '.ogg', '.lottie'})
+
+
+class SnapshotFilter:
+    """Snapshot filter profile: folders pruned during the walk and skipped file types"""
+
+    def __init__(self, name, description, exclude_dirs=(), exclude_extensions=()):
+        self.name = name
+        self.description = description
+        self.exclude_dirs = frozenset(exclude_dirs)
+        self.exclude_extensions = frozenset(exclude_extensions)
+
+    def include_file(self, file_name):
+        return os.path.splitext(file_name)[1].lower() not in self.exclude_extensions
+
+    def copytree_ignore(self, directory, names):
+        """Ignore callback for shutil.copytree"""
+        ignored = []
+        for name in names:
+            if os.path.isdir(os.path.join(directory, name)):
+                if name in self.exclude_dirs:
+                    ignored.append(name)
+            elif not self.include_file(name):
+                ignored.append(name)
+        return ignored
+
+
+DEFAULT_FILTER_PROFILE = 'full'
+
+FILTER_PROFILES = {profile.name: profile for profile in (
+    SnapshotFilter('sources', 'Sources only',
+                   SKIP_FOLDERS | CACHE_FOLDERS | ASSET_FOLDERS, SKIP_EXTENSIONS | ASSET_EXTENSIONS),
+    SnapshotFilter('sources_assets', 'Sources and assets', SKIP_FOLDERS | CACHE_FOLDERS),
+    SnapshotFilter('full', 'Everything'),
+)}
+
+
+def get_filter_profile(name):
+    """Filter profile by name (ValueError if unknown)"""
+    if name not in FILTER_PROFILES:
+        raise ValueError(f"Unknown snapshot filter profile: {name}")
+    return FILTER_PROFILES[name]
+
+
+def iter_source_files(source_path, profile=None):
+    """
+    Walk a source tree, yielding (file_path, relative_path) for every file.
+    Folders excluded by the filter profile are pruned and never read.
+    """
+    snapshot_filter = get_filter_profile(profile or DEFAULT_FILTER_PROFILE)
+    for root, dirs, files in os.walk(source_path):
+        dirs[:] = sorted(d for d in dirs if d not in snapshot_filter.exclude_dirs)
+        for file in sorted(files):
+            if not snapshot_filter.include_file(file):
+                continue
+            file_path = os.path.join(root, file)
+            yield file_path, os.path.relpath(file_path, source_path).replace(os.sep, '/')
+
+
+# Linux ioctl that makes a file share the extents of another (btrfs, XFS, bcachefs...)
+FICLONE = 0x40049409
+
+# File copy modes: 'auto' tries a reflink, then in-kernel copies, then a plain copy;
+# 'reflink' requires a reflink, 'copy' always copies the data (still in the kernel
+# when possible); 'hardlink' links to the source and is only used for immutable store blobs
+COPY_AUTO = 'auto'
+COPY_REFLINK = 'reflink'
+COPY_HARDLINK = 'hardlink'
+COPY_BYTES = 'copy'
+COPY_MODES = (COPY_AUTO, COPY_REFLINK, COPY_HARDLINK, COPY_BYTES)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _reflink(src_fd, dst_fd):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError("Reflinks are not supported on this platform")
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_data(src_fd, dst_fd, size):
+    """
+    Copy file data with copy_file_range, then sendfile, then read/write;
+    each method continues from the offset where the previous one failed.
+    Returns the name of the method that finished the copy.
+    """
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(src_fd, dst_fd, size - offset, offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+            return 'copy_file_range'
+        except OSError:
+            pass
+
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            while offset < size:
+                sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            return 'sendfile'
+        except OSError:
+            pass
+
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while True:
+        chunk = os.read(src_fd, COPY_BUFFER_SIZE)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+    return 'copy'
+
+
+def copy_file_fast(src, dst, mode=COPY_AUTO):
+    """
+    Copy file content (not metadata) by the cheapest available method and
+    return its name: 'hardlink', 'reflink', 'copy_file_range', 'sendfile'
+    or 'copy'. 'auto' falls back silently; 'reflink' and 'hardlink' raise
+    OSError when the filesystem cannot do them.
+    """
+    if mode not in COPY_MODES:
+        raise ValueError(f"Unknown copy mode: {mode}")
+    if mode == COPY_HARDLINK:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+        return COPY_HARDLINK
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if mode in (COPY_AUTO, COPY_REFLINK):
+            try:
+                _reflink(fsrc.fileno(), fdst.fileno())
+                return COPY_REFLINK
+            except OSError:
+                if mode == COPY_REFLINK:
+                    raise
+        return _copy_data(fsrc.fileno(), fdst.fileno(), os.fstat(fsrc.fileno()).st_size)
+
+
+def copy_file_with_stat(src, dst, mode=COPY_AUTO):
+    """copy_file_fast plus permission bits and timestamps, like shutil.copy2"""
+    copy_file_fast(src, dst, mode)
+    shutil.copystat(src, dst)
+    return dst
+
+
+class FileScanner:
+    """
+    Incremental scan_file: feed the content with update(chunk) as it is
+    read for something else (e.g. by a snapshot codec), then result()
+    returns {'hash', 'lines', 'chars', 'size'}
+    """
+
+    def __init__(self, hash_name='sha256'):
+        self.digest = hashlib.new(hash_name)
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self.size = 0
+        self.lines = 0
+        self.chars = 0
+        self.last_char = ''
+
+    def update(self, chunk):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        self._count(self.decoder.decode(chunk))
+
+    def _count(self, text):
+        if text:
+            self.lines += text.count('\n')
+            self.chars += len(text)
+            self.last_char = text[-1]
+
+    def result(self):
+        self._count(self.decoder.decode(b'', final=True))
+        lines = self.lines
+        if self.last_char and self.last_char != '\n':
+            lines += 1
+        return {'hash': self.digest.hexdigest(), 'lines': lines, 'chars': self.chars,
+                'size': self.size}
+
+
+def scan_file(file_path, hash_name='sha256', buffer_size=1024 * 1024):
+    """
+    Read a file once and return {'hash', 'lines', 'chars', 'size'}: the
+    content hash plus line and character counts of the content decoded as
+    UTF-8 (undecodable bytes are ignored, as in ProjectAnalyzer.analyze_file)
+    """
+    scanner = FileScanner(hash_name)
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(buffer_size)
+            if not chunk:
+                break
+            scanner.update(chunk)
+    return scanner.result()
+
+
+class ObjectStore:
+    """
+    Content-addressed blob store: every distinct file content is kept once
+    under objects/<first two hex digits>/<rest of the sha256>.
+    """
+
+    HASH_NAME = 'sha256'
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def object_path(self, digest):
+        """Path of the blob for a content hash"""
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def has_object(self, digest):
+        return os.path.exists(self.object_path(digest))
+
+    def hash_file(self, file_path):
+        """Content hash of a file"""
+        with open(file_path, 'rb') as f:
+            return hashlib.file_digest(f, self.HASH_NAME).hexdigest()
+
+    def put_file(self, file_path, digest=None, copy_mode=COPY_AUTO):
+        """
+        Store a file, returns (hash, written). digest is a hint: the hash of
+        an earlier read of the file. When that blob is already stored, the
+        file is not copied. Otherwise the file is copied ('auto' reflinks it
+        when the filesystem allows, so it takes no space) and the copy is
+        hashed, so a file changed since the hint was computed is stored
+        under the hash of its copied content, never under the hint.
+        """
+        if digest is not None and self.has_object(digest):
+            return digest, False
+
+        # Write to a temporary file first so a crash never leaves a partial blob
+        fd, temp_path = tempfile.mkstemp(dir=self.objects_dir, prefix='.tmp-')
+        os.close(fd)
+        try:
+            copy_file_fast(file_path, temp_path, copy_mode)
+            digest = self.hash_file(temp_path)
+            if self.has_object(digest):
+                os.remove(temp_path)
+                return digest, False
+            object_path = self.object_path(digest)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Blobs are immutable; read-only blobs also protect restores hardlinked to them
+            os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(temp_path, object_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest, True
+
+    def iter_objects(self):
+        """Stored blobs as (hash, path, size); temporary files of interrupted writes are skipped"""
+        for prefix in sorted(os.listdir(self.objects_dir)):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if name.startswith('.tmp-'):
+                    continue
+                object_path = os.path.join(prefix_dir, name)
+                yield prefix + name, object_path, os.path.getsize(object_path)
+
+    def remove_object(self, digest):
+        """Delete a blob (blobs are read-only, which blocks deletion on Windows)"""
+        object_path = self.object_path(digest)
+        os.chmod(object_path, stat.S_IWUSR | stat.S_IRUSR)
+        os.remove(object_path)
+        try:
+            os.rmdir(os.path.dirname(object_path))
+        except OSError:
+            pass  # Other blobs share the prefix directory
+
+    def remove_stale_temp_files(self, max_age=3600):
+        """Delete temporary files left by interrupted writes; returns their total size"""
+        freed = 0
+        now = datetime.now().timestamp()
+        # Blobs are written next to the prefix directories; older versions wrote them inside
+        directories = [self.objects_dir] + [os.path.join(self.objects_dir, prefix)
+                                            for prefix in os.listdir(self.objects_dir)]
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                temp_path = os.path.join(directory, name)
+                if name.startswith('.tmp-') and now - os.path.getmtime(temp_path) > max_age:
+                    freed += os.path.getsize(temp_path)
+                    os.remove(temp_path)
+        return freed
+
+    def open_object(self, digest):
+        """Open a stored blob for reading"""
+        return open(self.object_path(digest), 'rb')
+
+    def restore_object(self, digest, destination, copy_mode=COPY_AUTO):
+        """Copy (or hardlink) a stored blob to destination, returns the copy method used"""
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        return copy_file_fast(self.object_path(digest), destination, copy_mode)
+
+
+class SnapshotManifest:
+    """
+    List of files of a snapshot with their content hashes and line/char
+    counts. For deduplicated snapshots the manifest is the snapshot itself;
+    archives and copies get a sidecar manifest next to them.
+    """
+
+    VERSION = 1
+    SUFFIX = '.manifest.json'
+
+    def __init__(self, source_path='', created_date=None, files=None, filter_profile=None):
+        self.source_path = source_path
+        self.created_date = created_date or datetime.now().isoformat()
+        self.filter_profile = filter_profile or DEFAULT_FILTER_PROFILE
+        # Relative path (with '/') -> {'size', 'mtime', 'hash', 'lines', 'chars'};
+        # manifests written before line counts were recorded lack 'lines' and 'chars'
+        self.files = files or {}
+
+    def add_file(self, rel_path, size, mtime, digest, lines=None, chars=None):
+        entry = {'size': size, 'mtime': mtime, 'hash': digest}
+        if lines is not None:
+            entry['lines'] = lines
+            entry['chars'] = chars
+        self.files[rel_path] = entry
+
+    def total_size(self):
+        return sum(entry['size'] for entry in self.files.values())
+
+    def save(self, manifest_path):
+        data = {
+            'version': self.VERSION,
+            'source_path': self.source_path,
+            'created_date': self.created_date,
+            'filter_profile': self.filter_profile,
+            'files': self.files
+        }
+        temp_path = manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported manifest version: {data.get('version')}")
+        return cls(data['source_path'], data['created_date'], data['files'],
+                   data.get('filter_profile'))
+
+    @classmethod
+    def is_manifest(cls, snapshot_path):
+        return snapshot_path.endswith(cls.SUFFIX)
+
+    @classmethod
+    def manifest_path(cls, snapshot_path):
+        """Manifest of a snapshot: the snapshot itself or its sidecar file"""
+        if cls.is_manifest(snapshot_path):
+            return snapshot_path
+        return snapshot_path.rstrip('/\\') + cls.SUFFIX
@@ -0,0 +1,209 @@
+import os
+import time
+import hashlib
+import threading
+from datetime import datetime
+from snapshot_store import SnapshotManifest
+from snapshot_archive import codec_for_path
+
+# Verification results
+VERIFY_OK = 'ok'
+VERIFY_CORRUPT = 'corrupt'
+VERIFY_MISSING = 'missing'
+
+
+class IOThrottle:
+    """
+    Rate limit shared by verification workers: every read reserves a time
+    slot proportional to its size, so all threads together read at most
+    bytes_per_second (None - unlimited)
+    """
+
+    def __init__(self, bytes_per_second=None):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def consume(self, size):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next_slot, now)
+            self._next_slot = start + size / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+class SnapshotVerifier:
+    """
+    Checks snapshot contents: ZIP member CRCs, and content hashes against
+    the snapshot manifest (or blob names in the object store). One verifier
+    can check several snapshots in parallel; store blobs shared between
+    them are hashed once.
+    """
+
+    BUFFER_SIZE = 1024 * 1024
+    MAX_PROBLEMS = 20
+    MAX_PROBLEM_LENGTH = 300
+
+    def __init__(self, store, throttle=None):
+        self.store = store
+        self.throttle = throttle or IOThrottle()
+        self.cancelled = False
+        self._verified_blobs = {}
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _hash_stream(self, stream):
+        """sha256 of a stream, read in throttled chunks"""
+        digest = hashlib.sha256()
+        size = 0
+        while not self.cancelled:
+            chunk = stream.read(self.BUFFER_SIZE)
+            if not chunk:
+                break
+            self.throttle.consume(len(chunk))
+            digest.update(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size
+
+    def verify(self, snapshot_path):
+        """
+        Verify one snapshot. Returns {'status', 'files_checked',
+        'bytes_checked', 'problems', 'verified_date'}.
+        """
+        result = {'status': VERIFY_OK, 'files_checked': 0, 'bytes_checked': 0, 'problems': []}
+        try:
+            if not os.path.exists(snapshot_path):
+                result['status'] = VERIFY_MISSING
+                result['problems'].append(f"Snapshot not found: {snapshot_path}")
+            elif SnapshotManifest.is_manifest(snapshot_path):
+                self._verify_dedup(SnapshotManifest.load(snapshot_path), result)
+            else:
+                manifest_path = SnapshotManifest.manifest_path(snapshot_path)
+                manifest = SnapshotManifest.load(manifest_path) if os.path.exists(manifest_path) else None
+                if os.path.isdir(snapshot_path):
+                    self._verify_directory(snapshot_path, manifest, result)
+                else:
+                    self._verify_archive(snapshot_path, manifest, result)
+        except Exception as e:
+            # Unreadable archive (truncated, broken compressed stream...)
+            self._problem(result, f"Snapshot is unreadable: {e}")
+        result['verified_date'] = datetime.now().isoformat()
+        return result
+
+    def _problem(self, result, message, status=VERIFY_CORRUPT):
+        result['status'] = status
+        if len(result['problems']) < self.MAX_PROBLEMS:
+            # zipfile errors can quote whole raw headers
+            result['problems'].append(message[:self.MAX_PROBLEM_LENGTH])
+
+    def _check_entry(self, result, rel_path, digest, size, manifest):
+        result['files_checked'] += 1
+        result['bytes_checked'] += size
+        if manifest is None:
+            return
+        entry = manifest.files.get(rel_path)
+        if entry is None:
+            self._problem(result, f"{rel_path}: not in manifest")
+        elif entry['hash'] != digest:
+            self._problem(result, f"{rel_path}: content hash mismatch")
+
+    def _check_missing(self, result, manifest, seen):
+        if manifest is None:
+            return
+        for rel_path in manifest.files.keys() - seen:
+            self._problem(result, f"{rel_path}: missing from snapshot")
+
+    def _verify_archive(self, archive_path, manifest, result):
+        codec = codec_for_path(archive_path)
+        if codec is None:
+            raise ValueError(f"Unknown snapshot format: {archive_path}")
+        seen = set()
+        for entry, stream in codec.iter_file_streams(archive_path):
+            if self.cancelled:
+                return
+            seen.add(entry['path'])
+            try:
+                digest, size = self._hash_stream(stream)
+            except Exception as e:
+                # ZIP members are independent, so the check goes on (bad CRC, bad data)
+                result['files_checked'] += 1
+                self._problem(result, f"{entry['path']}: {e}")
+                continue
+            if self.cancelled:
+                return
+            self._check_entry(result, entry['path'], digest, size, manifest)
+        self._check_missing(result, manifest, seen)
+
+    def _verify_directory(self, snapshot_path, manifest, result):
+        seen = set()
+        for root, _, files in os.walk(snapshot_path):
+            for file in files:
+                if self.cancelled:
+                    return
+                file_path = os.path.join(root, file)
+                rel_path = os.path.relpath(file_path, snapshot_path).replace(os.sep, '/')
+                seen.add(rel_path)
+                with open(file_path, 'rb') as f:
+                    digest, size = self._hash_stream(f)
+                if self.cancelled:
+                    return
+                self._check_entry(result, rel_path, digest, size, manifest)
+        self._check_missing(result, manifest, seen)
+
+    def _verify_dedup(self, manifest, result):
+        for rel_path, entry in manifest.files.items():
+            if self.cancelled:
+                return
+            result['files_checked'] += 1
+            result['bytes_checked'] += entry['size']
+            status = self._verify_blob(entry['hash'])
+            if status == VERIFY_MISSING:
+                self._problem(result, f"{rel_path}: object {entry['hash'][:12]} is missing")
+            elif status != VERIFY_OK:
+                self._problem(result, f"{rel_path}: object {entry['hash'][:12]} is corrupt")
+
+    def _verify_blob(self, digest):
+        """Hash a store blob once per verifier; its name is its expected hash"""
+        with self._lock:
+            if digest in self._verified_blobs:
+                return self._verified_blobs[digest]
+        try:
+            with self.store.open_object(digest) as f:
+                actual, _ = self._hash_stream(f)
+            status = VERIFY_OK if actual == digest or self.cancelled else VERIFY_CORRUPT
+        except FileNotFoundError:
+            status = VERIFY_MISSING
+        except OSError:
+            status = VERIFY_CORRUPT
+        with self._lock:
+            self._verified_blobs[digest] = status
+        return status
+
+
+class SnapshotScrubber(threading.Thread):
+    """
+    Background job that calls scrub() every check_interval seconds until
+    stopped. Runs as a daemon thread so it never blocks application exit.
+    """
+
+    def __init__(self, scrub, check_interval=3600):
+        super().__init__(name='snapshot-scrubber', daemon=True)
+        self.scrub = scrub
+        self.check_interval = check_interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.scrub()
+            except Exception as e:
+                print(f"Error scrubbing snapshots: {e}")
+            self.stop_event.wait(self.check_interval)
+
+    def stop(self):
+        self.stop_event.set()
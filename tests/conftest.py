@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# Modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in its own directory: the database and snapshots are stored relative to it"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def project(workdir):
+    """Small Flutter-like project tree"""
+    root = workdir / 'project'
+    (root / 'lib' / 'widgets').mkdir(parents=True)
+    (root / 'lib' / 'main.dart').write_text("void main() {\n  runApp(App());\n}\n")
+    (root / 'lib' / 'widgets' / 'button.dart').write_text("class Button {}\n")
+    (root / 'pubspec.yaml').write_text("name: demo\n")
+    return root
@@ -0,0 +1,53 @@
+import sqlite3
+
+from database_manager import DatabaseManager
+
+
+def test_snapshots_with_the_same_name_get_their_own_rows():
+    db = DatabaseManager()
+    first = db.save_snapshot('release', '', 'snapshots/a.zip', True)
+    second = db.save_snapshot('release', '', 'snapshots/b.zip', True, parent_id=first)
+
+    snapshots = {snapshot['id']: snapshot for snapshot in db.get_snapshots()}
+    assert set(snapshots) == {first, second}
+    assert snapshots[second]['parent_id'] == first
+
+
+def test_unique_snapshot_names_are_migrated(workdir):
+    # Schema of the first snapshots table, before names could repeat
+    conn = sqlite3.connect('flutter_manager.db')
+    conn.execute('''CREATE TABLE snapshots
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     name TEXT UNIQUE,
+                     description TEXT,
+                     directory_path TEXT,
+                     compressed INTEGER,
+                     created_date TEXT)''')
+    conn.execute("INSERT INTO snapshots (name, description, directory_path, compressed, created_date) "
+                 "VALUES ('release', 'old', 'snapshots/old.zip', 1, '2024-01-01T00:00:00')")
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager()
+    new_id = db.save_snapshot('release', 'new', 'snapshots/new.zip', True, parent_id=1)
+
+    snapshots = {snapshot['id']: snapshot for snapshot in db.get_snapshots()}
+    assert snapshots[1]['description'] == 'old'
+    assert snapshots[new_id]['parent_id'] == 1
+    assert new_id > 1
+
+
+def test_file_history_keeps_earlier_snapshots_of_the_same_name():
+    db = DatabaseManager()
+    versions = []
+    for content_hash in ('h1', 'h2', 'h3'):
+        snapshot_id = db.save_snapshot('daily', '', f'snapshots/{content_hash}.zip', True,
+                                       source_path='/work/app')
+        db.save_snapshot_files(snapshot_id, {'lib/main.dart': {
+            'size': 10, 'mtime': 1.0, 'hash': content_hash, 'lines': 1, 'chars': 10}})
+        versions.append(snapshot_id)
+
+    history = db.get_file_history('lib/main.dart', '/work/app')
+    assert [row['snapshot_id'] for row in history] == versions
+    assert [row['hash'] for row in history] == ['h1', 'h2', 'h3']
+    assert db.get_snapshot_files(versions[0])[0]['hash'] == 'h1'
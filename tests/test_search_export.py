@@ -0,0 +1,35 @@
+import csv
+from datetime import datetime
+
+import pytest
+
+from search_export import SearchResultWriter, open_result_writer
+
+
+def test_writer_without_write_result_cannot_be_created(workdir):
+    class IncompleteWriter(SearchResultWriter):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteWriter(str(workdir / 'results.txt'))
+    assert not (workdir / 'results.txt').exists()
+
+
+def _project_result():
+    return {'path': '/work/app/lib/main.dart', 'name': 'main.dart', 'directory': '/work/app/lib',
+            'size': 12, 'modified': datetime(2026, 1, 2, 3, 4, 5), 'project': 'app',
+            'text_matches': [{'line_number': 3, 'line_text': 'TODO: fix', 'match_start': 0,
+                              'match_end': 4, 'match_text': 'TODO'}]}
+
+
+def test_exports_keep_the_project_label(workdir):
+    for name in ('results.csv', 'results.grep', 'results.txt'):
+        with open_result_writer(str(workdir / name)) as writer:
+            writer.write(_project_result())
+
+    with open(workdir / 'results.csv', newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['project'], row['line_number']) for row in rows] == [('app', '3')]
+    assert (workdir / 'results.grep').read_text(encoding='utf-8') == \
+        "[app] /work/app/lib/main.dart:3:TODO: fix\n"
+    assert "Проект: app\n" in (workdir / 'results.txt').read_text(encoding='utf-8')
@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+
+import search_manager
+from search_manager import CompiledSearchQuery, SearchManager, build_search_query, compile_search_query
+
+
+def _names(results):
+    return sorted(result['name'] for result in results)
+
+
+def _all_files(root):
+    return [os.path.join(directory, name) for directory, _, files in os.walk(root) for name in files]
+
+
+def test_glob_filename_query_is_anchored_with_and_without_index(project):
+    (project / 'lib' / 'domain.dart').write_text("class Domain {}\n")
+    (project / 'lib' / 'main_screen.dart').write_text("class MainScreen {}\n")
+    query = build_search_query('main*', filename_only=True)
+
+    walked = SearchManager().run_query([str(project)], query)
+
+    indexed_manager = SearchManager()
+    indexed_manager.update_filename_index(str(project), _all_files(project))
+    indexed = indexed_manager.run_query([str(project)], query)
+
+    assert _names(walked) == ['main.dart', 'main_screen.dart']
+    assert _names(indexed) == _names(walked)
+
+
+def test_index_saved_in_an_earlier_session_does_not_replace_the_walk(project, workdir):
+    indexes_dir = str(workdir / 'search_indexes')
+    SearchManager(indexes_dir).update_filename_index(str(project), _all_files(project))
+    (project / 'lib' / 'settings.dart').write_text("class Settings {}\n")
+    query = build_search_query('settings', filename_only=True)
+
+    manager = SearchManager(indexes_dir)
+    assert manager.get_filename_index(str(project)) is not None
+    assert _names(manager.run_query([str(project)], query)) == ['settings.dart']
+
+    # Once refreshed in this session, the index serves the query
+    manager.update_filename_index(str(project), _all_files(project))
+    assert _names(manager.run_query([str(project)], query)) == ['settings.dart']
+
+
+def test_compiled_query_survives_a_cache_round_trip():
+    name_query = build_search_query('main*', filename_only=True)
+    text_query = build_search_query('run\\w+', use_regex=True)
+
+    restored_name = CompiledSearchQuery.from_cache(json.loads(json.dumps(name_query.to_cache())))
+    restored_text = CompiledSearchQuery.from_cache(json.loads(json.dumps(text_query.to_cache())))
+
+    assert restored_name.match_name('main_screen.dart')
+    assert not restored_name.match_name('domain.dart')
+    manager = SearchManager()
+    content = b"void main() {\n  runApp(App());\n}\n"
+    assert manager.match_content(content, 'utf-8', restored_text) == \
+        manager.match_content(content, 'utf-8', text_query)
+    assert [m['match_text'] for m in manager.match_content(content, 'utf-8', restored_text)] == ['runApp']
+
+
+def test_cache_of_an_older_version_is_discarded():
+    data = build_search_query('main*', filename_only=True).to_cache()
+    data['version'] = CompiledSearchQuery.CACHE_VERSION - 1
+    assert CompiledSearchQuery.from_cache(data) is None
+
+
+def test_regex_match_does_not_cross_a_newline():
+    manager = SearchManager()
+    content = b"alpha\nbeta\nalpha  beta\nab\nag done\n"
+
+    spaced = manager.match_content(content, 'utf-8', build_search_query(r'alpha\s+beta', use_regex=True))
+    assert [(m['line_number'], m['match_text']) for m in spaced] == [(3, 'alpha  beta')]
+
+    negated = manager.match_content(content, 'utf-8', build_search_query('a[^z]*g', use_regex=True))
+    assert [(m['line_number'], m['match_text']) for m in negated] == [(5, 'ag')]
+    for match in negated:
+        assert match['match_end'] <= len(match['line_text'])
+
+
+def test_file_encoding_is_detected_once_and_binary_files_are_skipped(workdir):
+    manager = SearchManager()
+    cp1251 = workdir / 'legacy.txt'
+    cp1251.write_bytes("// Привет, мир\nTODO: перевод\n".encode('cp1251'))
+    binary = workdir / 'image.bin'
+    binary.write_bytes(b"\x89PNG\x00\x00todo")
+
+    matches = manager.search_text_in_file(str(cp1251), 'todo')
+    assert [(m['line_number'], m['line_text']) for m in matches] == [(2, 'TODO: перевод')]
+    assert manager.search_text_in_file(str(cp1251), 'мир')[0]['match_start'] == 11
+    assert manager.search_text_in_file(str(binary), 'todo') == []
+
+
+def test_cancelled_search_stays_cancelled_when_the_next_search_starts(project):
+    manager = SearchManager()
+    query = build_search_query('*', filename_only=True)
+    cancel_event = threading.Event()
+    cancelled_search = manager.iter_query([str(project)], query, cancel_event=cancel_event)
+    assert next(cancelled_search) is not None
+
+    cancel_event.set()
+    next_results = manager.run_query([str(project)], query)
+
+    assert list(cancelled_search) == []
+    assert len(next_results) == 3
+    assert manager.search_results is next_results
+
+
+def _make_projects(workdir):
+    roots = {}
+    for name, count in (('small', 1), ('large', 4)):
+        root = workdir / name
+        (root / 'lib').mkdir(parents=True)
+        for i in range(count):
+            (root / 'lib' / f'file{i}.dart').write_text("// TODO: fix\n")
+        roots[name] = str(root)
+    return roots
+
+
+def test_search_projects_limits_and_truncation_per_project(workdir):
+    roots = _make_projects(workdir)
+    nested = os.path.join(roots['large'], 'lib')
+    manager = SearchManager()
+    query = build_search_query('TODO')
+
+    results = manager.search_projects([roots['small'], roots['large'], nested], query,
+                                      max_results=2, time_budget=60)
+
+    assert sorted(result['project'] for result in results) == ['large', 'large', 'small']
+    assert manager.truncated_projects == {os.path.realpath(roots['large']): 'max_files'}
+    assert manager.search_truncated == 'max_files'
+
+
+def test_search_projects_time_budget_stops_every_project(workdir):
+    roots = _make_projects(workdir)
+    manager = SearchManager()
+
+    results = manager.search_projects(list(roots.values()), build_search_query('TODO'),
+                                      time_budget=1e-9)
+
+    assert results == []
+    assert set(manager.truncated_projects.values()) == {'time_budget'}
+
+
+def test_search_walks_the_tree_once_and_reports_estimated_progress(workdir, monkeypatch):
+    root = workdir / 'big'
+    for folder in range(4):
+        (root / f'dir{folder}').mkdir(parents=True)
+        for i in range(30):
+            (root / f'dir{folder}' / f'file{i}.txt').write_text("text\n")
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(os, 'walk', lambda *args, **kwargs: walks.append(args) or walk(*args, **kwargs))
+    manager = SearchManager()
+    reports = []
+
+    results = manager.search_files([str(root)], progress_callback=lambda *report: reports.append(report))
+
+    assert len(results) == 120 and len(walks) == 1
+    percents = [percent for percent, _ in reports]
+    assert percents[-1] == 100 and all(0 < percent < 100 for percent in percents[:-1])
+    # The next run over the same roots estimates from the previous file count
+    reports.clear()
+    manager.search_files([str(root)], progress_callback=lambda *report: reports.append(report))
+    assert reports[0] == (50 / 120 * 100, "Обработано файлов: 50 из ~120")
+
+
+def test_identical_queries_are_compiled_once_and_filter_names_and_directories(project):
+    (project / 'build').mkdir()
+    (project / 'build' / 'main.dart').write_text("void main() {}\n")
+    (project / 'lib' / 'notes.txt').write_text("main\n")
+    query = compile_search_query(["*.dart", "*.yaml"], "main", file_extensions=[".dart"])
+
+    assert compile_search_query(("*.dart", "*.yaml"), "main", file_extensions=(".dart",)) is query
+    assert compile_search_query(["*.dart"], "main") is not query
+    assert query.match_name('main.dart') and not query.match_name('pubspec.yaml')
+    assert query.is_excluded_dir('build') and query.is_excluded_dir('.git')
+    assert compile_search_query(exclude_dirs=['gen*']).is_excluded_dir('generated')
+
+    results = SearchManager().run_query([str(project)], query)
+    assert [os.path.relpath(result['path'], project) for result in results] == [os.path.join('lib', 'main.dart')]
+
+
+def _make_files(root, count, text="needle\n"):
+    root.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        (root / f'file{i:02}.txt').write_text(text)
+
+
+def test_cursor_pages_continue_the_walk_without_repeating_results(workdir):
+    _make_files(workdir / 'files', 25)
+    manager = SearchManager()
+    query = build_search_query('needle')
+    full = sorted(result['path'] for result in manager.run_query([str(workdir / 'files')], query))
+
+    cursor = manager.open_cursor([str(workdir / 'files')], query)
+    pages = []
+    while cursor.has_more:
+        pages.append(cursor.next_page(page_size=10))
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sorted(result['path'] for page in pages for result in page) == full
+    assert cursor.returned == 25 and cursor.truncated is None
+    assert cursor.next_page() == []
+
+
+def test_search_limits_stop_early_and_record_the_reason(workdir):
+    _make_files(workdir / 'files', 10, text="needle\n" * 5)
+    manager = SearchManager()
+    directories = [str(workdir / 'files')]
+    query = build_search_query('needle')
+
+    cursor = manager.open_cursor(directories, query, max_files=4)
+    assert len(cursor.next_page(page_size=10)) == 4
+    assert not cursor.has_more and cursor.truncated == 'max_files'
+
+    results = manager.run_query(directories, query, max_matches_per_file=2)
+    assert len(results) == 10 and all(len(result['text_matches']) == 2 for result in results)
+    assert manager.search_truncated is None
+
+    results = manager.run_query(directories, query, max_total_matches=12)
+    assert [len(result['text_matches']) for result in results] == [5, 5, 2]
+    assert manager.search_truncated == 'max_total_matches'
+
+
+def test_search_in_files_applies_one_query_schema_to_names_or_contents(project):
+    (project / 'lib' / 'app.dart').write_text("// main entry is elsewhere\n")
+    (project / 'generated').mkdir()
+    (project / 'generated' / 'main.g.dart').write_text("// main\n")
+    manager = SearchManager()
+
+    by_name = manager.search_in_files('MAIN', str(project), filename_only=True, exclude_patterns=['gen*'])
+    assert _names(by_name) == ['main.dart']
+    assert all(result['text_matches'] == [] for result in by_name)
+
+    by_content = manager.search_in_files('main', [str(project)], file_patterns=['*.dart'],
+                                         exclude_patterns=['gen*'])
+    assert _names(by_content) == ['app.dart', 'main.dart']
+    assert manager.search_in_files('MAIN', str(project), case_sensitive=True) == []
+    assert _names(manager.search_in_files(r'^main\..*dart$', str(project), filename_only=True,
+                                          use_regex=True)) == ['main.dart', 'main.g.dart']
+
+
+def test_batch_search_matches_separate_searches_and_reads_each_file_once(project, monkeypatch):
+    (project / 'build').mkdir()
+    (project / 'build' / 'app.dart').write_text("runApp(App());\n")
+    queries = [build_search_query('runApp', file_patterns=['*.dart']),
+               build_search_query('class', exclude_patterns=['widgets']),
+               build_search_query('pub*', filename_only=True),
+               build_search_query('App', exclude_patterns=[])]
+    manager = SearchManager()
+    separate = [_names(manager.run_query([str(project)], query)) for query in queries]
+
+    opened = []
+    monkeypatch.setattr(search_manager, 'open', lambda path, *args: opened.append(path) or open(path, *args),
+                        raising=False)
+    batch = manager.search_batch([str(project)], queries)
+
+    assert [_names(results) for results in batch] == separate
+    assert separate[3] == ['app.dart', 'main.dart']
+    assert sorted(map(os.path.basename, opened)) == ['app.dart', 'button.dart', 'main.dart', 'pubspec.yaml']
@@ -0,0 +1,42 @@
+import json
+import os
+
+from search_manager import SearchManager
+from search_recipes_manager import SearchRecipesManager
+
+
+def test_legacy_recipes_file_is_moved_into_the_database(workdir):
+    recipe = {"name": "Widgets", "description": "", "query": "Widget",
+              "file_patterns": ["*.dart"], "exclude_patterns": []}
+    (workdir / SearchRecipesManager.LEGACY_RECIPES_FILE).write_text(json.dumps({"recipes": [recipe]}))
+
+    manager = SearchRecipesManager()
+
+    assert [recipe['name'] for recipe in manager.get_recipes()] == ['Widgets']
+    assert not os.path.exists(SearchRecipesManager.LEGACY_RECIPES_FILE)
+    assert os.path.exists(SearchRecipesManager.LEGACY_RECIPES_FILE + ".bak")
+    # A second start reads the database only
+    assert [recipe['name'] for recipe in SearchRecipesManager().get_recipes()] == ['Widgets']
+
+
+def test_compiled_recipe_query_is_reused_from_the_database(project):
+    manager = SearchRecipesManager()
+    assert manager.add_recipe("Runs", "", "runApp", file_patterns=["*.dart"])
+    index = len(manager.get_recipes()) - 1
+    recipe_id = manager.get_recipe(index)['id']
+    compiled = manager.get_compiled_query(index)
+    assert manager.db_manager.get_search_recipe_compiled(recipe_id) == compiled.to_cache()
+
+    # Another instance, as after a restart, loads the cached query instead of compiling
+    restarted = SearchRecipesManager()
+    cached = restarted.get_compiled_query(index)
+    assert cached is not compiled and cached.to_cache() == compiled.to_cache()
+    (run,) = restarted.run_recipes(SearchManager(), [str(project)], [index])
+    assert [result['name'] for result in run['results']] == ['main.dart']
+    assert restarted.get_recipe(index)['usage_count'] == 1
+
+    # Editing the recipe drops the cached query
+    assert restarted.update_recipe(index, "Buttons", "", "Button", file_patterns=["*.dart"])
+    (run,) = restarted.run_recipes(SearchManager(), [str(project)], [index])
+    assert [result['name'] for result in run['results']] == ['button.dart']
+    assert SearchRecipesManager().get_compiled_query(index).text_pattern == "Button"
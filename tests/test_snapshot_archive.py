@@ -0,0 +1,91 @@
+import os
+import zipfile
+
+import pytest
+
+from snapshot_archive import (DEFAULT_CODEC, ParallelZipWriter, available_codecs, codec_for_path,
+                              get_codec, is_compressed_content)
+
+
+def _write_sources(root, files):
+    root.mkdir()
+    for name, data in files.items():
+        (root / name).write_bytes(data)
+    return [(str(root / name), name) for name in files]
+
+
+SOURCES = {
+    'main.dart': b"void main() {}\n" * 2000,
+    'имя.dart': "класс\n".encode('utf-8') * 500,
+    'logo.png': b'\x89PNG' + os.urandom(20000),
+    'empty.txt': b'',
+}
+
+
+def test_parallel_zip_round_trip(workdir):
+    files = _write_sources(workdir / 'src', SOURCES)
+    writer = ParallelZipWriter('out.zip', workers=2)
+    writer.write_files(files)
+
+    with zipfile.ZipFile('out.zip') as archive:
+        assert archive.testzip() is None
+        assert {name: archive.read(name) for name in SOURCES} == SOURCES
+        assert archive.getinfo('logo.png').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('main.dart').compress_type == zipfile.ZIP_DEFLATED
+    assert writer.stored_members == 1
+
+
+def test_parallel_zip_writes_zip64_records(workdir):
+    files = _write_sources(workdir / 'src', SOURCES)
+    writer = ParallelZipWriter('out.zip', workers=2)
+    # Every size and offset above the limit takes the ZIP64 paths
+    writer.ZIP64_LIMIT = 16
+    writer.write_files(files)
+
+    with zipfile.ZipFile('out.zip') as archive:
+        assert archive.testzip() is None
+        assert {name: archive.read(name) for name in SOURCES} == SOURCES
+
+
+def test_stored_member_changed_after_compression_gets_its_crc(workdir):
+    files = _write_sources(workdir / 'src', {'photo.jpg': b'\xff\xd8\xff' + b'a' * 5000})
+    writer = ParallelZipWriter('out.zip', workers=1)
+    member = writer._compress_member(*files[0])
+    changed = b'\xff\xd8\xff' + b'b' * 7000
+    (workdir / 'src' / 'photo.jpg').write_bytes(changed)
+
+    with open('out.zip', 'wb') as archive:
+        writer._append_member(archive, member)
+        writer._write_central_directory(archive)
+
+    with zipfile.ZipFile('out.zip') as archive:
+        assert archive.testzip() is None
+        assert archive.read('photo.jpg') == changed
+
+
+def test_riff_is_compressed_only_for_webp():
+    assert is_compressed_content('image', b'RIFF\x00\x00\x00\x00WEBPVP8 ')
+    assert not is_compressed_content('sound', b'RIFF\x00\x00\x00\x00WAVEfmt ')
+    assert not is_compressed_content('movie', b'RIFF\x00\x00\x00\x00AVI LIST')
+
+
+@pytest.mark.parametrize('name', available_codecs())
+def test_every_available_codec_round_trips(workdir, name):
+    files = _write_sources(workdir / 'src', SOURCES)
+    codec = get_codec(name)
+    archive_path = str(workdir / ('out' + codec.extension))
+    codec.create(archive_path, files, level=1, workers=2)
+
+    assert codec_for_path(archive_path).extension == codec.extension
+    assert sorted(entry['path'] for entry in codec.list_members(archive_path)) == sorted(SOURCES)
+    with codec.open_member(archive_path, 'имя.dart') as stream:
+        assert stream.read() == SOURCES['имя.dart']
+    codec.extract(archive_path, str(workdir / 'restored'))
+    assert {name: (workdir / 'restored' / name).read_bytes() for name in SOURCES} == SOURCES
+
+
+def test_unknown_codecs_and_paths_are_rejected():
+    with pytest.raises(ValueError):
+        get_codec('rar')
+    assert codec_for_path('snapshots/notes.txt') is None
+    assert codec_for_path('snapshots/a.zip') is get_codec(DEFAULT_CODEC)
@@ -0,0 +1,333 @@
+import os
+import zipfile
+
+import pytest
+
+import snapshot_manager
+from snapshot_manager import SnapshotManager
+from snapshot_store import SnapshotManifest
+from snapshot_verify import VERIFY_CORRUPT, VERIFY_OK
+
+
+def test_incremental_snapshot_with_the_parent_name_keeps_the_parent(project):
+    manager = SnapshotManager()
+    assert manager.create_snapshot(str(project), 'nightly', storage='dedup')
+    parent_id = manager.last_snapshot_id
+    (project / 'lib' / 'main.dart').write_text("void main() {}\n")
+
+    # The GUI reuses the typed name and builds on the latest snapshot of the source
+    parent = manager.find_latest_snapshot(str(project))['id']
+    assert manager.create_snapshot(str(project), 'nightly', parent=parent)
+    child_id = manager.last_snapshot_id
+
+    assert manager.get_snapshot(parent_id) is not None
+    assert manager.get_snapshot(child_id)['parent_id'] == parent_id
+    comparison = manager.compare_snapshots(parent_id, child_id)
+    assert [item['rel_path'] for item in comparison['differences']['modified']] == ['lib/main.dart']
+
+
+def test_file_changed_during_a_dedup_snapshot_is_stored_consistently(project, workdir, monkeypatch):
+    main = project / 'lib' / 'main.dart'
+    scan_file = snapshot_manager.scan_file
+
+    def scan_then_edit(file_path):
+        info = scan_file(file_path)
+        if file_path == str(main):
+            main.write_text("void main() => print('edited');\n")
+        return info
+
+    monkeypatch.setattr(snapshot_manager, 'scan_file', scan_then_edit)
+    manager = SnapshotManager()
+    manifest_path = manager.create_snapshot(str(project), 'changing', storage='dedup')
+
+    assert manager.verify_snapshot(manager.last_snapshot_id)['status'] == VERIFY_OK
+    entry = SnapshotManifest.load(manifest_path).files['lib/main.dart']
+    assert entry['size'] == len(main.read_bytes()) and entry['lines'] == 1
+    assert manager.restore_snapshot(manifest_path, str(workdir / 'restored'))
+    assert (workdir / 'restored' / 'lib' / 'main.dart').read_text() == main.read_text()
+
+
+def test_snapshots_created_in_the_same_second_get_separate_paths(project):
+    manager = SnapshotManager()
+    first = manager.create_snapshot(str(project), 'quick')
+    second = manager.create_snapshot(str(project), 'quick')
+
+    assert first != second
+    assert os.path.exists(first) and os.path.exists(second)
+
+
+def test_collect_garbage_uses_records_and_removes_orphans(project):
+    manager = SnapshotManager()
+    kept = manager.create_snapshot(str(project), 'kept', storage='dedup')
+    (project / 'lib' / 'extra.dart').write_text("class Extra {}\n")
+    orphan = manager.create_snapshot(str(project), 'orphan', storage='dedup')
+    archive = manager.create_snapshot(str(project), 'archive')
+    # Records lost without their files, as replaced names used to leave them
+    for snapshot in manager.db_manager.get_snapshots():
+        if snapshot['name'] in ('orphan', 'archive'):
+            manager.db_manager.delete_snapshot(snapshot['id'])
+
+    report = manager.get_space_report()
+    extra_blob = len("class Extra {}\n")
+    assert report['garbage_bytes'] == extra_blob
+    assert report['orphaned_bytes'] > 0
+
+    stats = manager.collect_garbage(max_age=0)
+    assert stats['objects_removed'] == 1
+    assert stats['orphans_removed'] == 3  # dedup manifest, archive and its sidecar manifest
+    assert not os.path.exists(orphan) and not os.path.exists(archive)
+    assert os.path.exists(kept)
+
+    report = manager.get_space_report()
+    assert report['garbage_bytes'] == 0 and report['orphaned_bytes'] == 0
+    assert manager.restore_snapshot(kept, 'restored')
+
+
+def test_collect_garbage_keeps_recent_orphans(project):
+    manager = SnapshotManager()
+    archive = manager.create_snapshot(str(project), 'recent')
+    manager.db_manager.delete_snapshot(manager.last_snapshot_id)
+
+    assert manager.collect_garbage()['orphans_removed'] == 0
+    assert os.path.exists(archive)
+
+
+def test_retention_keeps_last_snapshots_with_the_same_name(project):
+    manager = SnapshotManager()
+    paths = [manager.create_snapshot(str(project), 'daily', storage='dedup') for _ in range(3)]
+    ids = [snapshot['id'] for snapshot in manager.list_snapshots()]
+
+    result = manager.apply_retention(keep_last=2)
+
+    assert result['deleted'] == [min(ids)]
+    assert not os.path.exists(paths[0])
+    assert all(os.path.exists(path) for path in paths[1:])
+
+
+def test_failed_copy_snapshot_leaves_no_partial_directory(project):
+    # A dangling link cannot be copied, so copytree fails after copying other files
+    os.symlink(str(project / 'missing.dart'), str(project / 'lib' / 'broken.dart'))
+    manager = SnapshotManager()
+
+    assert manager.create_snapshot(str(project), 'copy', compress=False) is None
+    assert os.listdir(manager.snapshots_dir) == ['objects']
+    assert manager.list_snapshots() == []
+
+
+SNAPSHOT_KINDS = [
+    {'codec': 'zip-deflate'},
+    {'codec': 'tar-gz'},
+    {'storage': 'dedup'},
+    {'compress': False},
+]
+
+
+@pytest.mark.parametrize('options', SNAPSHOT_KINDS, ids=lambda options: next(iter(options.values())))
+def test_snapshot_files_are_listed_opened_and_extracted_selectively(project, workdir, options):
+    manager = SnapshotManager()
+    assert manager.create_snapshot(str(project), 'subset', **options)
+    snapshot_id = manager.last_snapshot_id
+
+    paths = sorted(entry['path'] for entry in manager.list_snapshot_files(snapshot_id))
+    assert paths == ['lib/main.dart', 'lib/widgets/button.dart', 'pubspec.yaml']
+    with manager.open_snapshot_file(snapshot_id, 'lib/widgets/button.dart') as stream:
+        assert stream.read() == b"class Button {}\n"
+
+    assert manager.extract_snapshot_files(snapshot_id, 'extracted', ['lib/*'])
+    extracted = sorted(os.path.relpath(os.path.join(root, name), 'extracted').replace(os.sep, '/')
+                       for root, _, files in os.walk(workdir / 'extracted') for name in files)
+    assert extracted == ['lib/main.dart', 'lib/widgets/button.dart']
+
+
+def _flip_byte(path, offset):
+    os.chmod(path, 0o644)
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+@pytest.mark.parametrize('options', SNAPSHOT_KINDS, ids=lambda options: next(iter(options.values())))
+def test_verification_detects_corrupted_snapshots(project, options):
+    (project / 'lib' / 'data.dart').write_text("const data = [\n" + "  42,\n" * 5000 + "];\n")
+    manager = SnapshotManager()
+    snapshot_path = manager.create_snapshot(str(project), 'verified', **options)
+    snapshot_id = manager.last_snapshot_id
+    assert manager.verify_snapshot(snapshot_id)['status'] == VERIFY_OK
+
+    if SnapshotManifest.is_manifest(snapshot_path):
+        entry = SnapshotManifest.load(snapshot_path).files['lib/data.dart']
+        _flip_byte(manager.store.object_path(entry['hash']), 100)
+    elif os.path.isdir(snapshot_path):
+        _flip_byte(os.path.join(snapshot_path, 'lib', 'data.dart'), 100)
+    elif zipfile.is_zipfile(snapshot_path):
+        with zipfile.ZipFile(snapshot_path) as archive:
+            info = archive.getinfo('lib/data.dart')
+        # Middle of the member data, after the 30-byte local header and the name
+        _flip_byte(snapshot_path, info.header_offset + 30 + len(info.filename) + info.compress_size // 2)
+    else:
+        _flip_byte(snapshot_path, os.path.getsize(snapshot_path) // 3)
+
+    result = manager.verify_snapshot(snapshot_id)
+    assert result['status'] == VERIFY_CORRUPT
+    recorded = manager.get_snapshot(snapshot_id)
+    assert recorded['verify_status'] == VERIFY_CORRUPT and recorded['last_verified']
+
+
+def test_scrub_skips_recently_verified_snapshots(project):
+    manager = SnapshotManager()
+    manager.create_snapshot(str(project), 'scrubbed', storage='dedup')
+    assert list(manager.scrub_snapshots()) == [manager.last_snapshot_id]
+    assert manager.scrub_snapshots() == {}
+
+
+def _comparison_shape(comparison):
+    """Keys of a comparison and of its items, with the paths left out"""
+    return {
+        'keys': sorted(comparison),
+        'stats': [sorted(comparison[side]['stats']) for side in ('project1', 'project2')],
+        'differences': {bucket: sorted((item['name'], item['type'], item.get('parent'), tuple(sorted(item)))
+                                       for item in items)
+                        for bucket, items in comparison['differences'].items()}
+    }
+
+
+def test_compare_with_snapshot_returns_the_same_shape_with_and_without_a_manifest(project):
+    manager = SnapshotManager()
+    archive = manager.create_snapshot(str(project), 'base')
+    snapshot_id = manager.last_snapshot_id
+    (project / 'lib' / 'main.dart').write_text("void main() {}\n")
+    (project / 'lib' / 'widgets' / 'card.dart').write_text("class Card {}\n")
+    (project / 'pubspec.yaml').unlink()
+
+    from_manifest = manager.compare_with_snapshot(str(project), snapshot_id)
+    os.remove(SnapshotManifest.manifest_path(archive))
+    extracted = manager.compare_with_snapshot(str(project), snapshot_id)
+
+    assert _comparison_shape(from_manifest) == _comparison_shape(extracted)
+    assert [item['name'] for item in from_manifest['differences']['modified']] == ['main.dart']
+    assert [item['name'] for item in from_manifest['differences']['added']] == ['card.dart']
+    assert [item['name'] for item in from_manifest['differences']['removed']] == ['pubspec.yaml']
+    assert from_manifest['project1']['stats']['folders'] == extracted['project1']['stats']['folders']
+    assert from_manifest['project2']['stats']['lines'] == extracted['project2']['stats']['lines']
+
+
+@pytest.mark.parametrize('codec', ['zip-deflate', 'zip-bzip2', 'zip-stored', 'tar-gz'])
+def test_compressed_snapshot_manifest_hashes_the_archived_content(project, codec):
+    manager = SnapshotManager()
+    archive = manager.create_snapshot(str(project), codec, codec=codec)
+
+    manifest = SnapshotManifest.load(SnapshotManifest.manifest_path(archive))
+    assert sorted(manifest.files) == ['lib/main.dart', 'lib/widgets/button.dart', 'pubspec.yaml']
+    assert manifest.files['lib/main.dart']['lines'] == 3
+    assert manager.verify_snapshot(manager.last_snapshot_id)['status'] == VERIFY_OK
+
+
+def test_codec_benchmark_reports_every_requested_codec(project):
+    results = SnapshotManager().benchmark_codecs(str(project), ['zip-deflate', 'tar-gz'])
+
+    assert [result['codec'] for result in results] == ['zip-deflate', 'tar-gz']
+    original_size = sum(len(path.read_bytes()) for path in project.rglob('*') if path.is_file())
+    assert all(result['original_size'] == original_size and result['archive_size'] > 0 for result in results)
+
+
+def test_compare_snapshots_reports_renames_from_content_hashes(project):
+    manager = SnapshotManager()
+    manager.create_snapshot(str(project), 'before', storage='dedup')
+    before = manager.last_snapshot_id
+    (project / 'lib' / 'widgets' / 'button.dart').rename(project / 'lib' / 'button.dart')
+    (project / 'lib' / 'main.dart').write_text("void main() {\n  runApp(Demo());\n}\n")
+    (project / 'README.md').write_text("# Demo\n")
+    # Archives are compared through their sidecar manifests
+    manager.create_snapshot(str(project), 'after', codec='tar-gz')
+    after = manager.last_snapshot_id
+
+    comparison = manager.compare_snapshots(before, after)
+    differences = comparison['differences']
+    assert differences['renamed'] == [{'rel_path1': 'lib/widgets/button.dart', 'rel_path2': 'lib/button.dart',
+                                       'size': len("class Button {}\n")}]
+    assert [item['rel_path'] for item in differences['added']] == ['README.md']
+    assert differences['removed'] == []
+    assert [item['rel_path'] for item in differences['modified']] == ['lib/main.dart']
+    assert [item['rel_path'] for item in differences['unchanged']] == ['pubspec.yaml']
+    assert comparison['stats']['bytes_added'] == len("# Demo\n")
+    assert comparison['stats']['lines_change'] == 1
+
+    diff = manager.get_snapshots_file_diff(before, after, 'lib/main.dart')
+    assert '-  runApp(App());\n' in diff and '+  runApp(Demo());\n' in diff
+
+
+@pytest.mark.parametrize('options', SNAPSHOT_KINDS + [{'codec': 'tar-xz'}],
+                         ids=lambda options: next(iter(options.values())))
+def test_parallel_restore_keeps_contents_and_mtimes(project, workdir, options):
+    (project / 'assets').mkdir()
+    (project / 'assets' / 'logo.bin').write_bytes(os.urandom(300000))
+    sources = [path for path in project.rglob('*') if path.is_file()]
+    for age, path in enumerate(sources):
+        os.utime(path, (1600000000 + age * 60,) * 2)
+    manager = SnapshotManager()
+    manager.restore_workers = 3
+    snapshot_path = manager.create_snapshot(str(project), 'restored', **options)
+    reports = []
+
+    assert manager.restore_snapshot(snapshot_path, str(workdir / 'out'),
+                                    progress_callback=lambda *report: reports.append(report))
+
+    for path in sources:
+        restored = workdir / 'out' / path.relative_to(project)
+        assert restored.read_bytes() == path.read_bytes()
+        assert int(restored.stat().st_mtime) == int(path.stat().st_mtime)
+    assert manager.last_restore_stats['files'] == len(sources)
+    assert manager.last_restore_stats['bytes'] == sum(path.stat().st_size for path in sources)
+    assert reports[-1] == (100, f"Restored {len(sources)} of {len(sources)} files (0.3 MB)")
+
+
+def test_hardlink_restore_links_dedup_blobs_and_copies_other_snapshots(project, workdir):
+    manager = SnapshotManager()
+    manifest_path = manager.create_snapshot(str(project), 'linked', storage='dedup')
+    blob = manager.store.object_path(SnapshotManifest.load(manifest_path).files['lib/main.dart']['hash'])
+
+    assert manager.restore_snapshot(manifest_path, str(workdir / 'linked'), copy_mode='hardlink')
+    assert os.path.samefile(workdir / 'linked' / 'lib' / 'main.dart', blob)
+    assert manager.last_restore_stats['copy_methods'] == {'hardlink': 3}
+
+    copied = manager.create_snapshot(str(project), 'copied', compress=False)
+    assert manager.restore_snapshot(copied, str(workdir / 'copied'), compressed=False, copy_mode='hardlink')
+    assert not os.path.samefile(workdir / 'copied' / 'lib' / 'main.dart', os.path.join(copied, 'lib', 'main.dart'))
+    assert 'hardlink' not in manager.last_restore_stats['copy_methods']
+
+
+def test_daily_and_weekly_rules_keep_the_newest_snapshot_of_each_period():
+    dates = ['2024-03-04T09:00:00', '2024-03-04T18:00:00', '2024-03-05T10:00:00',
+             '2024-03-11T10:00:00', '2024-03-12T08:00:00', '2024-03-12T20:00:00']
+    snapshots = [{'id': i, 'created_date': date} for i, date in enumerate(dates, 1)]
+
+    assert SnapshotManager.select_retained_snapshots(snapshots, keep_daily=2) == {4, 6}
+    assert SnapshotManager.select_retained_snapshots(snapshots, keep_daily=3) == {3, 4, 6}
+    assert SnapshotManager.select_retained_snapshots(snapshots, keep_weekly=2) == {3, 6}
+    assert SnapshotManager.select_retained_snapshots(snapshots, keep_last=1, keep_weekly=2) == {3, 6}
+    assert SnapshotManager.select_retained_snapshots(snapshots) == set(range(1, 7))
+
+
+def test_size_bound_retention_frees_what_the_dry_run_estimates(project):
+    manager = SnapshotManager()
+    ids = []
+    for version in range(3):
+        (project / 'lib' / 'data.dart').write_bytes(os.urandom(20000))
+        manager.create_snapshot(str(project), 'sized', storage='dedup')
+        ids.append(manager.last_snapshot_id)
+
+    report = {item['id']: item for item in manager.get_space_report()['snapshots']}
+    # Only data.dart differs between the snapshots, the other files are shared
+    assert all(report[i]['physical_bytes'] == 20000 for i in ids)
+    assert all(report[i]['shared_bytes'] == report[ids[0]]['logical_bytes'] - 20000 for i in ids)
+
+    estimate = manager.apply_retention(max_bytes=0, dry_run=True)
+    assert estimate['deleted'] == ids[:2] and estimate['kept'] == ids[2:]
+    assert manager.get_space_report()['store_bytes'] > 0 and len(manager.list_snapshots()) == 3
+
+    result = manager.apply_retention(max_bytes=0)
+    assert result == estimate
+    assert [snapshot['id'] for snapshot in manager.list_snapshots()] == ids[2:]
+    assert manager.get_space_report()['garbage_bytes'] == 0
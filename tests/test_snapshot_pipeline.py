@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+import snapshot_pipeline
+from snapshot_manager import SnapshotManager
+from snapshot_pipeline import SnapshotPipeline, SnapshotProgress
+
+
+def test_tree_is_walked_once_and_totals_are_published_after_the_walk(project, monkeypatch):
+    walks = []
+    iter_source_files = snapshot_pipeline.iter_source_files
+
+    def counting_walk(*args):
+        walks.append(args)
+        return iter_source_files(*args)
+
+    monkeypatch.setattr(snapshot_pipeline, 'iter_source_files', counting_walk)
+    reports = []
+    with SnapshotPipeline(str(project), progress_callback=lambda *report: reports.append(report)) as pipeline:
+        pipeline.PROGRESS_INTERVAL = 0
+        for _, _, size in pipeline.iter_files():
+            pipeline.advance(size)
+
+    assert len(walks) == 1
+    assert (pipeline.files_total, pipeline.bytes_done) == (3, pipeline.bytes_total)
+    percent, progress = reports[-1]
+    assert percent == 100 and isinstance(progress, SnapshotProgress)
+    assert str(progress) == f"Saved 3 files ({pipeline.bytes_done / (1024 * 1024):.1f} MB)"
+
+
+def test_progress_line_with_totals_and_eta():
+    progress = SnapshotProgress(2, 1024 * 1024, 4, 3 * 1024 * 1024, eta=75)
+    assert str(progress) == "Saved 2 of 4 files (1.0 of 3.0 MB), 1:15 left"
+
+
+@pytest.mark.parametrize('options', [{}, {'storage': 'dedup'}, {'compress': False}])
+def test_cancelled_snapshot_leaves_nothing_behind(project, options):
+    manager = SnapshotManager()
+
+    def cancel_on_first_report(percent, progress):
+        manager.cancel_snapshot()
+
+    assert manager.create_snapshot(str(project), 'cancelled', progress_callback=cancel_on_first_report,
+                                   **options) is None
+    assert manager.list_snapshots() == []
+    assert list(manager.store.iter_objects()) == []
+    for root, _, files in os.walk(manager.snapshots_dir):
+        assert files == [], root
@@ -0,0 +1,60 @@
+import hashlib
+import os
+
+import pytest
+
+from snapshot_store import COPY_AUTO, COPY_BYTES, COPY_HARDLINK, ObjectStore, copy_file_fast
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_identical_contents_are_stored_once(workdir):
+    store = ObjectStore(str(workdir / 'store'))
+    (workdir / 'a.txt').write_bytes(b"same\n")
+    (workdir / 'b.txt').write_bytes(b"same\n")
+
+    first = store.put_file(str(workdir / 'a.txt'))
+    second = store.put_file(str(workdir / 'b.txt'))
+
+    assert first == (_sha256(b"same\n"), True)
+    assert second == (_sha256(b"same\n"), False)
+    assert [digest for digest, _, _ in store.iter_objects()] == [_sha256(b"same\n")]
+
+
+def test_file_changed_after_hashing_is_stored_under_its_own_hash(workdir):
+    store = ObjectStore(str(workdir / 'store'))
+    source = workdir / 'main.dart'
+    source.write_bytes(b"old\n")
+    hint = store.hash_file(str(source))
+    source.write_bytes(b"new content\n")
+
+    digest, written = store.put_file(str(source), hint)
+
+    assert written and digest == _sha256(b"new content\n")
+    assert not store.has_object(hint)
+    with store.open_object(digest) as f:
+        assert f.read() == b"new content\n"
+    assert not [name for name in (workdir / 'store' / 'objects').iterdir() if name.name.startswith('.tmp-')]
+
+
+@pytest.mark.parametrize('mode', [COPY_AUTO, COPY_BYTES])
+def test_fast_copy_reports_the_method_used(workdir, mode):
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    (workdir / 'src.bin').write_bytes(data)
+
+    method = copy_file_fast(str(workdir / 'src.bin'), str(workdir / 'dst.bin'), mode)
+
+    assert method in ('reflink', 'copy_file_range', 'sendfile', 'copy')
+    assert (workdir / 'dst.bin').read_bytes() == data
+
+
+def test_hardlink_copy_shares_the_inode_and_unknown_modes_fail(workdir):
+    (workdir / 'src.txt').write_text("linked\n")
+    (workdir / 'dst.txt').write_text("old\n")
+
+    assert copy_file_fast(str(workdir / 'src.txt'), str(workdir / 'dst.txt'), COPY_HARDLINK) == COPY_HARDLINK
+    assert os.path.samefile(workdir / 'src.txt', workdir / 'dst.txt')
+    with pytest.raises(ValueError):
+        copy_file_fast(str(workdir / 'src.txt'), str(workdir / 'other.txt'), 'symlink')